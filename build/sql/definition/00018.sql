@@ -0,0 +1,31 @@
+-- Record the regions enabled for each audited account so that
+-- regional criteria only query regions the account has opted into
+CREATE TABLE IF NOT EXISTS account_region(
+    id SERIAL PRIMARY KEY,
+    account_subscription_id INTEGER NOT NULL,
+    region_name VARCHAR(50) NOT NULL,
+    enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    date_updated TIMESTAMP NOT NULL,
+    CONSTRAINT "account_region_account_subscription_id_fkey" FOREIGN KEY (account_subscription_id)
+      REFERENCES "account_subscription" (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE NO ACTION,
+    CONSTRAINT account_region_account_subscription_id_and_region_name UNIQUE (account_subscription_id, region_name)
+);
+
+-- Record how many resources each regional criterion found in each region
+-- so that regions without resources can be checked less often
+CREATE TABLE IF NOT EXISTS account_criterion_region(
+    id SERIAL PRIMARY KEY,
+    account_subscription_id INTEGER NOT NULL,
+    criterion_id INTEGER NOT NULL,
+    region_name VARCHAR(50) NOT NULL,
+    resources INTEGER NOT NULL DEFAULT 0,
+    date_checked TIMESTAMP NOT NULL,
+    CONSTRAINT "account_criterion_region_account_subscription_id_fkey" FOREIGN KEY (account_subscription_id)
+      REFERENCES "account_subscription" (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE NO ACTION,
+    CONSTRAINT "account_criterion_region_criterion_id_fkey" FOREIGN KEY (criterion_id)
+      REFERENCES "criterion" (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE NO ACTION,
+    CONSTRAINT account_criterion_region_unique UNIQUE (account_subscription_id, criterion_id, region_name)
+);
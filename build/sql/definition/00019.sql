@@ -0,0 +1,3 @@
+-- Count the criteria attempted for each audit so the audit stats can be
+-- incremented as each criterion completes instead of recalculated
+ALTER TABLE account_audit ADD COLUMN criteria_attempted INTEGER DEFAULT 0;
@@ -0,0 +1,30 @@
+-- Deterministic work keys so redelivered audit messages are idempotent
+
+-- Remove audit criteria duplicated by redelivered messages before
+-- making (account_audit_id, criterion_id) unique
+DELETE FROM audit_criterion duplicate
+USING audit_criterion original
+WHERE duplicate.account_audit_id = original.account_audit_id
+AND duplicate.criterion_id = original.criterion_id
+AND duplicate.id > original.id;
+
+ALTER TABLE audit_criterion
+ADD CONSTRAINT audit_criterion_account_audit_id_and_criterion_id UNIQUE (account_audit_id, criterion_id);
+
+-- Set once the audit criterion result has been added to the account_audit stats
+ALTER TABLE audit_criterion ADD COLUMN counted BOOLEAN DEFAULT FALSE;
+UPDATE audit_criterion SET counted = attempted;
+
+-- Checkpoint each region of an audit criterion once its resources are written
+CREATE TABLE IF NOT EXISTS audit_criterion_region(
+    id SERIAL PRIMARY KEY,
+    audit_criterion_id INTEGER NOT NULL,
+    region_name VARCHAR(50) NOT NULL,
+    check_passed BOOLEAN NOT NULL DEFAULT FALSE,
+    summary TEXT NULL,
+    date_completed TIMESTAMP NOT NULL,
+    CONSTRAINT "audit_criterion_region_audit_criterion_id_fkey" FOREIGN KEY (audit_criterion_id)
+      REFERENCES "audit_criterion" (id) MATCH SIMPLE
+      ON UPDATE NO ACTION ON DELETE NO ACTION,
+    CONSTRAINT audit_criterion_region_unique UNIQUE (audit_criterion_id, region_name)
+);
@@ -0,0 +1,5 @@
+-- Staggered scheduling with a run interval per criterion
+ALTER TABLE criterion ADD COLUMN audit_interval_hours INTEGER NULL;
+
+-- Partial audits only evaluate the criteria which were due
+ALTER TABLE account_audit ADD COLUMN partial BOOLEAN DEFAULT FALSE;
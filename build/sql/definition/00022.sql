@@ -0,0 +1,27 @@
+-- Delta audits: resources unchanged since the previous audit reference the
+-- audit_resource record holding their data instead of storing another copy
+ALTER TABLE audit_resource ALTER COLUMN resource_data DROP NOT NULL;
+ALTER TABLE audit_resource ADD COLUMN data_hash VARCHAR(64) NULL;
+ALTER TABLE audit_resource ADD COLUMN carried_from_id INTEGER NULL REFERENCES audit_resource(id);
+
+-- Previous evaluations are looked up by audit and criterion
+CREATE INDEX IF NOT EXISTS audit_resource_account_audit_id_criterion_id
+ON audit_resource (account_audit_id, criterion_id);
+
+-- Every audit resource with its data whether stored or carried forward
+CREATE OR REPLACE VIEW audit_resource_complete AS
+SELECT
+  ar.id,
+  ar.criterion_id,
+  ar.account_audit_id,
+  ar.region,
+  ar.resource_id,
+  ar.resource_name,
+  ar.resource_persistent_id,
+  COALESCE(ar.resource_data, origin.resource_data) AS resource_data,
+  ar.date_evaluated,
+  ar.data_hash,
+  ar.carried_from_id
+FROM audit_resource AS ar
+LEFT JOIN audit_resource AS origin
+ON ar.carried_from_id = origin.id;
@@ -0,0 +1,24 @@
+-- Compressed resource payloads stored apart from the audit_resource columns
+-- read by resource lists. Existing audit_resource.resource_data is moved here
+-- in batches by the database_compress_resource_data lambda.
+CREATE TABLE IF NOT EXISTS audit_resource_data(
+    audit_resource_id INTEGER PRIMARY KEY REFERENCES audit_resource(id),
+    data BYTEA NOT NULL
+);
+
+-- Point to the record holding the data rather than reading the payload
+DROP VIEW IF EXISTS audit_resource_complete;
+CREATE VIEW audit_resource_complete AS
+SELECT
+  ar.id,
+  ar.criterion_id,
+  ar.account_audit_id,
+  ar.region,
+  ar.resource_id,
+  ar.resource_name,
+  ar.resource_persistent_id,
+  ar.date_evaluated,
+  ar.data_hash,
+  ar.carried_from_id,
+  COALESCE(ar.carried_from_id, ar.id) AS data_audit_resource_id
+FROM audit_resource AS ar;
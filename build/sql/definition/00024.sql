@@ -0,0 +1,13 @@
+-- Time spent in each stage of processing an audit, recorded by the
+-- audit lambdas and summarised by /api/timing/summary
+CREATE TABLE IF NOT EXISTS audit_timing(
+    id SERIAL PRIMARY KEY,
+    account_audit_id INTEGER NOT NULL REFERENCES account_audit(id),
+    criterion_id INTEGER NULL REFERENCES criterion(id),
+    region VARCHAR(50) NULL,
+    stage VARCHAR(50) NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    date_recorded TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS audit_timing_date_recorded ON audit_timing (date_recorded);
@@ -0,0 +1,3 @@
+-- The number of regions an audit criterion was split into when each region
+-- is evaluated in its own message. NULL when evaluated in one message.
+ALTER TABLE audit_criterion ADD COLUMN regions_expected INTEGER NULL;
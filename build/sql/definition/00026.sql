@@ -0,0 +1,6 @@
+-- Set once the completed audit message has been sent so a failure
+-- after the audit is flagged finished is retried on redelivery
+ALTER TABLE account_audit ADD COLUMN completion_sent BOOLEAN DEFAULT FALSE;
+
+-- audits finished before this column existed have been sent
+UPDATE account_audit SET completion_sent = TRUE WHERE finished = TRUE;
@@ -0,0 +1,3 @@
+-- The audit criterion of an earlier audit whose results were copied into
+-- a partial audit for a criterion the partial audit did not evaluate
+ALTER TABLE audit_criterion ADD COLUMN carried_from_id INTEGER NULL REFERENCES audit_criterion(id);
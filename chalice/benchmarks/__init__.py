@@ -0,0 +1,8 @@
+"""
+Benchmarks for the audit pipeline.
+Run from the chalice directory, eg:
+python -m benchmarks.audit_kickoff
+"""
+import os
+os.environ["CSW_CRITERIA_UNIT_TESTING"] = "1"
+os.environ.setdefault("CSW_REGION", "eu-west-2")
@@ -0,0 +1,101 @@
+"""
+Measure how the audit kickoff time grows with the number of accounts.
+
+Compares the original approach (one INSERT and one SendMessage per account)
+against AccountAudit.create_batch and GdsSqsClient.send_message_batch.
+
+The database is an in-memory SQLite binding of the models and SQS is a
+stub which sleeps for --sqs-latency milliseconds per API call so the
+numbers show the shape of the curve rather than production timings.
+"""
+import argparse
+import logging
+import time
+
+from app import app
+from chalicelib import models
+from chalicelib.aws.gds_sqs_client import GdsSqsClient
+from tests.chalicelib.test_database_default import (
+    bind_test_database,
+    unbind_test_database,
+)
+
+
+class LatencySqs:
+    """
+    Stub boto3 SQS client counting calls and simulating round trip latency
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def send_message(self, QueueUrl, MessageBody):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"MessageId": str(self.calls)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {
+            "Successful": [
+                {"Id": entry["Id"], "MessageId": entry["Id"]} for entry in Entries
+            ]
+        }
+
+
+def create_accounts(count):
+    team = models.ProductTeam.create(team_name="benchmark", active=True)
+    return [
+        models.AccountSubscription.create(
+            account_id=100000000000 + index,
+            account_name=f"benchmark-{index}",
+            product_team_id=team,
+            active=True,
+            auditable=True,
+            suspended=False,
+        )
+        for index in range(count)
+    ]
+
+
+def kickoff_serial(sqs, accounts):
+    for account in accounts:
+        audit = models.AccountAudit.create(account_subscription_id=account)
+        sqs.send_message("queue", app.utilities.to_json(audit.serialize()))
+
+
+def kickoff_batched(sqs, accounts):
+    audits = models.AccountAudit.create_batch(accounts)
+    bodies = [app.utilities.to_json(audit.serialize()) for audit in audits]
+    sqs.send_message_batch("queue", bodies)
+
+
+def run(account_counts, latency):
+    app.log.setLevel(logging.ERROR)
+    database, original = bind_test_database()
+    try:
+        accounts = create_accounts(max(account_counts))
+        print(f"{'accounts':>10} {'serial s':>10} {'calls':>7} {'batched s':>10} {'calls':>7}")
+        for count in account_counts:
+            row = [f"{count:>10}"]
+            for kickoff in [kickoff_serial, kickoff_batched]:
+                stub = LatencySqs(latency)
+                sqs = GdsSqsClient(app)
+                sqs.get_default_client = lambda service_name, region=None: stub
+                start = time.perf_counter()
+                kickoff(sqs, accounts[:count])
+                elapsed = time.perf_counter() - start
+                row.append(f"{elapsed:>10.3f} {stub.calls:>7}")
+            print(" ".join(row))
+    finally:
+        unbind_test_database(database, original)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    parser.add_argument("--sqs-latency", type=float, default=5, help="milliseconds per SQS call")
+    args = parser.parse_args()
+    run(args.accounts, args.sqs_latency / 1000)
@@ -0,0 +1,222 @@
+"""
+Run full audits of synthetic accounts through the audit lambdas end to end.
+
+Every account is queued for an audit as the scheduled audit does, then the
+account_audit_criteria, account_evaluate_criteria and audit_evaluated_metric
+handlers process the messages from a GdsSqsMemoryBackend, synchronously or
+on --workers threads, until every audit is finished.
+
+AWS responses are stubbed from tests/chalicelib/criteria/test_data.py:
+the security group criteria share one describe_security_groups call per
+region returning --resources groups and the CloudTrail Trusted Advisor
+criteria share the CLOUDTRAIL_LOGGING result. Each stubbed call sleeps for
+--aws-latency milliseconds to stand in for the API round trip.
+With --region-messages each regional criterion is split into a message
+per region (CSW_REGION_MESSAGES).
+
+The database is SQLite (a temporary file so it can be shared by worker
+threads) so the numbers show the relative cost of changes to the pipeline
+rather than production timings.
+"""
+import argparse
+import copy
+import logging
+import os
+import tempfile
+import time
+from unittest import mock
+
+from app import app
+
+# the audit lambdas are named after the environment prefix
+os.environ.setdefault("CSW_ENV", "benchmark")
+if not hasattr(app, "prefix"):
+    app.prefix = "csw-benchmark"
+
+from chalicelib import audit, models  # noqa: E402
+from chalicelib.aws.gds_aws_client import GdsAwsClient  # noqa: E402
+from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClient  # noqa: E402
+from chalicelib.aws.gds_sqs_client import GdsSqsClient  # noqa: E402
+from chalicelib.aws.gds_sqs_memory_backend import GdsSqsMemoryBackend  # noqa: E402
+from chalicelib.aws.gds_support_client import GdsSupportClient  # noqa: E402
+from tests.chalicelib.criteria.test_data import (  # noqa: E402
+    CLOUDTRAIL_LOGGING,
+    EGRESS_RESTRICTION,
+    SESSION,
+)
+from tests.chalicelib.test_database_default import (  # noqa: E402
+    bind_test_database,
+    unbind_test_database,
+)
+
+
+CRITERIA = [
+    "chalicelib.criteria.aws_ec2_security_group_ingress_ssh.AwsEc2SecurityGroupIngressSsh",
+    "chalicelib.criteria.aws_ec2_security_group_ingress_open.AwsEc2SecurityGroupIngressOpen",
+    "chalicelib.criteria.aws_ec2_egress_restriction.UnrestrictedEgressSecurityGroups",
+    "chalicelib.criteria.aws_support_cloudtrail_logging.CloudtrailLogHasErrors",
+    "chalicelib.criteria.aws_support_cloudtrail_logging.CloudtrailLogNotInRegion",
+    "chalicelib.criteria.aws_support_cloudtrail_logging.CloudtrailLogTurnedOff",
+]
+
+# the tables written by an audit
+AUDIT_TABLES = [
+    models.AccountAudit,
+    models.AuditCriterion,
+    models.AuditCriterionRegion,
+    models.AuditResource,
+    models.AuditResourceData,
+    models.ResourceCompliance,
+    models.AccountCriterionRegion,
+    models.AuditTiming,
+]
+
+
+def build_security_groups(count):
+    """
+    Alternate passing and failing security groups with unique ids
+    """
+    templates = [
+        EGRESS_RESTRICTION["pass"]["SecurityGroups"][0],
+        EGRESS_RESTRICTION["fail"]["SecurityGroups"][0],
+    ]
+    groups = []
+    for index in range(count):
+        group = copy.deepcopy(templates[index % 2])
+        group["GroupId"] = f"sg-{index:017x}"
+        group["GroupName"] = f"security-group-{index}"
+        groups.append(group)
+    return groups
+
+
+def create_fixtures(account_count):
+    for status in ["Not checked", "Pass", "Fail", "Exception"]:
+        models.Status.create(status_name=status, description=status)
+    provider = models.CriteriaProvider.create(provider_name="AWS")
+    for class_name in CRITERIA:
+        check = app.utilities.get_class_by_name(class_name)(app)
+        models.Criterion.create(
+            criterion_name=class_name.split(".")[-1],
+            criteria_provider_id=provider,
+            invoke_class_name=class_name,
+            invoke_class_get_data_method="get_data",
+            title=class_name.split(".")[-1],
+            description="",
+            why_is_it_important="",
+            how_do_i_fix_it="",
+            active=True,
+            is_regional=check.is_regional,
+        )
+    team = models.ProductTeam.create(team_name="benchmark", active=True)
+    return [
+        models.AccountSubscription.create(
+            account_id=100000000000 + index,
+            account_name=f"benchmark-{index}",
+            product_team_id=team,
+            active=True,
+            auditable=True,
+            suspended=False,
+        )
+        for index in range(account_count)
+    ]
+
+
+def stub_response(response, latency):
+    """
+    Return a function which waits for the latency then returns a copy of the response
+    """
+
+    def call(*args, **kwargs):
+        time.sleep(latency)
+        return copy.deepcopy(response)
+
+    return call
+
+
+def count_rows():
+    return sum(model.select().count() for model in AUDIT_TABLES)
+
+
+def run_audits(account_count, workers, regions, resources, latency):
+    """
+    Audit the accounts and return the wall time, queue stats and rows written
+    """
+    with tempfile.TemporaryDirectory() as path:
+        database, original = bind_test_database(os.path.join(path, "audit.db"))
+        backend = GdsSqsMemoryBackend(app)
+        backend.subscribe(f"{app.prefix}-audit-account-queue", audit.account_audit_criteria)
+        backend.subscribe(
+            f"{app.prefix}-audit-account-metric-queue", audit.account_evaluate_criteria
+        )
+        backend.subscribe(f"{app.prefix}-evaluated-metric-queue", audit.audit_evaluated_metric)
+        security_groups = build_security_groups(resources)
+        try:
+            accounts = create_fixtures(account_count)
+            with mock.patch.object(
+                GdsSqsClient, "queue_backend", backend
+            ), mock.patch.object(
+                GdsAwsClient, "get_chained_session", side_effect=stub_response(SESSION, latency)
+            ), mock.patch.object(
+                audit, "get_account_regions", return_value=regions
+            ), mock.patch.object(
+                GdsEc2SecurityGroupClient,
+                "describe_security_groups",
+                side_effect=stub_response(security_groups, latency),
+            ), mock.patch.object(
+                GdsSupportClient, "refresh_check_with_wait", return_value=True
+            ), mock.patch.object(
+                GdsSupportClient,
+                "describe_trusted_advisor_check_result",
+                side_effect=stub_response(CLOUDTRAIL_LOGGING["has_errors"], latency),
+            ):
+                start = time.perf_counter()
+                audits = models.AccountAudit.create_batch(accounts)
+                audit.queue_audits(GdsSqsClient(app), audits)
+                stats = backend.run(workers)
+                elapsed = time.perf_counter() - start
+
+            finished = (
+                models.AccountAudit.select()
+                .where(models.AccountAudit.finished == True)
+                .count()
+            )
+            stats["finished"] = finished
+            stats["completed_messages"] = len(
+                backend.get_messages(f"{app.prefix}-completed-audit-queue")
+            )
+            rows = count_rows()
+        finally:
+            unbind_test_database(database, original)
+    return elapsed, stats, rows
+
+
+def run(account_counts, worker_counts, regions, resources, latency):
+    app.log.setLevel(logging.ERROR)
+    print(
+        f"{'accounts':>9} {'workers':>8} {'wall s':>8} {'messages':>9} {'msgs/s':>8} "
+        f"{'rows':>8} {'rows/s':>8} {'retried':>8} {'finished':>9}"
+    )
+    for account_count in account_counts:
+        for workers in worker_counts:
+            elapsed, stats, rows = run_audits(
+                account_count, workers, regions, resources, latency
+            )
+            print(
+                f"{account_count:>9} {workers:>8} {elapsed:>8.2f} {stats['delivered']:>9} "
+                f"{stats['delivered'] / elapsed:>8.0f} {rows:>8} {rows / elapsed:>8.0f} "
+                f"{stats['failed']:>8} {stats['finished']:>9}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--regions", nargs="+", default=["eu-west-1", "eu-west-2", "us-east-1"])
+    parser.add_argument("--resources", type=int, default=20, help="security groups per region")
+    parser.add_argument("--aws-latency", type=float, default=50, help="milliseconds per API call")
+    parser.add_argument("--region-messages", action="store_true")
+    args = parser.parse_args()
+    if args.region_messages:
+        os.environ["CSW_REGION_MESSAGES"] = "1"
+    run(args.accounts, args.workers, args.regions, args.resources, args.aws_latency / 1000)
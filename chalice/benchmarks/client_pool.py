@@ -0,0 +1,123 @@
+"""
+Count the boto3 clients created while auditing synthetic accounts with
+and without the client pool.
+
+Each account gets its own session credentials, as assumed for an audit,
+and the Gds*Client methods the criteria use are called with the AWS API
+calls stubbed out: security groups and VPC flow logs in every region,
+then the KMS keys, load balancers and S3 buckets with their details, the
+IAM roles, RDS instances and EBS volumes.
+
+Without the pool (max_size 0) a client is created for every call as
+get_boto3_session_client did before. Client creation does not call AWS so
+the time reported is the real cost of creating the clients.
+"""
+import argparse
+import logging
+import os
+import time
+from unittest import mock
+
+from app import app
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_client_pool import GdsClientPool
+from chalicelib.aws.gds_ec2_client import GdsEc2Client
+from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClient
+from chalicelib.aws.gds_elb_client import GdsElbClient
+from chalicelib.aws.gds_iam_client import GdsIamClient
+from chalicelib.aws.gds_kms_client import GdsKmsClient
+from chalicelib.aws.gds_rds_client import GdsRdsClient
+from chalicelib.aws.gds_s3_client import GdsS3Client
+
+
+def get_responses(items):
+    """
+    A stubbed response for each API operation listing the given number of items
+    """
+    names = [f"item-{index}" for index in range(items)]
+    return {
+        "DescribeSecurityGroups": {"SecurityGroups": []},
+        "DescribeVpcs": {"Vpcs": [{"VpcId": name} for name in names]},
+        "DescribeFlowLogs": {"FlowLogs": []},
+        "ListKeys": {"Keys": [{"KeyId": name, "KeyArn": name} for name in names]},
+        "GetKeyRotationStatus": {"KeyRotationEnabled": True},
+        "DescribeKey": {"KeyMetadata": {"KeyId": "key"}},
+        "DescribeLoadBalancers": {"LoadBalancers": [{"LoadBalancerArn": name} for name in names]},
+        "DescribeLoadBalancerAttributes": {"Attributes": []},
+        "ListBuckets": {"Buckets": [{"Name": name} for name in names]},
+        "GetBucketPolicy": {"Policy": "{}"},
+        "GetBucketVersioning": {},
+        "GetBucketEncryption": {},
+        "GetBucketAcl": {},
+        "ListRoles": {"Roles": []},
+        "DescribeDBInstances": {"DBInstances": []},
+        "DescribeVolumes": {"Volumes": []},
+    }
+
+
+def audit_account(session, regions):
+    security_groups = GdsEc2SecurityGroupClient(app)
+    ec2 = GdsEc2Client(app)
+    for region in regions:
+        security_groups.describe_security_groups(session, region=region)
+        for vpc in ec2.describe_vpcs(session, region):
+            ec2.describe_flow_logs(session, vpc, region)
+    GdsKmsClient(app).get_key_list_with_details(session)
+    GdsElbClient(app).get_balancer_list_with_attributes(session)
+    s3 = GdsS3Client(app)
+    for bucket in s3.get_bucket_list(session):
+        s3.get_bucket_policy(session, bucket["Name"])
+        s3.get_bucket_versioning(session, bucket["Name"])
+        s3.get_bucket_encryption(session, bucket["Name"])
+        s3.get_bucket_acl(session, bucket["Name"])
+    GdsIamClient(app).list_roles(session)
+    GdsRdsClient(app).describe_db_instances(session)
+    ec2.describe_volumes(session)
+
+
+def run_audits(pool, accounts, regions, items):
+    """
+    Audit the accounts and return the elapsed time and pool stats
+    """
+    responses = get_responses(items)
+    with mock.patch.object(GdsAwsClient, "client_pool", pool), mock.patch(
+        "botocore.client.BaseClient._make_api_call",
+        side_effect=lambda operation_name, params: responses[operation_name],
+    ):
+        start = time.perf_counter()
+        for account in range(accounts):
+            session = {
+                "AccessKeyId": f"ASIA{account:016d}",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+            }
+            audit_account(session, regions)
+        elapsed = time.perf_counter() - start
+    return elapsed, pool.get_stats()
+
+
+def run(accounts, regions, items, max_size):
+    app.log.setLevel(logging.ERROR)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    print(
+        f"{'pool':>8} {'accounts':>9} {'created':>8} {'per audit':>10} "
+        f"{'reused':>7} {'evicted':>8} {'wall s':>7}"
+    )
+    for label, pool in [("none", GdsClientPool(max_size=0)), ("lru", GdsClientPool(max_size))]:
+        elapsed, stats = run_audits(pool, accounts, regions, items)
+        print(
+            f"{label:>8} {accounts:>9} {stats['created']:>8} {stats['created'] / accounts:>10.1f} "
+            f"{stats['hits']:>7} {stats['evicted']:>8} {elapsed:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument(
+        "--regions", nargs="+", default=["eu-west-1", "eu-west-2", "us-east-1", "us-west-2"]
+    )
+    parser.add_argument("--items", type=int, default=10, help="keys, balancers, buckets and vpcs")
+    parser.add_argument("--max-size", type=int, default=GdsClientPool.max_size)
+    args = parser.parse_args()
+    run(args.accounts, args.regions, args.items, args.max_size)
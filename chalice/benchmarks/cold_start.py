@@ -0,0 +1,92 @@
+"""
+Time the cold start of each audit lambda with and without prewarming
+the boto3 service models (CSW_PREWARM_SERVICES).
+
+Each run is a new python process standing in for a new lambda container.
+It records the time to import the audit module, which includes the
+prewarm when it is enabled, and the time for the first call: creating a
+client for each service the lambda uses (audit.LAMBDA_SERVICES) through
+GdsAwsClient and making one stubbed API call with it. The AWS API calls
+are stubbed out so the first call time is the client creation cost.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from unittest import mock
+
+
+def run_child(handler):
+    """
+    Import the audit module as the lambda would then make its first calls
+    and print the times as json
+    """
+    os.environ["AWS_LAMBDA_FUNCTION_NAME"] = f"cloud-security-watch-benchmark-{handler}"
+    start = time.perf_counter()
+    from app import app
+
+    app.log.disabled = True
+    app.prefix = "csw-benchmark"
+    from chalicelib import audit
+    from chalicelib.aws.gds_aws_client import GdsAwsClient
+
+    imported = time.perf_counter()
+    session = {"AccessKeyId": "cold", "SecretAccessKey": "start", "SessionToken": "token"}
+    client = GdsAwsClient(app)
+    with mock.patch("botocore.client.BaseClient._make_api_call", return_value={}):
+        for service_name in audit.get_lambda_services(os.environ["AWS_LAMBDA_FUNCTION_NAME"]):
+            pooled = client.get_pooled_client(service_name, session)
+            pooled._make_api_call("Benchmark", {})
+    called = time.perf_counter()
+    print(json.dumps({"import": imported - start, "first_call": called - imported}))
+
+
+def run_lambda(handler, prewarm):
+    env = dict(
+        os.environ,
+        CSW_ENV="benchmark",
+        CSW_PREWARM_SERVICES="true" if prewarm else "",
+        AWS_DEFAULT_REGION="eu-west-2",
+    )
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child", handler],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(handlers, repeats):
+    print(f"{'lambda':>30} {'prewarm':>8} {'import ms':>10} {'first call ms':>14} {'total ms':>9}")
+    for handler in handlers:
+        for prewarm in [False, True]:
+            runs = [run_lambda(handler, prewarm) for index in range(repeats)]
+            imported = statistics.median(run["import"] for run in runs) * 1000
+            called = statistics.median(run["first_call"] for run in runs) * 1000
+            print(
+                f"{handler:>30} {'yes' if prewarm else 'no':>8} {imported:>10.0f} "
+                f"{called:>14.0f} {imported + called:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--handlers", nargs="+")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per lambda, the median is reported")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child)
+    else:
+        os.environ.setdefault("CSW_ENV", "benchmark")
+        from app import app
+
+        app.prefix = "csw-benchmark"
+        from chalicelib.audit import LAMBDA_SERVICES
+
+        run(args.handlers or list(LAMBDA_SERVICES.keys()), args.repeats)
@@ -0,0 +1,232 @@
+"""
+Measure the evaluate and summarize hot paths of the criteria on scaled up
+inputs built from the shapes in tests/chalicelib/criteria/test_data.py.
+
+For each criterion the items are evaluated and the evaluated resources
+summarized as the audit does. The fastest of --repeat runs is reported in
+microseconds per item, and a separate run under tracemalloc records the
+peak memory allocated.
+
+The results are compared with the stored baseline
+(benchmarks/baselines/criteria_evaluate.json) and the script exits with
+status 1 if any criterion is slower or uses more memory than the baseline
+by more than --threshold percent. Timings depend on the machine so the
+baseline should be saved with --save-baseline on the machine used to
+compare against it.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from app import app
+from chalicelib.criteria.aws_ec2_egress_restriction import UnrestrictedEgressSecurityGroups
+from chalicelib.criteria.aws_ec2_security_group_ingress_open import (
+    AwsEc2SecurityGroupIngressOpen,
+)
+from chalicelib.criteria.aws_ec2_security_group_ingress_ssh import (
+    AwsEc2SecurityGroupIngressSsh,
+)
+from chalicelib.criteria.aws_iam_roles_with_trust_relationship import (
+    AwsIamRolesWithTrustRelationship,
+)
+from chalicelib.criteria.aws_s3_secure_policy import AwsS3SecurePolicy
+from tests.chalicelib.criteria.test_data import (
+    EGRESS_RESTRICTION,
+    IAM_ROLES_WITH_TRUST_RELATIONSHIP,
+    S3_BUCKET_POLICY_BUCKETS,
+)
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "criteria_evaluate.json")
+
+# ingress rules cycled through to build each security group
+# ranges are a mix of private, allow listed and public networks
+INGRESS_RULES = [
+    {"IpProtocol": "tcp", "FromPort": 22, "ToPort": 22, "IpRanges": ["10.0.0.0/16", "213.86.153.212/32"]},
+    {"IpProtocol": "tcp", "FromPort": 443, "ToPort": 443, "IpRanges": ["0.0.0.0/0"]},
+    {"IpProtocol": "tcp", "FromPort": 22, "ToPort": 22, "IpRanges": ["81.2.{index}.0/24", "85.133.67.244/32"]},
+    {"IpProtocol": "tcp", "FromPort": 0, "ToPort": 65535, "IpRanges": ["172.16.{index}.0/24"]},
+    {"IpProtocol": "tcp", "FromPort": 80, "ToPort": 80, "IpRanges": ["0.0.0.0/0", "192.168.1.0/24"]},
+    {"IpProtocol": "-1", "IpRanges": ["52.{index}.0.0/16"]},
+]
+
+
+def build_security_groups(count, rules):
+    templates = [
+        EGRESS_RESTRICTION["pass"]["SecurityGroups"][0],
+        EGRESS_RESTRICTION["fail"]["SecurityGroups"][0],
+    ]
+    groups = []
+    for index in range(count):
+        group = copy.deepcopy(templates[index % 2])
+        group["GroupId"] = f"sg-{index:017x}"
+        group["GroupName"] = f"security-group-{index}"
+        group["IpPermissions"] = []
+        for rule_index in range(rules):
+            template = INGRESS_RULES[(index + rule_index) % len(INGRESS_RULES)]
+            rule = {key: value for key, value in template.items() if key != "IpRanges"}
+            rule["IpRanges"] = [
+                {"CidrIp": cidr.format(index=index % 256)} for cidr in template["IpRanges"]
+            ]
+            rule.update({"Ipv6Ranges": [], "PrefixListIds": [], "UserIdGroupPairs": []})
+            group["IpPermissions"].append(rule)
+        groups.append(group)
+    return groups
+
+
+def build_buckets(count):
+    templates = list(S3_BUCKET_POLICY_BUCKETS.values())
+    return [copy.deepcopy(templates[index % len(templates)]) for index in range(count)]
+
+
+def build_roles(count):
+    templates = [
+        role for roles in IAM_ROLES_WITH_TRUST_RELATIONSHIP.values() for role in roles
+    ]
+    roles = []
+    for index in range(count):
+        role = copy.deepcopy(templates[index % len(templates)])
+        role["RoleName"] = f"role-{index}"
+        role["Arn"] = f"arn:aws:iam::123456789012:role/role-{index}"
+        roles.append(role)
+    return roles
+
+
+def get_cases(scale, rules):
+    """
+    (name, criterion class, items) for each benchmarked criterion
+    """
+    security_groups = build_security_groups(10000 * scale, rules)
+    return [
+        ("AwsEc2SecurityGroupIngressSsh", AwsEc2SecurityGroupIngressSsh, security_groups),
+        ("AwsEc2SecurityGroupIngressOpen", AwsEc2SecurityGroupIngressOpen, security_groups),
+        ("UnrestrictedEgressSecurityGroups", UnrestrictedEgressSecurityGroups, security_groups),
+        ("AwsS3SecurePolicy", AwsS3SecurePolicy, build_buckets(1000 * scale)),
+        ("AwsIamRolesWithTrustRelationship", AwsIamRolesWithTrustRelationship, build_roles(1000 * scale)),
+    ]
+
+
+def evaluate_items(check, items):
+    resources = []
+    for item in items:
+        resource = check.translate(item)
+        resource["region"] = "eu-west-2"
+        resource["resource_compliance"] = check.evaluate({}, item)
+        resources.append(resource)
+    return resources
+
+
+def measure(CriterionClass, items, repeat):
+    """
+    Returns the fastest evaluate and summarize times in microseconds per item
+    and the peak memory allocated in KB
+    """
+    check = CriterionClass(app)
+    evaluate_times = []
+    summarize_times = []
+    for attempt in range(repeat):
+        # criteria annotate the items so each run evaluates a fresh copy
+        run_items = copy.deepcopy(items)
+        start = time.perf_counter()
+        resources = evaluate_items(check, run_items)
+        evaluate_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        check.summarize(resources)
+        summarize_times.append(time.perf_counter() - start)
+
+    run_items = copy.deepcopy(items)
+    tracemalloc.start()
+    check.summarize(evaluate_items(check, run_items))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "items": len(items),
+        "evaluate_us": round(min(evaluate_times) / len(items) * 1e6, 2),
+        "summarize_us": round(min(summarize_times) / len(items) * 1e6, 2),
+        "peak_kb": round(peak / 1024),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Return a description of each result worse than the baseline by more
+    than the threshold percent
+    """
+    regressions = []
+    for name, result in results.items():
+        # peak memory grows with the number of items so only
+        # results from the same scale are compared
+        if name not in baseline or baseline[name]["items"] != result["items"]:
+            print(f"No baseline for {name} with {result['items']} items")
+            continue
+        for metric in ["evaluate_us", "summarize_us", "peak_kb"]:
+            limit = baseline[name][metric] * (1 + threshold / 100)
+            if result[metric] > limit:
+                regressions.append(
+                    f"{name} {metric} {result[metric]:.1f} > {baseline[name][metric]:.1f} "
+                    f"+ {threshold}%"
+                )
+    return regressions
+
+
+def run(scale, rules, repeat, threshold, save_baseline, criteria=None):
+    app.log.setLevel(logging.ERROR)
+    results = {}
+    print(
+        f"{'criterion':<34} {'items':>7} {'evaluate us':>12} {'summarize us':>13} {'peak KB':>9}"
+    )
+    for name, CriterionClass, items in get_cases(scale, rules):
+        if criteria and name not in criteria:
+            continue
+        result = measure(CriterionClass, items, repeat)
+        results[name] = result
+        print(
+            f"{name:<34} {result['items']:>7} {result['evaluate_us']:>12.2f} "
+            f"{result['summarize_us']:>13.2f} {result['peak_kb']:>9.0f}"
+        )
+
+    if save_baseline:
+        # criteria which were not run keep their saved baseline
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved baseline to {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline to compare with, run with --save-baseline")
+        return 0
+    with open(BASELINE_PATH) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scale", type=int, default=1,
+        help="10,000 security groups and 1,000 buckets and roles per unit, eg 10 for 100k groups",
+    )
+    parser.add_argument("--rules", type=int, default=6, help="ingress rules per security group")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=25, help="percent slower to fail")
+    parser.add_argument("--criteria", nargs="+", help="names of the criteria to run")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+    sys.exit(
+        run(args.scale, args.rules, args.repeat, args.threshold, args.save_baseline, args.criteria)
+    )
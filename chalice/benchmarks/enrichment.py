@@ -0,0 +1,108 @@
+"""
+Time the per item follow-up calls for an account with many KMS keys and
+S3 buckets with the enrichment executor at different worker counts.
+
+get_key_list_with_details makes two calls per key and AwsS3SecurePolicy
+makes one per bucket. The HTTP requests are stubbed below botocore so
+every call still goes through the rate limiter (token bucket per account
+and service, concurrency slots per service) and each request sleeps for
+--latency milliseconds to stand in for the API round trip.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from unittest import mock
+
+from botocore.awsrequest import AWSResponse
+
+from app import app
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_client_pool import GdsClientPool
+from chalicelib.aws.gds_enrichment_executor import GdsEnrichmentExecutor
+from chalicelib.aws.gds_kms_client import GdsKmsClient
+from chalicelib.aws.gds_rate_limiter import GdsRateLimiter
+from chalicelib.criteria.aws_s3_secure_policy import AwsS3SecurePolicy
+
+
+SESSION = {
+    "AccessKeyId": "enrichment",
+    "SecretAccessKey": "secret",
+    "SessionToken": "token",
+    "Account": "000000000001",
+}
+
+
+class RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def get_body(request, items):
+    """
+    The response body for the stubbed KMS and S3 operations
+    """
+    target = request.headers.get("X-Amz-Target", b"")
+    if isinstance(target, bytes):
+        target = target.decode()
+    if target.endswith("ListKeys"):
+        keys = [{"KeyId": f"key-{index}", "KeyArn": f"arn-{index}"} for index in range(items)]
+        return json.dumps({"Keys": keys, "Truncated": False})
+    if target.endswith("GetKeyRotationStatus"):
+        return json.dumps({"KeyRotationEnabled": True})
+    if target.endswith("DescribeKey"):
+        return json.dumps({"KeyMetadata": {"KeyId": "key"}})
+    if "?policy" in request.url:
+        return json.dumps({"Statement": []})
+    buckets = "".join(f"<Bucket><Name>bucket-{index}</Name></Bucket>" for index in range(items))
+    return f"<ListAllMyBucketsResult><Buckets>{buckets}</Buckets></ListAllMyBucketsResult>"
+
+
+def run_enrichment(workers, items, latency):
+    """
+    Fetch the key details and bucket policies and return the elapsed
+    seconds for each and the rate limiter stats
+    """
+    limiter = GdsRateLimiter()
+
+    def send(endpoint, request):
+        time.sleep(latency / 1000)
+        return AWSResponse(request.url, 200, {}, RawBody(get_body(request, items).encode()))
+
+    with mock.patch.object(GdsAwsClient, "rate_limiter", limiter), mock.patch.object(
+        GdsAwsClient, "client_pool", GdsClientPool()
+    ), mock.patch.object(
+        GdsAwsClient, "enrichment", GdsEnrichmentExecutor(workers)
+    ), mock.patch("botocore.endpoint.Endpoint._send", send):
+        start = time.perf_counter()
+        keys = GdsKmsClient(app).get_key_list_with_details(SESSION)
+        kms = time.perf_counter() - start
+        start = time.perf_counter()
+        buckets = AwsS3SecurePolicy(app).get_data(SESSION)
+        s3 = time.perf_counter() - start
+    assert len(keys) == items and len(buckets) == items
+    return kms, s3, limiter.get_stats()
+
+
+def run(workers, items, latency):
+    app.log.setLevel(logging.ERROR)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    print(f"{'workers':>8} {'items':>6} {'kms s':>7} {'s3 s':>7} {'calls':>6} {'limiter wait s':>15}")
+    for worker_count in workers:
+        kms, s3, stats = run_enrichment(worker_count, items, latency)
+        calls = sum(service["calls"] for service in stats.values())
+        waited = sum(service["wait_seconds"] for service in stats.values())
+        print(f"{worker_count:>8} {items:>6} {kms:>7.2f} {s3:>7.2f} {calls:>6} {waited:>15.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, GdsEnrichmentExecutor.max_workers])
+    parser.add_argument("--items", type=int, default=500, help="KMS keys and S3 buckets")
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds per API call")
+    args = parser.parse_args()
+    run(args.workers, args.items, args.latency)
@@ -0,0 +1,203 @@
+"""
+Measure the storage size of audit resource payloads and the latency of
+issue list queries before and after moving resource_data into compressed
+audit_resource_data records.
+
+Before: every audit_resource row holds the raw API JSON and the issue list
+loads each full row and serializes it with its data.
+After: the data is converted with AuditResourceData.convert_batch and the
+issue list selects the resource columns without the payload.
+The list timings cover loading the resource rows; serializing them is the
+same either way and is left out.
+
+The database is an in-memory SQLite binding of the models so the numbers
+show the relative difference rather than production timings. Sizes are the
+bytes of payload stored rather than the size of the table on disk.
+"""
+import argparse
+import json
+import logging
+import time
+
+from peewee import fn
+
+from app import app
+from chalicelib import models
+from tests.chalicelib.test_database_default import (
+    bind_test_database,
+    unbind_test_database,
+)
+
+
+def build_security_group(index):
+    return {
+        "Description": f"security group {index} for the application load balancer",
+        "GroupName": f"security-group-{index}",
+        "IpPermissions": [
+            {
+                "FromPort": port,
+                "IpProtocol": "tcp",
+                "IpRanges": [{"CidrIp": f"10.{index % 255}.{port % 255}.0/24"}],
+                "Ipv6Ranges": [],
+                "PrefixListIds": [],
+                "ToPort": port,
+                "UserIdGroupPairs": [],
+            }
+            for port in [22, 80, 443, 8080]
+        ],
+        "OwnerId": "123456789012",
+        "GroupId": f"sg-{index:017x}",
+        "IpPermissionsEgress": [
+            {
+                "IpProtocol": "-1",
+                "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+                "Ipv6Ranges": [],
+                "PrefixListIds": [],
+                "UserIdGroupPairs": [],
+            }
+        ],
+        "Tags": [{"Key": "Name", "Value": f"security-group-{index}"}],
+        "VpcId": "vpc-0123456789abcdef0",
+    }
+
+
+def create_resources(audit, criterion, count):
+    rows = []
+    for index in range(count):
+        rows.append(
+            {
+                "account_audit_id": audit.id,
+                "criterion_id": criterion.id,
+                "region": "eu-west-2",
+                "resource_id": f"sg-{index:017x}",
+                "resource_name": f"security-group-{index}",
+                "resource_persistent_id": f"AWS::EC2::SecurityGroup::eu-west-2::{index}",
+                "resource_data": json.dumps(build_security_group(index)),
+                "date_evaluated": audit.date_started,
+            }
+        )
+    with models.AuditResource._meta.database.atomic():
+        for start in range(0, count, 500):
+            models.AuditResource.insert_many(rows[start:start + 500]).execute()
+        models.ResourceCompliance.insert_many(
+            [
+                {
+                    "audit_resource_id": audit_resource_id,
+                    "annotation": "",
+                    "resource_type": "AWS::EC2::SecurityGroup",
+                    "resource_id": resource_id,
+                    "compliance_type": "NON_COMPLIANT",
+                    "is_compliant": False,
+                    "is_applicable": True,
+                    "status_id": 3,
+                }
+                for audit_resource_id, resource_id in models.AuditResource.select(
+                    models.AuditResource.id, models.AuditResource.resource_id
+                ).tuples()
+            ]
+        ).execute()
+
+
+def get_payload_bytes():
+    inline = models.AuditResource.select(
+        fn.COALESCE(fn.SUM(fn.LENGTH(models.AuditResource.resource_data)), 0)
+    ).scalar()
+    compressed = models.AuditResourceData.select(
+        fn.COALESCE(fn.SUM(fn.LENGTH(models.AuditResourceData.data)), 0)
+    ).scalar()
+    return inline + compressed
+
+
+def list_issues_before(audit):
+    """
+    Load each failed resource with its inline resource_data
+    Returns the bytes of resource data read
+    """
+    data_bytes = 0
+    for compliance in audit.get_audit_failed_resources():
+        audit_resource = models.AuditResource.get_by_id(compliance.audit_resource_id_id)
+        data_bytes += len(audit_resource.resource_data or "")
+    return data_bytes
+
+
+def list_issues_after(audit):
+    """
+    Load each failed resource without its data
+    Returns the bytes of resource data read
+    """
+    data_bytes = 0
+    for compliance in audit.get_audit_failed_resources():
+        audit_resource = models.AuditResource.get_summary_by_id(
+            compliance.audit_resource_id_id
+        )
+        data_bytes += len(audit_resource.resource_data or "")
+    return data_bytes
+
+
+def time_call(function, *args, repeat=3):
+    """
+    Returns the fastest of repeat calls and the result of the call
+    """
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(resource_counts):
+    app.log.setLevel(logging.ERROR)
+    print(
+        f"{'resources':>10} {'before KB':>10} {'after KB':>9} {'ratio':>6} "
+        f"{'list before s':>14} {'read KB':>8} {'list after s':>13} {'read KB':>8}"
+    )
+    for count in resource_counts:
+        database, original = bind_test_database()
+        try:
+            team = models.ProductTeam.create(team_name="benchmark", active=True)
+            account = models.AccountSubscription.create(
+                account_id=100000000000,
+                account_name="benchmark",
+                product_team_id=team,
+                active=True,
+                auditable=True,
+                suspended=False,
+            )
+            audit = models.AccountAudit.create(account_subscription_id=account)
+            provider = models.CriteriaProvider.create(provider_name="AWS")
+            criterion = models.Criterion.create(
+                criterion_name="benchmark",
+                criteria_provider_id=provider,
+                invoke_class_name="",
+                invoke_class_get_data_method="",
+                title="benchmark",
+                description="",
+                why_is_it_important="",
+                how_do_i_fix_it="",
+            )
+            for status in ["Not checked", "Pass", "Fail"]:
+                models.Status.create(status_name=status, description=status)
+            create_resources(audit, criterion, count)
+
+            before_bytes = get_payload_bytes()
+            list_before, read_before = time_call(list_issues_before, audit)
+            while models.AuditResourceData.convert_batch() > 0:
+                pass
+            after_bytes = get_payload_bytes()
+            list_after, read_after = time_call(list_issues_after, audit)
+            print(
+                f"{count:>10} {before_bytes / 1024:>10.0f} {after_bytes / 1024:>9.0f} "
+                f"{before_bytes / after_bytes:>6.1f} {list_before:>14.3f} {read_before / 1024:>8.0f} "
+                f"{list_after:>13.3f} {read_after / 1024:>8.0f}"
+            )
+        finally:
+            unbind_test_database(database, original)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--resources", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+    run(args.resources)
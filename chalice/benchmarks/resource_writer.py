@@ -0,0 +1,132 @@
+"""
+Measure the throughput of writing evaluated resources to the database.
+
+Compares the original approach (AuditResource.create then
+ResourceCompliance.create for each resource) against the buffered
+AuditResourceWriter.
+
+The database is an in-memory SQLite binding of the models where each
+statement sleeps for --db-latency milliseconds to stand in for the round
+trip to RDS so the numbers show the shape of the curve rather than
+production timings.
+"""
+import argparse
+import logging
+import time
+
+from app import app
+from chalicelib import models
+from tests.chalicelib.test_database_default import (
+    bind_test_database,
+    unbind_test_database,
+)
+
+
+def add_latency(database, latency):
+    """
+    Wrap execute_sql to count statements and simulate round trip latency
+    """
+    execute_sql = database.execute_sql
+    counter = {"statements": 0}
+
+    def execute_sql_with_latency(sql, params=None, commit=True):
+        counter["statements"] += 1
+        time.sleep(latency)
+        return execute_sql(sql, params, commit)
+
+    database.execute_sql = execute_sql_with_latency
+    return counter
+
+
+def build_items(audit, criterion, count):
+    items = []
+    for index in range(count):
+        resource_item = {
+            "account_audit_id": audit,
+            "criterion_id": criterion,
+            "region": "eu-west-2",
+            "resource_id": f"sg-{index:08}",
+            "resource_name": f"security-group-{index}",
+            "resource_persistent_id": f"arn:aws:ec2:eu-west-2:sg-{index:08}",
+            "resource_data": '{"GroupId": "sg-%08d", "IpPermissions": []}' % index,
+        }
+        compliance = {
+            "resource_type": "AWS::EC2::SecurityGroup",
+            "resource_id": f"sg-{index:08}",
+            "compliance_type": "COMPLIANT",
+            "is_compliant": True,
+            "is_applicable": True,
+            "status_id": 2,
+        }
+        items.append((resource_item, compliance))
+    return items
+
+
+def write_serial(items):
+    for resource_item, compliance in items:
+        audit_resource = models.AuditResource.create(**resource_item)
+        compliance["audit_resource_id"] = audit_resource
+        models.ResourceCompliance.create(**compliance)
+
+
+def write_buffered(items):
+    writer = models.AuditResourceWriter()
+    for resource_item, compliance in items:
+        writer.add(resource_item, compliance)
+    writer.flush()
+
+
+def run(resource_counts, latency):
+    app.log.setLevel(logging.ERROR)
+    database, original = bind_test_database()
+    try:
+        team = models.ProductTeam.create(team_name="benchmark", active=True)
+        account = models.AccountSubscription.create(
+            account_id=100000000000,
+            account_name="benchmark",
+            product_team_id=team,
+            active=True,
+            auditable=True,
+            suspended=False,
+        )
+        audit = models.AccountAudit.create(account_subscription_id=account)
+        provider = models.CriteriaProvider.create(provider_name="AWS")
+        criterion = models.Criterion.create(
+            criterion_name="benchmark",
+            criteria_provider_id=provider,
+            invoke_class_name="",
+            invoke_class_get_data_method="",
+            title="benchmark",
+            description="",
+            why_is_it_important="",
+            how_do_i_fix_it="",
+        )
+        models.Status.create(status_name="Pass", description="Pass")
+        counter = add_latency(database, latency)
+
+        print(
+            f"{'resources':>10} {'serial s':>10} {'rows/s':>9} {'stmts':>7} "
+            f"{'buffered s':>10} {'rows/s':>9} {'stmts':>7}"
+        )
+        for count in resource_counts:
+            row = [f"{count:>10}"]
+            for write in [write_serial, write_buffered]:
+                items = build_items(audit, criterion, count)
+                counter["statements"] = 0
+                start = time.perf_counter()
+                write(items)
+                elapsed = time.perf_counter() - start
+                row.append(
+                    f"{elapsed:>10.3f} {count / elapsed:>9.0f} {counter['statements']:>7}"
+                )
+            print(" ".join(row))
+    finally:
+        unbind_test_database(database, original)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--resources", type=int, nargs="+", default=[100, 500, 1000, 5000])
+    parser.add_argument("--db-latency", type=float, default=1, help="milliseconds per statement")
+    args = parser.parse_args()
+    run(args.resources, args.db_latency / 1000)
@@ -102,6 +102,46 @@ def database_create_items(event, context):
     return json_data
 
 
+@app.lambda_function()
+def database_create_audit_resources(event, context):
+    try:
+        dbh = DatabaseHandle(app)
+        created = dbh.create_audit_resources(event)
+        json_data = app.utilities.to_json(
+            [audit_resource.serialize() for audit_resource in created]
+        )
+    except Exception as err:
+        app.log.error(str(err))
+        json_data = None
+    return json_data
+
+
+@app.lambda_function()
+def database_compress_resource_data(event, context):
+    """
+    Move audit_resource.resource_data into compressed audit_resource_data
+    records in batches until every record is converted or the lambda is
+    close to timing out. Invoke again until converted is 0.
+    event: {"BatchSize": 1000}
+    """
+    converted = 0
+    try:
+        dbh = DatabaseHandle(app)
+        db = dbh.get_handle()
+        db.connect(reuse_if_open=True)
+        batch_size = event.get("BatchSize")
+        while True:
+            batch = models.AuditResourceData.convert_batch(batch_size)
+            converted += batch
+            app.log.debug(f"Converted {converted} audit resources")
+            if batch == 0 or context.get_remaining_time_in_millis() < 60000:
+                break
+        db.close()
+    except Exception as err:
+        app.log.error(str(err))
+    return converted
+
+
 @app.lambda_function()
 def database_get_item(event, context):
     app.log.debug("database_get_item function")
@@ -349,6 +349,41 @@ def route_api_daily_account():
     return Response(**response)
 
 
+@app.route("/api/timing/summary")
+def route_api_timing_summary():
+    """
+    p50 and p95 duration in milliseconds of each stage of the audit pipeline
+    per criterion and per account over the last ?days=1 days, slowest first
+    """
+    status_code = 200
+    try:
+        load_route_services()
+        authed = app.auth.try_login(app.current_request)
+
+        if authed:
+            query_params = app.current_request.query_params or {}
+            days = int(query_params.get("days", 1))
+            since = datetime.datetime.now() - datetime.timedelta(days=days)
+            data = {
+                "status": "ok",
+                "days": days,
+                "criteria": models.AuditTiming.get_percentiles(since, "criterion"),
+                "accounts": models.AuditTiming.get_percentiles(since, "account"),
+            }
+        else:
+            raise Exception("Unauthorised")
+    except Exception as err:
+        status_code = 403
+        data = {"status": "failed", "message": str(err)}
+    json = app.utilities.to_json(data, True)
+    response = {
+        "body": json,
+        "status_code": status_code,
+        "headers": {"Content-Type": "application/json"},
+    }
+    return Response(**response)
+
+
 @app.route("/api/prometheus/metrics")
 def route_api_prometheus_metrics():
     """
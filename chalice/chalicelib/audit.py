@@ -1,13 +1,15 @@
 """
 AUDIT LAMBDAS
 """
+import copy
 import os
 import json
 from datetime import datetime
-from peewee import Case, fn
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
 from chalice import Rate
+from peewee import InterfaceError, OperationalError
 
 from app import app
 from chalicelib.aws.gds_aws_client import GdsAwsClient
@@ -16,6 +18,10 @@ from chalicelib.aws.gds_sqs_client import GdsSqsClient
 from chalicelib.aws.gds_ec2_client import GdsEc2Client
 from chalicelib.aws.gds_organizations_client import GdsOrganizationsClient
 from chalicelib import models
+from chalicelib.blob_store import get_blob_store
+from chalicelib.deadline import Deadline
+from chalicelib.scheduler import AuditScheduler
+from chalicelib.timing import AuditTimer
 from chalicelib.criteria.aws_ec2_security_group_ingress_open import (
     AwsEc2SecurityGroupIngressOpen,
 )
@@ -43,44 +49,348 @@ def get_audit_criteria(app):
     return active_criteria
 
 
-def execute_on_audit_accounts_event(event, context):
+def log_stats(label, stats):
+    """
+    Record a dict of counters as one JSON log line
+    """
+    app.log.info(f"{label} stats: " + app.utilities.to_json(stats))
+
+
+def log_client_stats():
+    """
+    Record the counters shared by the AWS clients in the container:
+    the metadata and credential cache hits that show the API calls saved
+    by a warm container, the calls, retries and throttle events for each
+    service and the pages returned by each paginated call
+    """
+    log_stats("Metadata cache", GdsAwsClient.metadata.get_stats())
+    log_stats("Credential cache", GdsAwsClient.credentials.get_stats())
+    log_stats("API rate limiter", GdsAwsClient.rate_limiter.get_stats())
+    log_stats("Pagination", GdsAwsClient.get_pagination_stats())
+
+
+# boto3 services used by each audit lambda, keyed by handler name
+# their models are loaded while the lambda's container is initialised
+# when CSW_PREWARM_SERVICES is set
+LAMBDA_SERVICES = {
+    "audit_account_schedule": ["sqs"],
+    "audit_account": ["sqs"],
+    "account_audit_criteria": ["sqs", "ssm", "sts", "ec2"],
+    "account_evaluate_criteria": [
+        "sqs", "ssm", "sts", "ec2", "iam", "s3", "support", "kms", "elbv2", "rds", "cloudtrail",
+    ],
+    "audit_evaluated_metric": ["sqs"],
+    "manual_update_subscriptions": ["ssm", "sts", "organizations"],
+    "schedule_update_subscriptions": ["ssm", "sts", "organizations"],
+}
+
+
+def is_prewarm_mode():
+    """
+    In prewarm mode the boto3 models of the services a lambda uses are
+    loaded when this module is imported rather than by its first event
+    """
+    return os.environ.get("CSW_PREWARM_SERVICES", "").lower() in ["1", "true"]
+
+
+def get_lambda_services(function_name):
+    """
+    The services used by the lambda function.
+    Chalice names the functions {app_name}-{stage}-{handler}
+    """
+    for handler, services in LAMBDA_SERVICES.items():
+        if function_name.endswith(f"-{handler}"):
+            return services
+    return []
+
+
+def prewarm_lambda_services():
+    """
+    Load the models of the services used by the lambda being initialised
+    """
+    function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "")
     try:
-        status = False
-        active_accounts = models.AccountSubscription.select().where(
+        loaded = GdsAwsClient.boto_session.prewarm(get_lambda_services(function_name))
+        app.log.info(f"Prewarmed services for {function_name}: " + app.utilities.to_json(loaded))
+    except Exception as err:
+        app.log.error("Failed to prewarm services: " + str(err))
+
+
+class RetryableError(Exception):
+    """
+    A failure expected to succeed if the message is processed again
+    eg an SQS message which could not be sent
+    """
+
+
+# AWS error codes for failures expected to succeed if retried
+RETRYABLE_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "ServiceUnavailable",
+    "InternalError",
+    "InternalFailure",
+]
+
+
+def is_retryable_error(error):
+    """
+    Throttling, timeouts, AWS server errors and lost database connections
+    are retried. Anything else, eg AccessDenied, a malformed message or a
+    missing record, will fail again so is terminal.
+    """
+    if isinstance(error, RetryableError):
+        retryable = True
+    elif isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        retryable = code in RETRYABLE_ERROR_CODES or status_code >= 500
+    else:
+        retryable = isinstance(
+            error,
+            (
+                BotocoreConnectionError,
+                HTTPClientError,
+                OperationalError,
+                InterfaceError,
+                TimeoutError,
+                ConnectionError,
+            ),
+        )
+    return retryable
+
+
+def is_partial_batch_mode():
+    """
+    In partial batch mode the SQS handlers return only the messages to retry
+    as a partial batch response. Lambda ignores the response unless the event
+    source mapping has the ReportBatchItemFailures function response type so
+    only set CSW_SQS_PARTIAL_BATCH once the mappings have it.
+    """
+    return os.environ.get("CSW_SQS_PARTIAL_BATCH", "").lower() in ["1", "true"]
+
+
+def get_dead_letter_queue_name():
+    """
+    The queue recording the messages which failed with terminal errors,
+    set by CSW_AUDIT_DEAD_LETTER_QUEUE, or None if there isn't one
+    """
+    return os.environ.get("CSW_AUDIT_DEAD_LETTER_QUEUE") or None
+
+
+def process_message_batch(event, queue_name, process_message):
+    """
+    Process each SQS message in the batch on its own.
+    Messages failing with terminal errors are sent to the dead letter queue
+    instead of being retried.
+    In partial batch mode the messages which should be retried are returned
+    as a partial batch response. Otherwise a RetryableError is raised so the
+    whole batch is retried, which is safe since the handlers skip the work
+    already done for a redelivered message.
+    """
+    failures = []
+    received = 0
+    for message in event:
+        received += 1
+        message_id = message.to_dict().get("messageId")
+        try:
+            process_message(message)
+        except Exception as error:
+            app.log.error(app.utilities.get_typed_exception())
+            retry = is_retryable_error(error)
+            if not retry:
+                # retry anyway if the message can't be dead lettered
+                retry = not send_to_dead_letter_queue(queue_name, message, error)
+            if retry:
+                failures.append({"itemIdentifier": message_id})
+    log_client_stats()
+    if len(failures) > 0 and not is_partial_batch_mode():
+        raise RetryableError(f"{len(failures)} of {received} messages from {queue_name} to retry")
+    return {"batchItemFailures": failures}
+
+
+def send_to_dead_letter_queue(queue_name, message, error):
+    """
+    Record a message which failed with a terminal error
+    on the dead letter queue with the error which caused it.
+    Without a dead letter queue the error is only logged.
+    Returns False if the message could not be recorded so should be retried.
+    """
+    dead_letter_queue_name = get_dead_letter_queue_name()
+    if dead_letter_queue_name is None:
+        app.log.error(f"Dropped message {message.to_dict().get('messageId')} from {queue_name}")
+        return True
+    sqs = GdsSqsClient(app)
+    queue_url = sqs.get_queue_url(dead_letter_queue_name)
+    message_data = {
+        "queue": queue_name,
+        "message_id": message.to_dict().get("messageId"),
+        "body": message.body,
+        "error": f"{type(error).__name__}: {error}",
+    }
+    message_id = None
+    if queue_url is not None:
+        message_id = sqs.send_message(queue_url, app.utilities.to_json(message_data))
+    return message_id is not None
+
+
+def get_region_workers():
+    """
+    The maximum number of regions whose data is collected concurrently
+    for the account being audited. Set CSW_MAX_REGION_WORKERS=1 to
+    collect the regions one after another.
+    """
+    try:
+        workers = int(os.environ.get("CSW_MAX_REGION_WORKERS", 8))
+    except ValueError:
+        workers = 1
+    return max(workers, 1)
+
+
+def get_account_regions(account_subscription_id, session):
+    """
+    Get the names of the regions enabled for the audited account.
+    The list is stored in the account_region table between audits.
+    If the target account's regions can't be listed fall back to the
+    regions visible to the lambda without storing them.
+    """
+    ec2 = GdsEc2Client(app)
+
+    def load_regions():
+        regions = ec2.describe_account_regions(session)
+        return [region["RegionName"] for region in regions]
+
+    try:
+        regions = models.AccountRegion.get_enabled_regions(
+            account_subscription_id, load_regions
+        )
+    except ClientError:
+        app.log.error(app.utilities.get_typed_exception())
+        regions = [region["RegionName"] for region in ec2.describe_regions()]
+    return regions
+
+
+def get_active_accounts():
+    return list(
+        models.AccountSubscription.select().where(
             models.AccountSubscription.active == True
         )
-        app.log.debug("Found active accounts: " + str(len(list(active_accounts))))
-        items = []
+    )
+
+
+def get_active_criteria():
+    return list(models.Criterion.select().where(models.Criterion.active == True))
+
+
+def queue_audits(sqs, audits, criterion_ids=None):
+    """
+    Send each audit to the audit account queue
+    criterion_ids maps the id of a partial audit to the ids of
+    the criteria it should evaluate
+    """
+    app.log.debug("Invoke SQS client")
+    app.log.debug("Set prefix: " + app.prefix)
+    queue_url = sqs.get_queue_url(f"{app.prefix}-audit-account-queue")
+    app.log.debug("Retrieved queue url: " + queue_url)
+    message_bodies = []
+    for audit in audits:
+        message_data = audit.serialize()
+        if criterion_ids is not None and audit.id in criterion_ids:
+            message_data["criterion_ids"] = criterion_ids[audit.id]
+        message_bodies.append(app.utilities.to_json(message_data))
+    message_ids = sqs.send_message_batch(queue_url, message_bodies)
+    failed = message_ids.count(None)
+    app.log.debug(f"Sent {len(message_ids) - failed} SQS messages")
+    if failed > 0:
+        raise Exception(f"Message ID empty for {failed} SQS send_message_batch entries")
+
+
+def execute_on_audit_accounts_event(event, context):
+    try:
+        status = False
+        active_accounts = get_active_accounts()
+        app.log.debug("Found active accounts: " + str(len(active_accounts)))
         # create SQS message
         sqs = GdsSqsClient(app)
-        app.log.debug("Invoke SQS client")
-        app.log.debug("Set prefix: " + app.prefix)
-        queue_url = sqs.get_queue_url(f"{app.prefix}-audit-account-queue")
-        app.log.debug("Retrieved queue url: " + queue_url)
-        for account in active_accounts:
-            app.log.debug("Audit account: " + account.account_name)
-            items.append(account.serialize())
-            # create a new empty account audit record
-            audit = models.AccountAudit.create(account_subscription_id=account)
-            app.log.debug("Created audit record")
-            message_body = app.utilities.to_json(audit.serialize())
-            app.log.debug("Sending SQS message with body: " + message_body)
-            message_id = sqs.send_message(queue_url, message_body)
-            if message_id is not None:
-                app.log.debug("Sent SQS message: " + message_id)
-            else:
-                raise Exception("Message ID empty from SQS send_message")
+        # create a new empty account audit record for every account at once
+        audits = models.AccountAudit.create_batch(active_accounts)
+        app.log.debug(f"Created {len(audits)} audit records")
+        queue_audits(sqs, audits)
         status = True
     except Exception as err:
         app.log.error("Failed to start audit: " + str(err))
         status = False
-        items = []
+    log_client_stats()
+    return status
+
+
+def execute_scheduled_audits(now=None):
+    """
+    Queue the audits for the accounts with criteria due in this slot
+    of the audit window.
+    Audits evaluating every active criterion are full audits, the others
+    are partial audits of the criteria which were due.
+    """
+    try:
+        status = False
+        scheduler = AuditScheduler(app, now)
+        active_accounts = get_active_accounts()
+        active_criteria = get_active_criteria()
+        planned, expected = scheduler.plan(active_accounts, active_criteria)
+        full_accounts = [
+            (account, criteria)
+            for account, criteria in planned
+            if len(criteria) == len(active_criteria)
+        ]
+        partial_accounts = [
+            (account, criteria)
+            for account, criteria in planned
+            if len(criteria) < len(active_criteria)
+        ]
+        audits = models.AccountAudit.create_batch(
+            [account for account, criteria in full_accounts]
+        )
+        partial_audits = models.AccountAudit.create_batch(
+            [account for account, criteria in partial_accounts], partial=True
+        )
+        criterion_ids = {
+            audit.id: [criterion.id for criterion in criteria]
+            for audit, (account, criteria) in zip(partial_audits, partial_accounts)
+        }
+        # the audit criteria are created now so the next slot counts
+        # the criteria queued here as run before they are evaluated
+        for audit_record, (account, criteria) in zip(
+            audits + partial_audits, full_accounts + partial_accounts
+        ):
+            models.AuditCriterion.create_batch(audit_record, criteria)
+        load = sum(len(criteria) for account, criteria in planned)
+        app.log.info(
+            f"Scheduled {len(audits)} full and {len(partial_audits)} partial audits "
+            f"of {len(active_accounts)} accounts: "
+            f"{load} criterion evaluations, expected {expected} per slot"
+        )
+        if len(planned) > 0:
+            queue_audits(GdsSqsClient(app), audits + partial_audits, criterion_ids)
+        status = True
+    except Exception as err:
+        app.log.error("Failed to schedule audits: " + str(err))
+        status = False
+    log_client_stats()
     return status
 
 
-@app.schedule(Rate(24, unit=Rate.HOURS))
+@app.schedule(Rate(AuditScheduler.slot_minutes, unit=Rate.MINUTES))
 def audit_account_schedule(event):
-    return execute_on_audit_accounts_event(event, {})
+    return execute_scheduled_audits()
 
 
 @app.lambda_function()
@@ -88,319 +398,935 @@ def audit_account(event, context):
     return execute_on_audit_accounts_event(event, context)
 
 
+@app.lambda_function()
+def audit_schedule_load(event, context):
+    """
+    Report the expected and actual criterion evaluations
+    queued in each slot over the last audit window
+    """
+    scheduler = AuditScheduler(app)
+    curve = scheduler.get_load_curve(get_active_accounts(), get_active_criteria())
+    peak = max([slot["actual"] for slot in curve], default=0)
+    return app.utilities.to_json(
+        {
+            "slot_minutes": scheduler.slot_minutes,
+            "expected_per_slot": curve[0]["expected"] if curve else 0,
+            "peak_per_slot": peak,
+            "slots": curve,
+        }
+    )
+
+
 @app.on_sqs_message(queue=f"{app.prefix}-audit-account-queue")
 def account_audit_criteria(event):
-    status = False
+    sqs = GdsSqsClient(app)
+    return process_message_batch(
+        event,
+        f"{app.prefix}-audit-account-queue",
+        lambda message: create_audit_criteria(sqs, message),
+    )
+
+
+def create_audit_criteria(sqs, message):
+    """
+    Create the audit criteria for an audit and send them
+    to the audit account metric queue to be evaluated
+    """
+    audit_data = json.loads(message.body)
+    app.log.debug(message.body)
+    timer = AuditTimer(app, audit_data["id"])
+    timer.record_queue_wait(message)
     try:
-        sqs = GdsSqsClient(app)
         app.log.debug("Invoke SQS client")
         app.log.debug("Set prefix: " + app.prefix)
         queue_url = sqs.get_queue_url(f"{app.prefix}-audit-account-metric-queue")
+        if queue_url is None:
+            raise RetryableError("Failed to get audit account metric queue URL")
         app.log.debug("Retrieved queue url: " + queue_url)
         active_criteria = models.Criterion.select().where(
             models.Criterion.active == True
         )
-        messages = []
-        for message in event:
-            audit_data = json.loads(message.body)
-            app.log.debug(message.body)
+        if "criterion_ids" in audit_data:
+            # partial audits only evaluate the criteria which were due
+            active_criteria = active_criteria.where(
+                models.Criterion.id.in_(audit_data["criterion_ids"])
+            )
+        with timer.span("create_audit_criteria"):
             audit = models.AccountAudit.get_by_id(audit_data["id"])
             audit.active_criteria = len(list(active_criteria))
-            audit.save()
-            for criterion in active_criteria:
-                # catch KeyErrors for duplicate compound keys if SQS messages
-                # are processed twice
-                # (account_audit_id, criterion_id) should be unique
-                try:
-                    audit_criterion = models.AuditCriterion.create(
-                        account_audit_id=audit, criterion_id=criterion
-                    )
-                    message_body = app.utilities.to_json(audit_criterion.serialize())
-                    message_id = sqs.send_message(queue_url, message_body)
-                    messages.append(message_id)
-                except KeyError:
-                    app.log.error(app.utilities.get_typed_exception())
-            audit.date_updated = datetime.now()
-            audit.save()
+            # only save the columns changed here since the stats
+            # are incremented concurrently as criteria are evaluated
+            audit.save(only=[models.AccountAudit.active_criteria])
+            # (account_audit_id, criterion_id) is unique so if SQS messages
+            # are processed twice the existing audit criteria are reused
+            # and only those which have not been evaluated are sent again
+            audit_criteria = [
+                audit_criterion
+                for audit_criterion in models.AuditCriterion.create_batch(
+                    audit, active_criteria
+                )
+                if not audit_criterion.attempted
+            ]
+        # criteria sharing a data source are sent in a single message
+        # so the data is only collected once
+        message_bodies = [
+            app.utilities.to_json(message_data)
+            for message_data in group_by_data_source(audit_criteria)
+        ]
+        with timer.span("send_messages"):
+            message_ids = sqs.send_message_batch(queue_url, message_bodies)
+        audit.date_updated = datetime.now()
+        audit.save(only=[models.AccountAudit.date_updated])
+        failed = message_ids.count(None)
+        if failed > 0:
+            # resending is safe since the audit criteria are reused
+            raise RetryableError(f"Failed to send {failed} audit criteria messages")
+    finally:
+        timer.flush()
+
+
+def get_data_source_key(audit_criterion):
+    """
+    Criteria declaring the same data_source are evaluated from one collection
+    of the data. Criteria without a data_source are collected on their own.
+    """
+    criterion = audit_criterion.criterion_id
+    try:
+        CheckClass = app.utilities.get_class_by_name(criterion.invoke_class_name)
+        data_source = getattr(CheckClass, "data_source", None)
     except Exception:
-        app.log.error(app.utilities.get_typed_exception())
-    return status
+        data_source = None
+    if data_source is None:
+        return ("criterion", criterion.id)
+    return ("data_source", criterion.is_regional) + tuple(data_source)
+
+
+def group_by_data_source(audit_criteria):
+    """
+    Build one message per data source from the serialized first audit criterion
+    listing the ids of the other audit criteria sharing its data source
+    """
+    groups = {}
+    for audit_criterion in audit_criteria:
+        groups.setdefault(get_data_source_key(audit_criterion), []).append(
+            audit_criterion
+        )
+    messages = []
+    for group in groups.values():
+        message_data = group[0].serialize()
+        message_data["shared_audit_criterion_ids"] = [
+            audit_criterion.id for audit_criterion in group[1:]
+        ]
+        messages.append(message_data)
+    return messages
 
 
 # TODO break down into multiple steps
 @app.on_sqs_message(queue=f"{app.prefix}-audit-account-metric-queue")
 def account_evaluate_criteria(event):
-    status = False
+    sqs = GdsSqsClient(app)
+    # messages in the batch share the invocation's deadline
+    deadline = Deadline(getattr(event, "context", None))
+    return process_message_batch(
+        event,
+        f"{app.prefix}-audit-account-metric-queue",
+        lambda message: evaluate_audit_criteria_message(sqs, message, deadline),
+    )
+
+
+def evaluate_audit_criteria_message(sqs, message, deadline=None):
+    app.log.debug("Invoke SQS client")
+    app.log.debug("Set prefix: " + app.prefix)
+    queue_url = sqs.get_queue_url(f"{app.prefix}-evaluated-metric-queue")
+    if queue_url is None:
+        raise RetryableError("Failed to get evaluated metric queue URL")
+    app.log.debug("Retrieved queue url: " + queue_url)
+    app.log.debug("parse message body")
+    audit_criteria_data = json.loads(message.body)
+    timer = AuditTimer(app, audit_criteria_data["account_audit_id"]["id"])
+    timer.record_queue_wait(message, audit_criteria_data["criterion_id"]["id"])
     try:
+        return evaluate_audit_criteria(sqs, queue_url, audit_criteria_data, timer, deadline)
+    finally:
+        timer.flush()
+
+
+def evaluate_audit_criteria(sqs, queue_url, audit_criteria_data, timer=None, deadline=None):
+    """
+    Assume the role and collect the data once for the audit criterion in the
+    message and any audit criteria sharing its data source, then evaluate
+    each criterion against its own copy of the data.
+    Each audit criterion is saved and sent to the evaluated metric queue.
+    When a message is redelivered audit criteria which have already been
+    evaluated are not evaluated again and only their regions
+    which have not been completed are collected.
+    The time taken by each stage is recorded by the timer.
+    In region mode a message for several regions is split into one message
+    per region (with a "region" key) and the last region to complete adds
+    up the region summaries and sends the evaluated metric.
+    When the deadline is reached before every region has been evaluated
+    the audit criteria which are not complete are saved without being
+    marked as attempted and sent in a continuation message which only
+    evaluates their remaining regions.
+    Returns True if every criterion was processed.
+    """
+    audit_data = audit_criteria_data["account_audit_id"]
+    audit = models.AccountAudit.get_by_id(audit_data["id"])
+    if timer is None:
+        timer = AuditTimer(app, audit.id)
+    app.log.debug("loaded audit")
+    account_id = audit.account_subscription_id.account_id
+    account_subscription_id = audit.account_subscription_id.id
+
+    region = audit_criteria_data.get("region")
+    audit_criterion_ids = [audit_criteria_data["id"]]
+    audit_criterion_ids.extend(audit_criteria_data.get("shared_audit_criterion_ids", []))
+    processed = True
+    checks = []
+    for audit_criterion_id in audit_criterion_ids:
+        audit_criterion = models.AuditCriterion.get_by_id(audit_criterion_id)
+        app.log.debug("loaded audit criterion")
+        criterion = audit_criterion.criterion_id
+        app.log.debug("criterion: " + criterion.title)
+        CheckClass = app.utilities.get_class_by_name(criterion.invoke_class_name)
+        check = CheckClass(app)
+        check.set_account_subscription_id(account_subscription_id)
+        if audit_criterion.attempted:
+            # The message has been redelivered after the criterion was evaluated
+            # so the metric message is sent again in case it was not sent before
+            app.log.debug(f"Audit criterion {audit_criterion.id} already evaluated")
+            check_passed = get_completed_check_passed(check, audit_criterion)
+            if send_evaluated_metric(
+                sqs, queue_url, audit_criterion, audit_criterion.processed, check_passed
+            ) is None:
+                raise RetryableError("Failed to send evaluated metric message")
+            processed &= audit_criterion.processed
+            continue
+        # Mark audit_criterion record as attempted regardless of successful processing
+        # This means that we can tell when an audit is finished even if it did not complete
+        # Finished = every check was attempted
+        # Complete = every check was successfully processed (pass or fail)
+        audit_criterion.attempted = True
+        checks.append((audit_criterion, criterion, check))
+
+    if len(checks) == 0:
+        return processed
+
+    # TODO figure out how to resolve the chain account and new role names
+    # session = check.get_session(
+    #     account=account_id, role=f"{app.prefix}_CstSecurityInspectorRole"
+    # )
+    lead_criterion_id = checks[0][1].id
+    lead_check = checks[0][2]
+    with timer.span("assume_role", lead_criterion_id):
+        session = lead_check.get_chained_session(account_id)
+
+    check_requests = []
+    check_completed_regions = []
+    collected = {}
+    if session is not None:
+        unique_requests = {}
+        for audit_criterion, criterion, check in checks:
+            requests = get_criterion_requests(
+                check, criterion, account_subscription_id, session, region
+            )
+            completed_regions = models.AuditCriterionRegion.get_completed(
+                audit_criterion.id
+            )
+            check_requests.append(requests)
+            check_completed_regions.append(completed_regions)
+            for params in requests:
+                if get_region_key(params) not in completed_regions:
+                    unique_requests.setdefault(get_request_key(params), params)
+        if region is None and is_region_mode() and fan_out_regions(
+            sqs, queue_url, checks, check_requests, check_completed_regions
+        ):
+            return False
+        # get the data for every request (usually all regions) concurrently
+        # criteria sharing a data source all get the same data
+        for params, data, boto3_error in lead_check.collect_data(
+            session,
+            list(unique_requests.values()),
+            get_region_workers(),
+            timer,
+            lead_criterion_id,
+            deadline,
+        ):
+            collected[get_request_key(params)] = (data, boto3_error)
+
+    continued = []
+    for index, (audit_criterion, criterion, check) in enumerate(checks):
+        # check passed is set to true and and-equalsed for all
+        # or false and or-equalsed for any
+        check_passed = check.aggregation_type == "all"
         status = False
-        sqs = GdsSqsClient(app)
-        app.log.debug("Invoke SQS client")
-        app.log.debug("Set prefix: " + app.prefix)
-        queue_url = sqs.get_queue_url(f"{app.prefix}-evaluated-metric-queue")
-        app.log.debug("Retrieved queue url: " + queue_url)
-        for message in event:
-            app.log.debug("parse message body")
-            audit_criteria_data = json.loads(message.body)
-            audit_criterion = models.AuditCriterion.get_by_id(audit_criteria_data["id"])
-            app.log.debug("loaded audit criterion")
-            audit_data = audit_criteria_data["account_audit_id"]
-            audit = models.AccountAudit.get_by_id(audit_data["id"])
-            app.log.debug("loaded audit")
-            criterion_data = audit_criteria_data["criterion_id"]
-            criterion = models.Criterion.get_by_id(criterion_data["id"])
-            app.log.debug("criterion: " + criterion.title)
-            provider = criterion_data["criteria_provider_id"]
-            app.log.debug("provider: " + provider["provider_name"])
-            CheckClass = app.utilities.get_class_by_name(criterion.invoke_class_name)
-            check = CheckClass(app)
-            account_id = audit.account_subscription_id.account_id
-            check.set_account_subscription_id(audit.account_subscription_id.id)
-
-            # TODO figure out how to resolve the chain account and new role names
-            # TODO implement the check.get_chained_session method
-            # session = check.get_session(
-            #     account=account_id, role=f"{app.prefix}_CstSecurityInspectorRole"
-            # )
-            session = check.get_chained_session(account_id)
-
-            # check passed is set to true and and-equalsed for all
-            # or false and or-equalsed for any
-            check_passed = check.aggregation_type == "all"
-
-            # Mark audit_criterion record as attempted regardless of successful processing
-            # This means that we can tell when an audit is finished even if it did not complete
-            # Finished = every check was attempted
-            # Complete = every check was successfully processed (pass or fail)
-            audit_criterion.attempted = True
-
-            if session is not None:
-                params = {}
-                for param in criterion.criterion_params:
-                    params[param.param_name] = param.param_value
-                app.log.debug("params: " + app.utilities.to_json(params))
-                requests = []
-                if criterion.is_regional:
-                    ec2 = GdsEc2Client(app)
-                    regions = ec2.describe_regions()
-                    for region in regions:
-                        region_params = params.copy()
-                        region_params["region"] = region["RegionName"]
-                        app.log.debug(
-                            "Create request from region: " + region_params["region"]
-                        )
-                        requests.append(region_params)
-                else:
-                    requests.append(params)
-                summary = None
-
-                # check passed is set to true and and-equalsed for all
-                # or false and or-equalsed for any
-                check_passed = check.aggregation_type == "all"
-                is_all = check_passed
-                for params in requests:
-                    try:
-                        data = check.get_data(session, **params)
-                        # Set status to true only if data is returned successfully
-                        # AccessDenied remains unprocessed
-                        status = True
-                    except ClientError as boto3_error:
-                        # catch access denied type errors from out-of-date policies
-                        app.log.error(str(boto3_error))
-                        data = None
-                    if data is not None:
-                        app.log.debug("api response: " + app.utilities.to_json(data))
-                        evaluated = []
-                        for api_response_item in data:
-                            compliance = check.evaluate({}, api_response_item)
-                            app.log.debug(app.utilities.to_json(compliance))
-
-                            item_passed = compliance["status_id"] == 2
-
-                            # for "any" type checks only passed resources need to be recorded
-                            # individual failed resources are irrelevant for any checks.
-                            if is_all or item_passed:
-
-                                audit_resource_item = check.build_audit_resource_item(
-                                    api_item=api_response_item,
-                                    audit=audit,
-                                    criterion=criterion,
-                                    params=params,
-                                )
-
-                                # only check exception status for failed resources
-                                if not item_passed:
-                                    # insert exception handling here so we catch failed exceptions before they
-                                    # change the status of the check
-                                    # potentially change the item_passed status before updating check_passed
-                                    exception = models.ResourceException.has_active_exception(
-                                        criterion.id,
-                                        audit_resource_item["resource_persistent_id"],
-                                        audit.account_subscription_id.id,
-                                    )
-
-                                    if exception is not None:
-                                        item_passed = True
-                                        compliance["status_id"] = 4
-                                        compliance["is_compliant"] = True
-                                        compliance["compliance_type"] = "COMPLIANT"
-                                        compliance[
-                                            "annotation"
-                                        ] += f"<p>[Passed by exception: {exception.reason}]</p>"
-
-                                # create an audit_resource record
-                                audit_resource = models.AuditResource.create(
-                                    **audit_resource_item
-                                )
-
-                                # populate foreign key for compliance record
-                                compliance["audit_resource_id"] = audit_resource
-                                audit_resource_item["resource_compliance"] = compliance
-
-                                resource_compliance = models.ResourceCompliance.create(
-                                    **compliance
-                                )  # TODO: unecessary assignment?
-                                evaluated.append(audit_resource_item)
-
-                            # update check passed status
-                            check_passed = (
-                                (check_passed and item_passed)
-                                if is_all
-                                else (check_passed or item_passed)
-                            )
-
-                        summary = check.summarize(evaluated, summary)
-                        app.log.debug(app.utilities.to_json(summary))
-                        audit_criterion.resources = summary["all"]["display_stat"]
-                        audit_criterion.tested = summary["applicable"]["display_stat"]
-                        audit_criterion.passed = summary["compliant"]["display_stat"]
-                        audit_criterion.failed = summary["non_compliant"][
-                            "display_stat"
-                        ]
-                        audit_criterion.ignored = summary["not_applicable"][
-                            "display_stat"
-                        ]
-                        audit_criterion.regions = summary["regions"]["count"]
-                        audit_criterion.processed = status
-                        # Only update the processed stat if the assume was successful
-
-            # Set the attempted status even if the criterion was not processed
+        pending_regions = []
+        if session is not None:
+            try:
+                status, check_passed, pending_regions = evaluate_criterion(
+                    audit,
+                    audit_criterion,
+                    criterion,
+                    check,
+                    check_requests[index],
+                    check_completed_regions[index],
+                    collected,
+                    copy_data=len(checks) > 1,
+                    timer=timer,
+                    deadline=deadline,
+                )
+            except Exception as error:
+                # retryable errors fail the message so it is retried
+                # without marking the criterion as attempted
+                if is_retryable_error(error):
+                    raise
+                app.log.error(app.utilities.get_typed_exception())
+                status = False
+
+        if len(pending_regions) > 0:
+            # save the running stats, the completed regions are checkpointed
+            app.log.info(
+                f"Deadline reached for audit criterion {audit_criterion.id} "
+                f"with {len(pending_regions)} regions pending"
+            )
+            audit_criterion.attempted = False
             audit_criterion.save()
+            continued.append(audit_criterion)
+            continue
 
-            message_data = audit_criterion.serialize()
-            message_data["processed"] = status
-            message_data["check_passed"] = check_passed
-            # It may be worth adding a field to the model
-            # to record where a check failed because of a failed assume role
-            # message_data['assume_failed'] = (session is None)
-            message_body = app.utilities.to_json(message_data)
-            message_id = sqs.send_message(
-                queue_url, message_body
-            )  # TODO: unecessary assignment?
+        if region is not None:
+            processed &= complete_region(sqs, queue_url, audit_criterion, check, region)
+            continue
 
-    except Exception:
-        app.log.error(app.utilities.get_typed_exception())
+        # Set the attempted status even if the criterion was not processed
+        audit_criterion.save()
+        if send_evaluated_metric(sqs, queue_url, audit_criterion, status, check_passed) is None:
+            # the redelivered message will resend the metric message
+            raise RetryableError("Failed to send evaluated metric message")
+        processed &= status
+
+    if len(continued) > 0:
+        send_continuation(sqs, audit_criteria_data, continued)
+        processed = False
+
+    return processed
+
+
+def fan_out_regions(sqs, queue_url, checks, check_requests, check_completed_regions):
+    """
+    Send a message for each region which has not been completed listing the
+    audit criteria which evaluate it, so the regions are evaluated
+    concurrently. Each audit criterion records how many regions it expects.
+    Returns False without sending anything unless there are at least two
+    regions to evaluate.
+    """
+    region_criteria = {}
+    for (audit_criterion, criterion, check), requests, completed_regions in zip(
+        checks, check_requests, check_completed_regions
+    ):
+        if not criterion.is_regional:
+            return False
+        for params in requests:
+            if get_region_key(params) not in completed_regions:
+                region_criteria.setdefault(get_region_key(params), []).append(
+                    audit_criterion
+                )
+    if len(region_criteria) < 2:
+        return False
+
+    for (audit_criterion, criterion, check), requests in zip(checks, check_requests):
+        audit_criterion.regions_expected = len(requests)
+        audit_criterion.save(only=[models.AuditCriterion.regions_expected])
+    message_bodies = []
+    for region_name, audit_criteria in region_criteria.items():
+        message_data = audit_criteria[0].serialize()
+        message_data["shared_audit_criterion_ids"] = [
+            audit_criterion.id for audit_criterion in audit_criteria[1:]
+        ]
+        message_data["region"] = region_name
+        message_bodies.append(app.utilities.to_json(message_data))
+    region_queue_url = sqs.get_queue_url(f"{app.prefix}-audit-account-metric-queue")
+    if region_queue_url is None:
+        raise RetryableError("Failed to get audit account metric queue URL")
+    message_ids = sqs.send_message_batch(region_queue_url, message_bodies)
+    failed = message_ids.count(None)
+    if failed > 0:
+        # region messages which are sent again are evaluated from their checkpoints
+        raise RetryableError(f"Failed to send {failed} region messages")
+
+    # criteria whose regions were all completed by an earlier delivery
+    for (audit_criterion, criterion, check), completed_regions in zip(
+        checks, check_completed_regions
+    ):
+        if not any(audit_criterion in criteria for criteria in region_criteria.values()):
+            complete_regions(sqs, queue_url, audit_criterion, check, completed_regions)
+    return True
+
+
+def complete_region(sqs, queue_url, audit_criterion, check, region_name):
+    """
+    Record that a region message has been processed for the audit criterion.
+    A region which could not be evaluated (eg access was denied) is
+    checkpointed without a summary so the criterion can still complete.
+    Returns the processed status if the criterion is complete.
+    """
+    completed_regions = models.AuditCriterionRegion.get_completed(audit_criterion.id)
+    if region_name not in completed_regions:
+        models.AuditCriterionRegion.complete(audit_criterion.id, region_name, False, None)
+        completed_regions = models.AuditCriterionRegion.get_completed(audit_criterion.id)
+    return complete_regions(sqs, queue_url, audit_criterion, check, completed_regions)
+
+
+def complete_regions(sqs, queue_url, audit_criterion, check, completed_regions):
+    """
+    Once every expected region has a checkpoint add the region summaries
+    up into the audit criterion stats. Each region is committed before
+    the checkpoints are counted so the last region to complete sees them
+    all and only one caller marks the criterion as attempted and sends
+    the evaluated metric.
+    Returns the processed status or False while regions are outstanding.
+    """
+    if len(completed_regions) < audit_criterion.regions_expected:
+        app.log.debug(
+            f"Audit criterion {audit_criterion.id} has {len(completed_regions)} "
+            f"of {audit_criterion.regions_expected} regions completed"
+        )
+        return False
+    is_all = check.aggregation_type == "all"
+    check_passed = is_all
+    status = False
+    summary = None
+    for checkpoint in completed_regions.values():
+        region_summary = checkpoint.get_summary()
+        if region_summary is None:
+            continue
+        status = True
+        check_passed = (
+            (check_passed and checkpoint.check_passed)
+            if is_all
+            else (check_passed or checkpoint.check_passed)
+        )
+        summary = check.merge_summary(summary, region_summary)
+    if summary is not None:
+        set_summary_stats(audit_criterion, summary)
+    audit_criterion.processed = status
+    if audit_criterion.mark_attempted():
+        if send_evaluated_metric(sqs, queue_url, audit_criterion, status, check_passed) is None:
+            # the redelivered region message will resend the metric message
+            raise RetryableError("Failed to send evaluated metric message")
     return status
 
 
-@app.on_sqs_message(queue=f"{app.prefix}-evaluated-metric-queue")
-def audit_evaluated_metric(event):
+def send_continuation(sqs, audit_criteria_data, audit_criteria):
+    """
+    Send the audit criteria which ran out of time back to the audit account
+    metric queue. Their completed regions are read from the checkpoints
+    so only the remaining regions are collected and evaluated.
+    """
+    message_data = audit_criteria[0].serialize()
+    message_data["shared_audit_criterion_ids"] = [
+        audit_criterion.id for audit_criterion in audit_criteria[1:]
+    ]
+    message_data["continuation"] = audit_criteria_data.get("continuation", 0) + 1
+    queue_url = sqs.get_queue_url(f"{app.prefix}-audit-account-metric-queue")
+    if queue_url is None or sqs.send_message(queue_url, app.utilities.to_json(message_data)) is None:
+        # the redelivered message continues from the checkpoints instead
+        raise RetryableError("Failed to send continuation message")
+
+
+def send_evaluated_metric(sqs, queue_url, audit_criterion, status, check_passed):
+    message_data = audit_criterion.serialize()
+    message_data["processed"] = status
+    message_data["check_passed"] = check_passed
+    # It may be worth adding a field to the model
+    # to record where a check failed because of a failed assume role
+    # message_data['assume_failed'] = (session is None)
+    message_body = app.utilities.to_json(message_data)
+    return sqs.send_message(queue_url, message_body)
+
+
+def get_completed_check_passed(check, audit_criterion):
+    """
+    Aggregate the check_passed status of the completed regions of an audit criterion
+    """
+    is_all = check.aggregation_type == "all"
+    check_passed = is_all
+    completed_regions = models.AuditCriterionRegion.get_completed(audit_criterion.id)
+    if len(completed_regions) == 0:
+        return False
+    for region in completed_regions.values():
+        if region.get_summary() is None:
+            # the region could not be evaluated in its own message
+            continue
+        check_passed = (
+            (check_passed and region.check_passed)
+            if is_all
+            else (check_passed or region.check_passed)
+        )
+    return check_passed
+
+
+def get_criterion_requests(check, criterion, account_subscription_id, session, region=None):
+    """
+    Build the get_data params for the criterion, one set for each
+    region which needs to be checked for regional criteria
+    or only the region of a region message
+    """
+    params = {}
+    for param in criterion.criterion_params:
+        params[param.param_name] = param.param_value
+    app.log.debug("params: " + app.utilities.to_json(params))
+    requests = []
+    if criterion.is_regional and region is not None:
+        region_params = params.copy()
+        region_params["region"] = region
+        requests.append(region_params)
+    elif criterion.is_regional:
+        regions = check.filter_regions(
+            get_account_regions(account_subscription_id, session)
+        )
+        # regions where no resources were found recently are skipped
+        skip_regions = models.AccountCriterionRegion.get_skippable_regions(
+            account_subscription_id, criterion.id
+        )
+        for region_name in regions:
+            if region_name in skip_regions:
+                app.log.debug("Skip empty region: " + region_name)
+                continue
+            region_params = params.copy()
+            region_params["region"] = region_name
+            app.log.debug("Create request from region: " + region_params["region"])
+            requests.append(region_params)
+    else:
+        requests.append(params)
+    return requests
+
+
+def get_request_key(params):
+    """
+    Identify identical get_data requests made by criteria sharing a data source
+    """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def get_region_key(params):
+    """
+    The region part of the (audit criterion, region) work key
+    """
+    return params.get("region", models.AuditCriterionRegion.global_region)
+
+
+def evaluate_criterion(
+    audit,
+    audit_criterion,
+    criterion,
+    check,
+    requests,
+    completed_regions,
+    collected,
+    copy_data=False,
+    timer=None,
+    deadline=None,
+):
+    """
+    Evaluate the collected data for each of the criterion's requests
+    and update the audit criterion stats.
+    Regions completed by an earlier delivery of the message are
+    added to the stats from their checkpoints instead.
+    copy_data gives the criterion its own copy of the data since
+    some criteria annotate the items they evaluate.
+    Regions which were not collected before the deadline, or which would
+    be started after it, are left pending. At least one region is
+    evaluated so that each continuation makes progress.
+    Returns the processed status, whether the check passed
+    and the pending region names.
+    """
+    if timer is None:
+        timer = AuditTimer(app, audit.id)
     status = False
-    try:
-        status = False
-        sqs = GdsSqsClient(app)
-        for message in event:
-            audit_criteria_data = json.loads(message.body)
-            audit = models.AccountAudit.get_by_id(
-                audit_criteria_data["account_audit_id"]["id"]
+    account_subscription_id = audit.account_subscription_id.id
+    summary = None
+    region_resources = {}
+    pending_regions = []
+    evaluated = 0
+    if criterion.is_regional and len(requests) == 0:
+        # every enabled region was recently found to be empty
+        status = True
+        audit_criterion.processed = True
+
+    # check passed is set to true and and-equalsed for all
+    # or false and or-equalsed for any
+    is_all = check.aggregation_type == "all"
+    check_passed = is_all
+    exception_index = models.ExceptionIndex(criterion.id, account_subscription_id)
+    check.set_exception_index(exception_index)
+    # evaluate the responses in the order of the requests
+    for params in requests:
+        region_key = get_region_key(params)
+        if region_key in completed_regions:
+            app.log.debug("Region already evaluated: " + region_key)
+            checkpoint = completed_regions[region_key]
+            region_passed = checkpoint.check_passed
+            region_summary = checkpoint.get_summary()
+            if region_summary is None:
+                # the region could not be evaluated in its own message
+                continue
+            status = True
+        elif get_request_key(params) not in collected or (
+            evaluated > 0 and deadline is not None and deadline.reached()
+        ):
+            pending_regions.append(region_key)
+            continue
+        else:
+            evaluated += 1
+            data, boto3_error = collected[get_request_key(params)]
+            if boto3_error is None:
+                # Set status to true only if data is returned successfully
+                # AccessDenied remains unprocessed
+                status = True
+            elif is_retryable_error(boto3_error):
+                # throttled regions are retried by retrying the message
+                raise boto3_error
+            else:
+                # catch access denied type errors from out-of-date policies
+                app.log.error(str(boto3_error))
+            if data is None:
+                continue
+            if copy_data:
+                data = copy.deepcopy(data)
+            app.log.debug("api response: " + app.utilities.to_json(data))
+            if "region" in params:
+                region_resources[params["region"]] = len(data)
+            region_passed, region_summary = evaluate_request(
+                audit, audit_criterion, criterion, check, params, data, exception_index, timer
             )
 
-            # Processed = count where processed = True
-            processed_case = Case(None, [(models.AuditCriterion.processed, 1)], 0)
+        # update check passed status
+        check_passed = (
+            (check_passed and region_passed) if is_all else (check_passed or region_passed)
+        )
+        summary = check.merge_summary(summary, region_summary)
+        app.log.debug(app.utilities.to_json(summary))
+        set_summary_stats(audit_criterion, summary)
+        audit_criterion.processed = status
+        # Only update the processed stat if the assume was successful
 
-            # Attempted = count where attempted = True
-            attempted_case = Case(None, [(models.AuditCriterion.attempted, 1)], 0)
+    models.AccountCriterionRegion.record_resources(
+        account_subscription_id, criterion.id, region_resources
+    )
+    return status, check_passed, pending_regions
 
-            # Count where failed resources > 0
-            failed_case = Case(None, [(models.AuditCriterion.failed > 0, 1)], 0)
 
-            # Collate stats from audit criteria records
-            stats = (
-                models.AuditCriterion.select(
-                    fn.COUNT(models.AuditCriterion.id).alias("active_criteria"),
-                    fn.SUM(attempted_case).alias("attempted_criteria"),
-                    fn.SUM(processed_case).alias("processed_criteria"),
-                    fn.SUM(failed_case).alias("failed_criteria"),
-                    fn.SUM(models.AuditCriterion.failed).alias("failed_resources"),
-                )
-                .where(models.AuditCriterion.account_audit_id == audit)
-                .get()
-            )
+def set_summary_stats(audit_criterion, summary):
+    audit_criterion.resources = summary["all"]["display_stat"]
+    audit_criterion.tested = summary["applicable"]["display_stat"]
+    audit_criterion.passed = summary["compliant"]["display_stat"]
+    audit_criterion.failed = summary["non_compliant"]["display_stat"]
+    audit_criterion.ignored = summary["not_applicable"]["display_stat"]
+    audit_criterion.regions = summary["regions"]["count"]
 
-            app.log.debug(
-                (
-                    f"Processed: {stats.processed_criteria} "
-                    f"Failed checks: {stats.failed_criteria} "
-                    f"Failed resources: {stats.failed_resources}"
-                )
-            )
 
-            audit.criteria_processed = stats.processed_criteria
-            audit.criteria_passed = stats.processed_criteria - stats.failed_criteria
-            audit.criteria_failed = stats.failed_criteria
-            audit.issues_found = stats.failed_resources
-            audit.finished = stats.active_criteria == stats.attempted_criteria
-
-            if audit.finished:
-                audit.date_completed = datetime.now()
-                message_data = audit.serialize()
-                audit_criteria = (
-                    models.AuditCriterion.select()
-                    .join(models.AccountAudit)
-                    .where(models.AccountAudit.id == audit.id)
-                )
-                criteria_data = []
-                for criteria in audit_criteria:
-                    criteria_data.append(criteria.serialize())
-                message_data["criteria"] = criteria_data
-                failed_resources = (
-                    models.ResourceCompliance.select()
-                    .join(models.AuditResource)
-                    .join(models.AccountAudit)
-                    .where(
-                        models.ResourceCompliance.status_id == 3,
-                        models.AccountAudit.id == audit.id,
-                    )
+def is_region_mode():
+    """
+    In region mode a regional criterion is split into one message per
+    region so its regions are evaluated concurrently by separate
+    invocations and it takes about as long as its slowest region
+    """
+    return os.environ.get("CSW_REGION_MESSAGES", "").lower() in ["1", "true"]
+
+
+def is_delta_mode():
+    """
+    In delta mode resources unchanged since the last audit are not evaluated
+    again and their records reference the data stored by the earlier audit
+    instead of storing another copy
+    """
+    return os.environ.get("CSW_DELTA_AUDITS", "").lower() in ["1", "true"]
+
+
+def carry_forward(previous, data_hash):
+    """
+    Return the compliance of an unchanged resource from its previous
+    evaluation or None if the resource has to be evaluated.
+    Only passed and failed results are carried forward. Resources passed
+    by exception are evaluated again since the exception may have expired
+    and the exception is applied to failed resources as usual.
+    """
+    if previous is None or previous["data_hash"] != data_hash:
+        return None
+    if previous["compliance"]["status_id"] not in [2, 3]:
+        return None
+    compliance = previous["compliance"].copy()
+    compliance["annotation"] = compliance["annotation"] or ""
+    return compliance
+
+
+def evaluate_request(
+    audit, audit_criterion, criterion, check, params, data, exception_index, timer=None
+):
+    """
+    Evaluate the data returned for one request (usually one region)
+    then write the resources and the region checkpoint in one transaction.
+    In delta mode resources unchanged since the last audit carry their
+    previous compliance forward.
+    Returns whether the check passed for the request and its summary.
+    """
+    if timer is None:
+        timer = AuditTimer(app, audit.id)
+    region = params.get("region")
+    start = timer.clock()
+    is_all = check.aggregation_type == "all"
+    check_passed = is_all
+    evaluated = []
+    previous_evaluations = None
+    if is_delta_mode():
+        previous_evaluations = models.AuditResource.get_previous_evaluations(
+            audit, criterion.id, params.get("region")
+        )
+    for api_response_item in data:
+        compliance = None
+        audit_resource_item = None
+        data_hash = None
+        if previous_evaluations is not None:
+            # hashed before evaluate which may add to the item
+            data_hash = check.get_data_hash(api_response_item)
+        if previous_evaluations:
+            audit_resource_item = check.build_audit_resource_item(
+                api_item=api_response_item,
+                audit=audit,
+                criterion=criterion,
+                params=params,
+            )
+            audit_resource_item["data_hash"] = data_hash
+            previous = previous_evaluations.get(
+                audit_resource_item["resource_persistent_id"]
+            )
+            compliance = carry_forward(previous, data_hash)
+            if compliance is not None:
+                # reference the stored data instead of storing another copy
+                audit_resource_item["resource_data"] = None
+                audit_resource_item["carried_from_id"] = previous["data_id"]
+        if compliance is None:
+            compliance = check.evaluate({}, api_response_item)
+        app.log.debug(app.utilities.to_json(compliance))
+
+        item_passed = compliance["status_id"] == 2
+
+        # for "any" type checks only passed resources need to be recorded
+        # individual failed resources are irrelevant for any checks.
+        if is_all or item_passed:
+
+            if audit_resource_item is None:
+                audit_resource_item = check.build_audit_resource_item(
+                    api_item=api_response_item,
+                    audit=audit,
+                    criterion=criterion,
+                    params=params,
                 )
-                resources_data = []
-                for resource in failed_resources:
-                    resources_data.append(resource.serialize())
-                message_data["failed_resources"] = resources_data
-                # create SQS message
-                queue_url = sqs.get_queue_url(f"{app.prefix}-completed-audit-queue")
-                app.log.debug("Retrieved queue url: " + queue_url)
-                message_body = app.utilities.to_json(message_data)
-                try:
-                    latest = models.AccountLatestAudit.get(
-                        models.AccountLatestAudit.account_subscription_id
-                        == audit.account_subscription_id
-                    )
-                    latest.account_audit_id = audit
-                    latest.save()
-                except models.AccountLatestAudit.DoesNotExist:
-                    latest = models.AccountLatestAudit.create(
-                        account_subscription_id=audit.account_subscription_id,
-                        account_audit_id=audit,
-                    )
-                app.log.debug(
-                    "latest_audit: " + app.utilities.to_json(latest.serialize())
+                if data_hash is not None:
+                    audit_resource_item["data_hash"] = data_hash
+
+            # only check exception status for failed resources
+            if not item_passed:
+                # insert exception handling here so we catch failed exceptions before they
+                # change the status of the check
+                # potentially change the item_passed status before updating check_passed
+                exception = exception_index.get_exception(
+                    audit_resource_item["resource_persistent_id"]
                 )
-                message_id = sqs.send_message(
-                    queue_url, message_body
-                )  # TODO: unecessary assignment?
-            audit.save()
-    except Exception as err:
-        app.log.error(str(err))
-    return status
+
+                if exception is not None:
+                    item_passed = True
+                    compliance["status_id"] = 4
+                    compliance["is_compliant"] = True
+                    compliance["compliance_type"] = "COMPLIANT"
+                    compliance[
+                        "annotation"
+                    ] += f"<p>[Passed by exception: {exception.reason}]</p>"
+
+            audit_resource_item["resource_compliance"] = compliance
+            evaluated.append(audit_resource_item)
+
+        # update check passed status
+        check_passed = (
+            (check_passed and item_passed) if is_all else (check_passed or item_passed)
+        )
+
+    summary = check.summarize(evaluated)
+    timer.record("evaluate", (timer.clock() - start) * 1000, criterion.id, region)
+
+    # Records left by an earlier attempt which did not complete the region are
+    # replaced so that a redelivered message does not duplicate them.
+    # The writer populates the compliance foreign keys.
+    db_write = timer.span("db_write", criterion.id, region)
+    with db_write, models.AuditCriterionRegion._meta.database.atomic():
+        models.AuditResource.delete_evaluated(audit.id, criterion.id, region)
+        writer = models.AuditResourceWriter()
+        for audit_resource_item in evaluated:
+            writer.add(audit_resource_item, audit_resource_item["resource_compliance"])
+        writer.flush()
+        models.AuditCriterionRegion.complete(
+            audit_criterion.id, get_region_key(params), check_passed, summary
+        )
+    return check_passed, summary
+
+
+@app.on_sqs_message(queue=f"{app.prefix}-evaluated-metric-queue")
+def audit_evaluated_metric(event):
+    sqs = GdsSqsClient(app)
+    return process_message_batch(
+        event,
+        f"{app.prefix}-evaluated-metric-queue",
+        lambda message: record_evaluated_metric(sqs, message),
+    )
+
+
+def record_evaluated_metric(sqs, message):
+    """
+    Add an evaluated audit criterion to the audit stats
+    and complete the audit once every criterion has been attempted
+    """
+    audit_criteria_data = json.loads(message.body)
+    account_audit_id = audit_criteria_data["account_audit_id"]["id"]
+    processed = audit_criteria_data.get("processed", False)
+    failed_resources = audit_criteria_data.get("failed") or 0
+    criterion_id = audit_criteria_data["criterion_id"]["id"]
+    timer = AuditTimer(app, account_audit_id)
+    timer.record_queue_wait(message, criterion_id)
+
+    try:
+        # add this criterion to the audit stats without recounting
+        # every audit criterion record in the audit
+        # a redelivered message is only counted once
+        with timer.span("record_metric", criterion_id):
+            counted = models.AccountAudit.record_criterion_result(
+                account_audit_id, processed, failed_resources, audit_criteria_data["id"]
+            )
+        if not counted:
+            app.log.debug(f"Audit criterion {audit_criteria_data['id']} already counted")
+        app.log.debug(
+            (
+                f"Processed: {processed} "
+                f"Failed resources: {failed_resources}"
+            )
+        )
+
+        # only one message can flip the finished flag so the
+        # completed audit is only sent once
+        if models.AccountAudit.mark_finished(account_audit_id):
+            send_completed_audit(sqs, models.AccountAudit.get_by_id(account_audit_id))
+        elif not counted:
+            # the message which finished the audit may have failed
+            # before the completed audit was sent
+            audit = models.AccountAudit.get_by_id(account_audit_id)
+            if audit.finished and not audit.completion_sent:
+                app.log.debug(f"Sending completed audit {account_audit_id} again")
+                send_completed_audit(sqs, audit)
+    finally:
+        timer.flush()
+
+
+def send_completed_audit(sqs, audit):
+    """
+    Update the latest audit and send the completed audit message.
+    A partial audit is merged with the latest audit first so the message
+    has a result for every criterion.
+    The audit is only flagged as sent once the message has been accepted
+    so a failure is raised to be retried when the result is redelivered.
+    """
+    merged = merge_partial_audit(audit) if audit.partial else None
+    if merged is not None:
+        audit = merged
+    message_data = get_completed_audit_message(audit)
+    # create SQS message
+    queue_url = sqs.get_queue_url(f"{app.prefix}-completed-audit-queue")
+    app.log.debug("Retrieved queue url: " + str(queue_url))
+    message_body = app.utilities.to_json(message_data)
+    if not audit.partial or merged is not None:
+        update_latest_audit(audit)
+    if queue_url is None or sqs.send_message(queue_url, message_body) is None:
+        raise RetryableError("Failed to send completed audit message")
+    models.AccountAudit.mark_completion_sent(audit.id)
+
+
+def merge_partial_audit(audit):
+    """
+    A partial audit only evaluates the criteria which were due. It takes
+    the results of the other criteria from the account's latest audit and
+    replaces it so the results of the frequent criteria are shown as soon
+    as they are evaluated.
+    Returns the merged audit with its stats updated, or None if the account
+    has no earlier latest audit to merge.
+    """
+    latest = audit.account_subscription_id.get_latest_audit()
+    if latest is None or latest.id > audit.id:
+        return None
+    # the latest audit is already this audit when the message is sent again
+    if latest.id < audit.id:
+        carried = audit.carry_forward_criteria(latest)
+        app.log.debug(f"Carried {carried} audit criteria forward from audit {latest.id}")
+    return models.AccountAudit.get_by_id(audit.id)
+
+
+def update_latest_audit(audit):
+    try:
+        latest = models.AccountLatestAudit.get(
+            models.AccountLatestAudit.account_subscription_id
+            == audit.account_subscription_id
+        )
+        latest.account_audit_id = audit
+        latest.save()
+    except models.AccountLatestAudit.DoesNotExist:
+        latest = models.AccountLatestAudit.create(
+            account_subscription_id=audit.account_subscription_id,
+            account_audit_id=audit,
+        )
+    app.log.debug(
+        "latest_audit: " + app.utilities.to_json(latest.serialize())
+    )
+
+
+def get_completed_audit_message(audit):
+    """
+    Build the completed audit message with every audit criterion and failed resource.
+    In claim-check mode the full payload is written to the blob store
+    and the message only contains the audit stats and a pointer to the payload.
+    """
+    message_data = audit.serialize()
+    audit_criteria = (
+        models.AuditCriterion.select()
+        .join(models.AccountAudit)
+        .where(models.AccountAudit.id == audit.id)
+    )
+    criteria_data = []
+    for criteria in audit_criteria:
+        criteria_data.append(criteria.serialize())
+    message_data["criteria"] = criteria_data
+    failed_resources = (
+        models.ResourceCompliance.select()
+        .join(models.AuditResource)
+        .join(models.AccountAudit)
+        .where(
+            models.ResourceCompliance.status_id == 3,
+            models.AccountAudit.id == audit.id,
+        )
+    )
+    resources_data = []
+    for resource in failed_resources:
+        resources_data.append(resource.serialize())
+    message_data["failed_resources"] = resources_data
+
+    store = get_blob_store(app)
+    if store is not None:
+        account_id = audit.account_subscription_id.account_id
+        key = f"completed-audit/{account_id}/{audit.id}.json"
+        location = store.put(key, app.utilities.to_json(message_data))
+        app.log.debug("Completed audit payload stored at: " + location)
+        message_data = audit.serialize()
+        message_data["claim_check"] = {"key": key, "location": location}
+        message_data["criteria_count"] = len(criteria_data)
+        message_data["failed_resources_count"] = len(resources_data)
+    return message_data
 
 
 def get_default_audit_account_list():
@@ -539,3 +1465,7 @@ if os.environ["CSW_ENV"] == "prod":
         SUSPENDED accounts are switched to inactive.
         """
         update_subscriptions()
+
+
+if is_prewarm_mode():
+    prewarm_lambda_services()
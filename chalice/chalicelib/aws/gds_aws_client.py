@@ -1,17 +1,50 @@
 # GdsAwsClient
 # Manage sts assume-role calls and temporary credentials
-import boto3
 import os
 import re
+import threading
 from datetime import datetime
+from functools import partial
+
+from chalicelib.aws.gds_batch_loader import GdsBatchLoader
+from chalicelib.aws.gds_boto_session import boto_session
+from chalicelib.aws.gds_client_pool import client_pool
+from chalicelib.aws.gds_credential_cache import credential_cache
+from chalicelib.aws.gds_enrichment_executor import enrichment_executor
+from chalicelib.aws.gds_metadata_cache import metadata_cache
+from chalicelib.aws.gds_rate_limiter import rate_limiter
 
 
 class GdsAwsClient:
 
-    # initialise empty dictionaries for clients and assume role sessions
+    # initialise empty dictionary for resources
     resources = dict()
-    clients = dict()
-    sessions = dict()
+    # process-wide cache of assumed role sessions keyed by session name
+    credentials = credential_cache
+    # process-wide boto3 session every client and resource is created from
+    boto_session = boto_session
+    # process-wide pool of boto3 clients reused for the same credentials
+    client_pool = client_pool
+    # seconds before the credentials expire that their clients are evicted
+    credential_expiry_margin = 60
+
+    # process-wide cache for slow changing metadata shared by all clients
+    metadata = metadata_cache
+    # seconds before cached metadata is fetched again
+    chain_role_params_ttl = 3600
+    caller_identity_ttl = 3600
+    # held while boto3 resources are created
+    client_lock = threading.RLock()
+    # process-wide rate limiting and retry policy for every client created
+    rate_limiter = rate_limiter
+    # items requested per page by paginate for each operation
+    # operations not listed use the service's default page size
+    page_sizes = dict()
+    # pages and items returned by paginate for each operation
+    pagination_stats = dict()
+    pagination_lock = threading.Lock()
+    # process-wide thread pool for the follow-up calls made for each item
+    enrichment = enrichment_executor
 
     resource_type = "AWS::*::*"
     annotation = ""
@@ -19,6 +52,8 @@ class GdsAwsClient:
     def __init__(self, app=None):
         self.app = app
         self.chain = {}
+        # batch loaders by name, kept for the life of the client
+        self.batch_loaders = dict()
         # self.get_chain_role_params()
 
     def get_chain_role_params(self):
@@ -27,27 +62,38 @@ class GdsAwsClient:
         """
         if self.chain == {}:
             # Only get the SSM params if they're not
-            # already populated into self.chain
-            params = {
-                "/csw/chain/account": "account",
-                "/csw/chain/chain_role": "chain_role",
-                "/csw/chain/target_role": "target_role",
-            }
+            # already populated into self.chain or the
+            # process-wide metadata cache
+            self.chain = self.metadata.get(
+                ("ssm", "chain_role_params"),
+                self.load_chain_role_params,
+                self.chain_role_params_ttl,
+            ).copy()
+
+        return self.chain
 
-            # Get list of SSM parameter names from dict
-            param_list = list(params.keys())
+    def load_chain_role_params(self):
+        params = {
+            "/csw/chain/account": "account",
+            "/csw/chain/chain_role": "chain_role",
+            "/csw/chain/target_role": "target_role",
+        }
 
-            ssm = boto3.client("ssm")
+        # Get list of SSM parameter names from dict
+        param_list = list(params.keys())
 
-            # Get all listed parameters in one API call
-            response = ssm.get_parameters(Names=param_list, WithDecryption=True)
+        ssm = self.get_pooled_client("ssm")
 
-            for item in response["Parameters"]:
-                param_name = params[item["Name"]]
-                param_value = item["Value"]
-                self.chain[param_name] = param_value
+        # Get all listed parameters in one API call
+        response = ssm.get_parameters(Names=param_list, WithDecryption=True)
 
-        return self.chain
+        chain = {}
+        for item in response["Parameters"]:
+            param_name = params[item["Name"]]
+            param_value = item["Value"]
+            chain[param_name] = param_value
+
+        return chain
 
     def to_camel_case(self, source_string, capitalize_first=True):
 
@@ -76,48 +122,45 @@ class GdsAwsClient:
             session_name = f"{account}-{role}"
         return session_name
 
-    # create clients once and reuse - store by client name
-    # which encompasses the account, role and service
-    # {account-number}-{role-name}-{region}-{service}
-    # eg: 779799343306-AdminRole-eu-west-2-s3
-    def get_client_name(self, service_name, session_name="default", region="eu-west-1"):
-        return f"{session_name}-{region}-{service_name}"
+    # creates a boto3.client registered with the rate limiter
+    # using the session credentials or the environment credentials if None
+    def create_client(self, service_name, session=None, region=None, account="default"):
+
+        credentials = {}
+        if session is not None:
+            credentials = {
+                "aws_access_key_id": session["AccessKeyId"],
+                "aws_secret_access_key": session["SecretAccessKey"],
+                "aws_session_token": session["SessionToken"],
+            }
+            account = session.get("Account", account)
+
+        client = self.boto_session.client(
+            service_name,
+            region_name=region,
+            config=self.rate_limiter.get_client_config(),
+            **credentials,
+        )
+        return self.rate_limiter.register(client, account)
 
     # gets a boto3.client class for the given service, account and role
-    # if the client has already been defined in self.clients it is
-    # reused instead of creating a new instance
+    # from the client pool
     def get_boto3_client(self, service_name, account="default", role="", region=None):
 
         session_name = self.get_session_name(account, role)
-        client_name = self.get_client_name(service_name, session_name, region)
-
-        if client_name not in self.clients:
-
-            if session_name == "default":
-                client = self.get_default_client(service_name, region)
 
-            else:
-                client = self.get_assumed_client(service_name, account, role, region)
+        if session_name == "default":
+            client = self.get_default_client(service_name, region)
 
         else:
-            client = self.clients[client_name]
+            client = self.get_assumed_client(service_name, account, role, region)
 
         return client
 
     # gets a boto3.client with the default credentials
     def get_default_client(self, service_name, region=None):
 
-        client_name = self.get_client_name(service_name, "default", region)
-
-        # self.clients[client_name] = boto3.client(service_name) #, **creds)
-        self.clients[client_name] = boto3.client(
-            service_name,
-            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-            aws_session_token=os.environ["AWS_SESSION_TOKEN"],
-            region_name=region,
-        )
-        return self.clients[client_name]
+        return self.get_pooled_client(service_name, self.get_default_session(), region)
 
     def get_default_session(self):
         session = {
@@ -131,36 +174,105 @@ class GdsAwsClient:
     # resulting from sts assume-role command
     def get_assumed_client(self, service_name, account="default", role="", region=None):
 
-        session_name = self.get_session_name(account, role)
-        client_name = self.get_client_name(service_name, session_name)
-
         session = self.get_session(account, role)
-        self.clients[client_name] = boto3.client(
-            service_name,
-            aws_access_key_id=session["AccessKeyId"],
-            aws_secret_access_key=session["SecretAccessKey"],
-            aws_session_token=session["SessionToken"],
-            region_name=region,
-        )
 
-        return self.clients[client_name]
+        return self.get_pooled_client(service_name, session, region, account)
 
     def get_boto3_session_client(self, service_name, session, region=None):
 
-        client = boto3.client(
-            service_name,
-            aws_access_key_id=session["AccessKeyId"],
-            aws_secret_access_key=session["SecretAccessKey"],
-            aws_session_token=session["SessionToken"],
-            region_name=region,
+        return self.get_pooled_client(service_name, session, region, "session")
+
+    def get_pooled_client(self, service_name, session=None, region=None, account="default"):
+        """
+        Return the pooled client for the credentials, service and region
+        creating it if there isn't one.
+        Credentials are identified by their access key id so every session
+        assumed for an account gets its own clients.
+        """
+        return self.client_pool.get(
+            (self.get_credential_identity(session), service_name, region),
+            lambda: self.create_client(service_name, session, region, account),
+            self.get_credential_expiry(session),
         )
 
-        return client
+    def get_credential_identity(self, session):
+        return "environment" if session is None else session["AccessKeyId"]
+
+    def get_credential_expiry(self, session):
+        """
+        The client pool clock time credential_expiry_margin seconds before
+        the session credentials expire or None if they do not expire
+        """
+        if session is None or session.get("Expiration") is None:
+            return None
+        expiration = session["Expiration"]
+        remaining = (expiration - datetime.now(expiration.tzinfo)).total_seconds()
+        return self.client_pool.clock() + remaining - self.credential_expiry_margin
+
+    def paginate(self, client, operation_name, result_key, page_size=None, **kwargs):
+        """
+        Yield the items of a list or describe call one page at a time.
+        Every page is requested so large accounts are not truncated to
+        the first page and only one page is held in memory at once.
+        page_size overrides page_sizes for the operation.
+        Operations the service does not paginate are called once.
+        """
+        if page_size is None:
+            page_size = self.page_sizes.get(operation_name)
+        if client.can_paginate(operation_name):
+            pagination_config = {}
+            if page_size is not None:
+                pagination_config["PageSize"] = page_size
+            paginator = client.get_paginator(operation_name)
+            pages = paginator.paginate(PaginationConfig=pagination_config, **kwargs)
+        else:
+            pages = [getattr(client, operation_name)(**kwargs)]
+        for page in pages:
+            items = page.get(result_key, [])
+            self.count_page(operation_name, len(items))
+            yield from items
+
+    @classmethod
+    def count_page(cls, operation_name, item_count):
+        with cls.pagination_lock:
+            stats = cls.pagination_stats.setdefault(operation_name, {"pages": 0, "items": 0})
+            stats["pages"] += 1
+            stats["items"] += item_count
+
+    @classmethod
+    def get_pagination_stats(cls):
+        with cls.pagination_lock:
+            return {
+                operation_name: stats.copy()
+                for operation_name, stats in cls.pagination_stats.items()
+            }
+
+    def enrich(self, items, fetch, on_error=None):
+        """
+        Call fetch(item) for each item on the enrichment executor
+        and return the results in item order
+        """
+        return self.enrichment.map(fetch, items, on_error)
+
+    def get_batch_loader(self, name, fetch_many, max_batch_size=None):
+        """
+        The client's GdsBatchLoader for name, created on first use
+        so the ids requested while the client is used are batched
+        """
+        with self.client_lock:
+            if name not in self.batch_loaders:
+                self.batch_loaders[name] = GdsBatchLoader(fetch_many, max_batch_size)
+            return self.batch_loaders[name]
 
     def get_boto3_resource(self, resource_name):
 
-        if resource_name not in self.resources:
-            self.resources[resource_name] = boto3.resource(resource_name)
+        with self.client_lock:
+            if resource_name not in self.resources:
+                resource = self.boto_session.resource(
+                    resource_name, config=self.rate_limiter.get_client_config()
+                )
+                self.rate_limiter.register(resource.meta.client)
+                self.resources[resource_name] = resource
 
         return self.resources[resource_name]
 
@@ -168,8 +280,24 @@ class GdsAwsClient:
     def assume_role(
         self, account, role, session=None, is_lambda=True, email="", token=""
     ):
+        try:
+            credentials = self.load_session(account, role, session, is_lambda, email, token)
+            self.credentials.set(self.get_session_name(account, role), credentials)
+            role_assumed = True
+        except Exception as exception:
+            print(exception)
+            role_assumed = False
+
+        return role_assumed
 
+    def load_session(
+        self, account, role, session=None, is_lambda=True, email="", token=""
+    ):
         """
+        Issue the sts assume-role command and return the temporary
+        credentials with the account they are for
+        Raises an exception if the role could not be assumed
+
         Example response
         {
             'Credentials': {
@@ -185,109 +313,88 @@ class GdsAwsClient:
             'PackedPolicySize': 123
         }
         """
-        try:
-            # force account to be 12 character string with leading zeros.
-            if account != "default":
-                account = str(account).rjust(12, "0")
-            self.app.log.debug(f"Assuming to account: {account} with role: {role}")
-
-            if session is None:
-                sts = self.get_boto3_client("sts")
-            else:
-                sts = self.get_boto3_session_client("sts", session)
-
-            role_arn = f"arn:aws:iam::{account}:role/{role}"
-            print(f"Assume role: {role_arn}")
-
-            session_name = self.get_session_name(account, role)
-
-            # if in a lambda context the right to assume the role
-            # is granted to the lambda function so no further
-            # authentication is required
-            if is_lambda:
-                assumed_credentials = sts.assume_role(
-                    RoleSessionName=session_name, RoleArn=role_arn
-                )
+        # force account to be 12 character string with leading zeros.
+        if account != "default":
+            account = str(account).rjust(12, "0")
+        self.app.log.debug(f"Assuming to account: {account} with role: {role}")
 
-            # in a command line context the MFA serial and token
-            # are used to authenticate the user credentials
-            else:
-                mfa_serial = f"arn:aws:iam::622626885786:mfa/{email}"
-                assumed_credentials = sts.assume_role(
-                    RoleSessionName=session_name,
-                    RoleArn=role_arn,
-                    SerialNumber=mfa_serial,
-                    TokenCode=token,
-                )
+        if session is None:
+            sts = self.get_boto3_client("sts")
+        else:
+            sts = self.get_boto3_session_client("sts", session)
 
-            role_assumed = "Credentials" in assumed_credentials.keys()
+        role_arn = f"arn:aws:iam::{account}:role/{role}"
+        print(f"Assume role: {role_arn}")
 
-            if role_assumed:
-                expiry = assumed_credentials["Credentials"]["Expiration"].strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                )
-                self.app.log.debug("Session expiry: " + expiry)
-                # self.app.log.debug('Time now: ' + datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
-                self.sessions[session_name] = assumed_credentials["Credentials"]
-            else:
-                raise Exception("Assume role failed")
+        session_name = self.get_session_name(account, role)
 
-        except Exception as exception:
-            print(exception)
-            role_assumed = False
+        # if in a lambda context the right to assume the role
+        # is granted to the lambda function so no further
+        # authentication is required
+        if is_lambda:
+            assumed_credentials = sts.assume_role(
+                RoleSessionName=session_name, RoleArn=role_arn
+            )
 
-        return role_assumed
+        # in a command line context the MFA serial and token
+        # are used to authenticate the user credentials
+        else:
+            mfa_serial = f"arn:aws:iam::622626885786:mfa/{email}"
+            assumed_credentials = sts.assume_role(
+                RoleSessionName=session_name,
+                RoleArn=role_arn,
+                SerialNumber=mfa_serial,
+                TokenCode=token,
+            )
+
+        if "Credentials" not in assumed_credentials.keys():
+            raise Exception("Assume role failed")
+
+        expiry = assumed_credentials["Credentials"]["Expiration"].strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        self.app.log.debug("Session expiry: " + expiry)
+        # the account identifies the rate limiter buckets
+        # for clients created with the session
+        return dict(assumed_credentials["Credentials"], Account=account)
 
     def get_caller_details(self, session=None):
         """
         Get the role and account id assumed by the current session credentials
+        The identity of the default credentials is cached process-wide
         :param session:
         :return:
         """
         caller_details = None
         try:
             if session is None:
-                sts = boto3.client("sts")
-            else:
-                sts = boto3.client(
-                    "sts",
-                    aws_access_key_id=session["AccessKeyId"],
-                    aws_secret_access_key=session["SecretAccessKey"],
-                    aws_session_token=session["SessionToken"],
+                caller_details = self.metadata.get(
+                    ("sts", "caller_identity", "default"),
+                    self.load_caller_identity,
+                    self.caller_identity_ttl,
                 )
-
-            caller_details = sts.get_caller_identity()
+            else:
+                caller_details = self.load_caller_identity(session)
         except Exception as err:
             self.app.log.error("Failed to get caller details: " + str(err))
             pass
 
         return caller_details
 
-    # get_session returns the existing session if it already exists
-    # or assumes the role and returns the new session if it doesn't
-    def get_session(self, account="default", role="", session=None):
-
-        try:
-            session_name = self.get_session_name(account, role)
-            valid = False
-
-            if session_name in self.sessions.keys():
-                session = self.sessions[session_name]
-                valid = True
+    def load_caller_identity(self, session=None):
+        sts = self.get_pooled_client("sts", session)
 
-                expiry = session["Expiration"].strftime("%Y-%m-%d %H:%M:%S")
-                now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-                if expiry < now:
-                    self.sessions[session_name] = None
-                    valid = False
+        return sts.get_caller_identity()
 
-            if not valid:
-
-                assumed = self.assume_role(account, role, session)
-                if not assumed:
-                    raise Exception("Assume role failed")
+    # get_session returns the cached session if it is still valid
+    # or assumes the role and returns the new session if it isn't
+    def get_session(self, account="default", role="", session=None):
 
-            session = self.sessions[session_name]
+        try:
+            session = self.credentials.get(
+                self.get_session_name(account, role),
+                partial(self.load_session, account, role, session),
+            )
 
         except Exception as exception:
             self.app.log.error(str(exception))
@@ -302,19 +409,7 @@ class GdsAwsClient:
         assumes complete successfully
         return: bool
         """
-        assumed = False
-        chain = self.get_chain_role_params()
-        try:
-            chain_assumed = self.assume_role(chain["account"], chain["chain_role"])
-            if chain_assumed:
-                chain_session = self.get_session(chain["account"], chain["chain_role"])
-                assumed = self.assume_role(
-                    target_account, chain["target_role"], session=chain_session
-                )
-        except Exception:
-            self.app.log.error(self.app.utilities.get_typed_exception())
-
-        return assumed
+        return self.get_chained_session(target_account) is not None
 
     def get_chained_session(self, target_account):
         """
@@ -326,17 +421,31 @@ class GdsAwsClient:
         target_session = None
         try:
             chain = self.get_chain_role_params()
-            chain_assumed = self.assume_role(chain["account"], chain["chain_role"])
-            if chain_assumed:
-                chain_session = self.get_session(chain["account"], chain["chain_role"])
-                target_session = self.get_session(
-                    target_account, chain["target_role"], session=chain_session
+            chain_session = self.get_session(chain["account"], chain["chain_role"])
+            if chain_session is not None:
+                target_session = self.credentials.get(
+                    self.get_session_name(target_account, chain["target_role"]),
+                    partial(self.load_chained_session, target_account, chain),
                 )
+            else:
+                # the chain parameters may have changed since they were cached
+                self.metadata.invalidate(("ssm", "chain_role_params"))
         except Exception:
             self.app.log.error(self.app.utilities.get_typed_exception())
 
         return target_session
 
+    def load_chained_session(self, target_account, chain):
+        """
+        Assume the target role with the chain session current when the
+        target session is loaded, which may be a background refresh
+        after the chain session it was first assumed with has expired
+        """
+        chain_session = self.get_session(chain["account"], chain["chain_role"])
+        if chain_session is None:
+            raise Exception("Assume chain role failed")
+        return self.load_session(target_account, chain["target_role"], chain_session)
+
     def parse_arn_components(self, arn):
 
         # arn:aws:[service]:[region]:[account]:[resource]
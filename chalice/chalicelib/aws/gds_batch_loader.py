@@ -0,0 +1,129 @@
+"""
+GdsBatchLoader
+Coalesce lookups of single ids into multi-id API calls
+
+Callers ask for one id at a time, eg a security group by id, and get a
+future back straight away. The ids requested for the same batch key
+(eg credentials and region) are collected until the first caller asks
+for a result, then fetched together by one fetch_many call:
+
+    loader = GdsBatchLoader(describe_groups)
+    groups = [loader.load(region, group_id, session, region) for group_id in ids]
+    # one describe_groups(session, region, ids) call
+    groups = [group.result() for group in groups]
+
+GdsEnrichmentExecutor.map resolves futures returned by fetch once every
+item has been fetched, so per item lookups made through enrich are
+batched the same way.
+
+Results are cached for the life of the loader. Gds*Clients keep their
+loaders per client instance so the cache lasts for a criterion run.
+"""
+import threading
+from concurrent.futures import Future
+
+
+class GdsBatchResult(Future):
+    """
+    A future for one id which fetches its batch when the result is needed
+    """
+
+    def __init__(self, loader=None, batch=None):
+        super(GdsBatchResult, self).__init__()
+        self.loader = loader
+        self.batch = batch
+
+    def result(self, timeout=None):
+        if self.batch is not None:
+            self.loader.dispatch(self.batch)
+        return super(GdsBatchResult, self).result(timeout)
+
+
+class GdsBatch:
+    def __init__(self, batch_key, args):
+        self.batch_key = batch_key
+        self.args = args
+        self.results = dict()
+        self.dispatched = False
+        self.lock = threading.Lock()
+
+
+class GdsBatchLoader:
+
+    max_batch_size = 100
+
+    def __init__(self, fetch_many, max_batch_size=None):
+        """
+        :param fetch_many: function called with the args of the first load
+            in the batch followed by the list of ids, returning a dict of
+            the results by id. Ids missing from the dict resolve to None.
+        """
+        self.fetch_many = fetch_many
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+        self.cache = dict()
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"loads": 0, "hits": 0, "batches": 0, "ids": 0}
+
+    def load(self, batch_key, item_id, *args):
+        """
+        Return a future for item_id, adding it to the pending batch for batch_key
+        :param args: passed to fetch_many if this load starts the batch
+        """
+        with self.lock:
+            self.stats["loads"] += 1
+            if (batch_key, item_id) in self.cache:
+                self.stats["hits"] += 1
+                return self.cache[(batch_key, item_id)]
+
+            batch = self.pending.get(batch_key)
+            if batch is None:
+                batch = GdsBatch(batch_key, args)
+                self.pending[batch_key] = batch
+            result = GdsBatchResult(self, batch)
+            batch.results[item_id] = result
+            self.cache[(batch_key, item_id)] = result
+            if len(batch.results) >= self.max_batch_size:
+                # later ids start a new batch
+                del self.pending[batch_key]
+        return result
+
+    def get(self, batch_key, item_id, *args):
+        return self.load(batch_key, item_id, *args).result()
+
+    def dispatch(self, batch):
+        """
+        Fetch the ids in the batch unless it has already been fetched
+        """
+        with batch.lock:
+            if batch.dispatched:
+                return
+            batch.dispatched = True
+            with self.lock:
+                if self.pending.get(batch.batch_key) is batch:
+                    del self.pending[batch.batch_key]
+                self.stats["batches"] += 1
+                self.stats["ids"] += len(batch.results)
+
+            try:
+                fetched = self.fetch_many(*batch.args, list(batch.results.keys()))
+            except Exception as err:
+                with self.lock:
+                    # failed lookups are not cached so can be tried again
+                    for item_id, result in batch.results.items():
+                        if self.cache.get((batch.batch_key, item_id)) is result:
+                            del self.cache[(batch.batch_key, item_id)]
+                for result in batch.results.values():
+                    result.set_exception(err)
+                return
+
+            for item_id, result in batch.results.items():
+                result.set_result(fetched.get(item_id))
+
+    def get_stats(self):
+        with self.lock:
+            return self.stats.copy()
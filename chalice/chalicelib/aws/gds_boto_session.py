@@ -0,0 +1,83 @@
+"""
+GdsBotoSession
+One boto3 session shared by every Gds*Client in the process
+
+The first client created for a service loads and parses its JSON models
+which takes tens of milliseconds for the larger services like EC2.
+Each session's loader keeps the parsed models so clients created from
+the same session later only take a few milliseconds. Every client and
+resource is created from the one session instead of boto3's lazily
+created default session, which is not thread-safe.
+
+prewarm() loads the models of the services a lambda uses while its
+container is initialised so the first event does not pay for them.
+"""
+import threading
+import time
+
+import boto3
+
+
+class GdsBotoSession:
+
+    # the models are the same in every region so any region is prewarmed
+    prewarm_region = "eu-west-2"
+    # prewarmed clients are thrown away so never need real credentials
+    prewarm_credentials = {
+        "aws_access_key_id": "prewarm",
+        "aws_secret_access_key": "prewarm",
+        "aws_session_token": "prewarm",
+    }
+
+    def __init__(self, create_session=boto3.session.Session):
+        self.create_session = create_session
+        self.session = None
+        # boto3 sessions are not thread-safe so clients and resources
+        # are created while holding the lock
+        self.lock = threading.RLock()
+        # milliseconds taken to load each prewarmed service
+        self.prewarmed = dict()
+
+    def get_session(self):
+        with self.lock:
+            if self.session is None:
+                self.session = self.create_session()
+            return self.session
+
+    def client(self, service_name, **kwargs):
+        with self.lock:
+            return self.get_session().client(service_name, **kwargs)
+
+    def resource(self, resource_name, **kwargs):
+        with self.lock:
+            return self.get_session().resource(resource_name, **kwargs)
+
+    def prewarm(self, service_names):
+        """
+        Load the models of the services not already prewarmed by creating
+        a client for each
+        :param service_names: list of boto3 service names eg ["ec2", "iam"]
+        :return: dict of milliseconds taken for each service loaded
+        """
+        loaded = dict()
+        for service_name in service_names:
+            with self.lock:
+                if service_name in self.prewarmed:
+                    continue
+                start = time.perf_counter()
+                self.client(
+                    service_name,
+                    region_name=self.prewarm_region,
+                    **self.prewarm_credentials,
+                )
+                loaded[service_name] = round((time.perf_counter() - start) * 1000, 1)
+                self.prewarmed[service_name] = loaded[service_name]
+        return loaded
+
+    def get_stats(self):
+        with self.lock:
+            return {"prewarmed": self.prewarmed.copy()}
+
+
+# Shared by every Gds*Client in the process
+boto_session = GdsBotoSession()
@@ -0,0 +1,99 @@
+"""
+GdsClientPool
+A process-wide pool of boto3 clients shared by every Gds*Client
+
+Creating a boto3 client loads the service model so costs tens of
+milliseconds. Clients are reused for the same credentials, service and
+region instead of being created for every call, eg for every KMS key or
+S3 bucket whose details are fetched.
+
+Warm lambda containers audit many accounts so the pool is bounded.
+The least recently used client is evicted when the pool is full and
+clients are evicted once the credentials they were created with expire.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class GdsClientPool:
+
+    max_size = 128
+
+    def __init__(self, max_size=None, clock=time.monotonic):
+        if max_size is not None:
+            self.max_size = max_size
+        self.clock = clock
+        self.clients = OrderedDict()
+        # boto3 client creation is not thread-safe so clients are
+        # created while holding the lock
+        self.lock = threading.RLock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "created": 0, "evicted": 0, "expired": 0}
+
+    def get(self, key, create, expires=None):
+        """
+        Return the pooled client for key or call create() to create it.
+        :param key: (credential identity, service name, region)
+        :param create: function with no arguments returning a new client
+        :param expires: clock time after which the client's credentials
+            are no longer valid or None if they do not expire
+        """
+        now = self.clock()
+        with self.lock:
+            if key in self.clients:
+                client, client_expires = self.clients[key]
+                if client_expires is None or client_expires > now:
+                    self.clients.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return client
+                del self.clients[key]
+                self.stats["expired"] += 1
+
+            client = create()
+            self.stats["created"] += 1
+            self.clients[key] = (client, expires)
+            self.evict(now)
+        return client
+
+    def evict(self, now):
+        """
+        Remove the clients with expired credentials then the least recently
+        used clients until the pool is within max_size
+        """
+        with self.lock:
+            expired = [
+                key for key, (client, expires) in self.clients.items()
+                if expires is not None and expires <= now
+            ]
+            for key in expired:
+                del self.clients[key]
+            self.stats["expired"] += len(expired)
+            while len(self.clients) > self.max_size:
+                self.clients.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def invalidate(self, identity=None):
+        """
+        Remove the clients created with the given credential identity
+        or every client when identity is None
+        """
+        with self.lock:
+            removed = [
+                key for key in self.clients if identity is None or key[0] == identity
+            ]
+            for key in removed:
+                del self.clients[key]
+        return len(removed)
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats["size"] = len(self.clients)
+        return stats
+
+
+# Shared by every Gds*Client in the process
+client_pool = GdsClientPool()
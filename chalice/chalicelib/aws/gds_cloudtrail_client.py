@@ -13,6 +13,11 @@ class GdsCloudtrailClient(GdsAwsClient):
     def describe_trails(self, session):
         """
         """
+        return list(self.iter_trails(session))
+
+    def iter_trails(self, session):
+        """
+        describe_trails is not paginated so the trails come from a single call
+        """
         cloudtrail_client = self.get_boto3_session_client("cloudtrail", session)
-        data = cloudtrail_client.describe_trails().get("trailList", [])
-        return data
+        return self.paginate(cloudtrail_client, "describe_trails", "trailList")
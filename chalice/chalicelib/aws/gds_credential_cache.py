@@ -0,0 +1,165 @@
+"""
+GdsCredentialCache
+A process-wide cache of assumed role credentials keyed by (account, role)
+
+Every criterion message assumes the chain role and then the target role
+in the audited account. Warm lambda containers reuse the cached sessions
+instead of calling STS each time, which keeps STS throttling down as the
+number of audited accounts grows.
+
+- Credentials are refreshed in the background refresh_margin seconds
+  before they expire so callers keep using the cached session meanwhile
+- Credentials within expiry_margin seconds of expiring are not used and
+  the caller waits for new ones
+- Concurrent requests for the same key while it is being assumed wait
+  for the one STS call in flight instead of making their own
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+
+class GdsCredentialCache:
+
+    # seconds before expiry that the credentials are refreshed in the background
+    refresh_margin = 300
+    # seconds before expiry that the credentials are no longer used
+    expiry_margin = 60
+    # the most sessions kept, the least recently used are dropped first
+    max_size = 256
+
+    def __init__(self, clock=time.monotonic, refresh_workers=2):
+        self.clock = clock
+        self.sessions = OrderedDict()
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+        self.refresh_workers = refresh_workers
+        self.executor = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "sts_calls": 0,
+            "failures": 0,
+        }
+
+    def get_expires(self, credentials):
+        """
+        The clock time when the credentials expire or None if they do not
+        """
+        expiration = credentials.get("Expiration")
+        if expiration is None:
+            return None
+        remaining = (expiration - datetime.now(expiration.tzinfo)).total_seconds()
+        return self.clock() + remaining
+
+    def get(self, key, assume):
+        """
+        Return the cached credentials for key or call assume() to get them.
+        Only one assume() call is made at a time for each key.
+        assume() exceptions are raised to every caller waiting for it
+        and nothing is cached.
+        :param key: (account, role)
+        :param assume: function with no arguments returning the credentials
+        """
+        now = self.clock()
+        refresh = False
+        owner = False
+        with self.lock:
+            cached = self.sessions.get(key)
+            if cached is not None and self.is_usable(cached[1], now):
+                credentials, expires = cached
+                self.sessions.move_to_end(key)
+                self.stats["hits"] += 1
+                if not self.is_due_refresh(expires, now) or key in self.in_flight:
+                    return credentials
+                self.stats["refreshes"] += 1
+                future = self.start_assume(key)
+                refresh = True
+            elif key in self.in_flight:
+                self.stats["coalesced"] += 1
+                future = self.in_flight[key]
+            else:
+                self.stats["misses"] += 1
+                future = self.start_assume(key)
+                owner = True
+
+        if refresh:
+            # callers keep using the cached credentials while they are refreshed
+            self.get_executor().submit(self.assume, key, assume, future)
+            return credentials
+        if owner:
+            self.assume(key, assume, future)
+        return future.result()
+
+    def is_usable(self, expires, now):
+        return expires is None or expires - self.expiry_margin > now
+
+    def is_due_refresh(self, expires, now):
+        return expires is not None and expires - self.refresh_margin <= now
+
+    def start_assume(self, key):
+        future = Future()
+        self.in_flight[key] = future
+        return future
+
+    def assume(self, key, assume, future):
+        """
+        Call assume() and publish the result to the callers waiting for it
+        """
+        try:
+            with self.lock:
+                self.stats["sts_calls"] += 1
+            credentials = assume()
+            if credentials is None:
+                raise Exception(f"Failed to assume {key}")
+            self.set(key, credentials)
+            future.set_result(credentials)
+        except Exception as err:
+            with self.lock:
+                self.stats["failures"] += 1
+            future.set_exception(err)
+        finally:
+            with self.lock:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+
+    def set(self, key, credentials):
+        expires = self.get_expires(credentials)
+        with self.lock:
+            self.sessions[key] = (credentials, expires)
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_size:
+                self.sessions.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            removed = list(self.sessions.keys()) if key is None else [key]
+            removed = [item for item in removed if item in self.sessions]
+            for item in removed:
+                del self.sessions[item]
+        return len(removed)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.refresh_workers, thread_name_prefix="credential-refresh"
+                )
+            return self.executor
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats["size"] = len(self.sessions)
+        return stats
+
+
+# Shared by every Gds*Client in the process
+credential_cache = GdsCredentialCache()
@@ -8,31 +8,109 @@ class GdsEc2Client(GdsAwsClient):
 
     resource_type = "AWS::EC2::*"
 
+    # seconds before the region list is fetched again
+    regions_ttl = 86400
+    # the most values a describe call filter accepts
+    filter_values_limit = 200
+
     def describe_regions(self):
 
+        return self.metadata.get(
+            ("ec2", "describe_regions", "default"),
+            self.load_regions,
+            self.regions_ttl,
+        )
+
+    def load_regions(self):
+
         ec2 = self.get_default_client("ec2")
         response = ec2.describe_regions()
 
         return response["Regions"]
 
+    def describe_account_regions(self, session):
+        """
+        List the regions enabled for the account the session belongs to.
+        Without AllRegions describe-regions omits opt-in regions that the
+        account has not opted into.
+        """
+        ec2 = self.get_boto3_session_client("ec2", session)
+        response = ec2.describe_regions(
+            Filters=[
+                {
+                    "Name": "opt-in-status",
+                    "Values": ["opt-in-not-required", "opted-in"],
+                }
+            ]
+        )
+
+        return response["Regions"]
+
     def describe_vpcs(self, session, region_name):
 
+        return list(self.iter_vpcs(session, region_name))
+
+    def iter_vpcs(self, session, region_name, page_size=None):
+
         ec2 = self.get_boto3_session_client("ec2", session, region=region_name)
-        response = ec2.describe_vpcs()
 
-        return response["Vpcs"]
+        return self.paginate(ec2, "describe_vpcs", "Vpcs", page_size)
 
     def describe_flow_logs(self, session, vpc, region_name):
 
-        ec2 = self.get_boto3_session_client("ec2", session, region=region_name)
-        response = ec2.describe_flow_logs(
-            Filters=[{"Name": "resource-id", "Values": [vpc["VpcId"]]}]
+        return self.load_flow_logs(session, vpc, region_name).result()
+
+    def load_flow_logs(self, session, vpc, region_name):
+        """
+        Return a future for the list of flow logs of the VPC
+        The flow logs of the VPCs requested for the same region are
+        fetched together
+        """
+        loader = self.get_batch_loader(
+            "flow_logs", self.describe_flow_logs_by_vpc, self.filter_values_limit
         )
+        return loader.load(
+            (self.get_credential_identity(session), region_name),
+            vpc["VpcId"],
+            session,
+            region_name,
+        )
+
+    def describe_flow_logs_by_vpc(self, session, region_name, vpc_ids):
+        """
+        Get the flow logs of each VPC in one describe call
+        """
+        ec2 = self.get_boto3_session_client("ec2", session, region=region_name)
+        flow_logs = {vpc_id: [] for vpc_id in vpc_ids}
+        for flow_log in self.paginate(
+            ec2,
+            "describe_flow_logs",
+            "FlowLogs",
+            Filters=[{"Name": "resource-id", "Values": vpc_ids}],
+        ):
+            flow_logs.setdefault(flow_log["ResourceId"], []).append(flow_log)
+        return flow_logs
 
-        return response["FlowLogs"]
+    def iter_flow_logs(self, session, vpc, region_name, page_size=None):
+
+        ec2 = self.get_boto3_session_client("ec2", session, region=region_name)
+
+        return self.paginate(
+            ec2,
+            "describe_flow_logs",
+            "FlowLogs",
+            page_size,
+            Filters=[{"Name": "resource-id", "Values": [vpc["VpcId"]]}],
+        )
 
     def describe_volumes(self, session):
         """
         """
+        return list(self.iter_volumes(session))
+
+    def iter_volumes(self, session, page_size=None):
+        """
+        Yield the volumes one page of describe_volumes at a time
+        """
         client = self.get_boto3_session_client("ec2", session)
-        return client.describe_volumes().get("Volumes", [])
+        return self.paginate(client, "describe_volumes", "Volumes", page_size)
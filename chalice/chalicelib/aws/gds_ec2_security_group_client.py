@@ -12,30 +12,19 @@ class GdsEc2SecurityGroupClient(GdsEc2Client):
 
     def describe_security_groups(self, session, **kwargs):
 
-        # get a boto3 client for the EC2 service in the given region (default to London)
-        ec2 = self.get_boto3_session_client("ec2", session, kwargs["region"])
+        return list(self.iter_security_groups(session, kwargs["region"]))
 
-        # run describe security groups api call
-        response = ec2.describe_security_groups()
+    def iter_security_groups(self, session, region, page_size=None):
 
-        # return the security groups element of the response
-        security_groups = response["SecurityGroups"]
+        # get a boto3 client for the EC2 service in the given region
+        ec2 = self.get_boto3_session_client("ec2", session, region)
 
-        return security_groups
+        return self.paginate(ec2, "describe_security_groups", "SecurityGroups", page_size)
 
     def get_security_group_by_id(self, session, region, id):
         try:
             if id:
-                ec2 = self.get_boto3_session_client("ec2", session, region)
-
-                # run describe security groups api call
-                response = ec2.describe_security_groups(
-                    GroupIds = [id]
-                )
-
-                group = None
-                if len(response["SecurityGroups"] == 1):
-                    group = response["SecurityGroups"][0]
+                group = self.load_security_group(session, region, id).result()
             else:
                 raise Exception("No security group ID provided")
         except Exception:
@@ -44,6 +33,32 @@ class GdsEc2SecurityGroupClient(GdsEc2Client):
 
         return group
 
+    def load_security_group(self, session, region, id):
+        """
+        Return a future for the security group or None if it does not exist
+        The groups requested for the same region are fetched together
+        """
+        loader = self.get_batch_loader(
+            "security_groups", self.describe_security_groups_by_id, self.filter_values_limit
+        )
+        return loader.load((self.get_credential_identity(session), region), id, session, region)
+
+    def describe_security_groups_by_id(self, session, region, ids):
+        """
+        Get the security groups by id in one describe call
+        A group-id filter is used rather than GroupIds so that ids which
+        no longer exist are left out instead of failing the whole call
+        A failed call is raised so the loader does not cache the groups
+        """
+        ec2 = self.get_boto3_session_client("ec2", session, region)
+        groups = self.paginate(
+            ec2,
+            "describe_security_groups",
+            "SecurityGroups",
+            Filters=[{"Name": "group-id", "Values": ids}],
+        )
+        return {group["GroupId"]: group for group in groups}
+
     def translate(self, data):
 
         item = {"resource_id": data["GroupId"], "resource_name": data["GroupName"]}
@@ -12,10 +12,12 @@ class GdsElbClient(GdsAwsClient):
 
     def get_balancer_list_with_attributes(self, session):
         balancer_list = self.get_balancer_list(session)
-        for balancer in balancer_list:
-            for kv in self.get_balancer_attributes(
-                session, balancer["LoadBalancerArn"]
-            ):
+        attributes = self.enrich(
+            balancer_list,
+            lambda balancer: self.get_balancer_attributes(session, balancer["LoadBalancerArn"]),
+        )
+        for balancer, balancer_attributes in zip(balancer_list, attributes):
+            for kv in balancer_attributes:
                 balancer.update({kv["Key"]: kv["Value"]})
         self.app.log.debug("ELB::get_balancer_list_with_attributes")
         self.app.log.debug(type(balancer_list))
@@ -25,8 +27,14 @@ class GdsElbClient(GdsAwsClient):
     def get_balancer_list(self, session):
         """
         """
+        return list(self.iter_balancers(session))
+
+    def iter_balancers(self, session, page_size=None):
+        """
+        Yield the load balancers one page of describe_load_balancers at a time
+        """
         client = self.get_boto3_session_client("elbv2", session)
-        return client.describe_load_balancers().get("LoadBalancers", [])
+        return self.paginate(client, "describe_load_balancers", "LoadBalancers", page_size)
 
     def get_balancer_attributes(self, session, load_balancer_arn):
         """
@@ -0,0 +1,118 @@
+"""
+GdsEnrichmentExecutor
+A process-wide thread pool for the follow-up calls made for each item
+of a list, eg the rotation status and details of every KMS key
+
+Making the calls one after another takes a round trip per item so an
+account with hundreds of keys or buckets takes minutes. The calls are
+made on a bounded pool instead:
+- results are returned in the order of the items
+- an exception for one item does not stop the other items, every item
+  is finished before the first exception is raised or passed to on_error
+- the calls go through the clients' rate limiter as usual so the pool
+  only sets how many are in flight at once for the process
+- fetch may return a future, eg from GdsBatchLoader.load, which is
+  resolved once every item has been fetched so lookups can be batched
+- map called from a pool thread runs its items in that thread so a
+  nested map cannot wait on a pool full of its own callers
+
+Set CSW_ENRICHMENT_WORKERS=1 to make the calls one after another.
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class GdsEnrichmentExecutor:
+
+    max_workers = 16
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            try:
+                max_workers = int(os.environ.get("CSW_ENRICHMENT_WORKERS", self.max_workers))
+            except ValueError:
+                max_workers = 1
+        self.max_workers = max(max_workers, 1)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"batches": 0, "items": 0, "errors": 0}
+
+    def map(self, fetch, items, on_error=None):
+        """
+        Call fetch(item) for each item and return the results in item order
+        :param fetch: function taking one item
+        :param items: iterable of items
+        :param on_error: function called with (item, exception) for each item
+            whose fetch raised, returning the result to use for the item.
+            When None the first exception in item order is raised.
+        """
+        items = list(items)
+        if self.max_workers == 1 or len(items) <= 1 or self.is_worker():
+            outcomes = [self.call(fetch, item) for item in items]
+        else:
+            executor = self.get_executor()
+            futures = [executor.submit(self.run, fetch, item) for item in items]
+            outcomes = [future.result() for future in futures]
+        outcomes = [self.resolve(outcome) for outcome in outcomes]
+
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(items)
+            self.stats["errors"] += len([error for result, error in outcomes if error is not None])
+
+        results = []
+        for item, (result, error) in zip(items, outcomes):
+            if error is not None:
+                if on_error is None:
+                    raise error
+                result = on_error(item, error)
+            results.append(result)
+        return results
+
+    def call(self, fetch, item):
+        try:
+            return fetch(item), None
+        except Exception as err:
+            return None, err
+
+    def resolve(self, outcome):
+        """
+        Wait for the result of a fetch which returned a future
+        """
+        result, error = outcome
+        if error is None and isinstance(result, Future):
+            try:
+                return result.result(), None
+            except Exception as err:
+                return None, err
+        return outcome
+
+    def run(self, fetch, item):
+        self.local.worker = True
+        return self.call(fetch, item)
+
+    def is_worker(self):
+        return getattr(self.local, "worker", False)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="enrichment"
+                )
+            return self.executor
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+        stats["max_workers"] = self.max_workers
+        return stats
+
+
+# Shared by every Gds*Client in the process
+enrichment_executor = GdsEnrichmentExecutor()
@@ -10,24 +10,35 @@ class GdsIamClient(GdsAwsClient):
 
     def list_users(self, session):
 
+        return list(self.iter_users(session))
+
+    def iter_users(self, session, page_size=None):
+
         iam = self.get_boto3_session_client("iam", session)
-        response = iam.list_users()
 
-        return response["Users"]
+        return self.paginate(iam, "list_users", "Users", page_size)
 
     def list_roles(self, session):
 
+        return list(self.iter_roles(session))
+
+    def iter_roles(self, session, page_size=None):
+
         iam = self.get_boto3_session_client("iam", session)
-        response = iam.list_roles()
 
-        return response["Roles"]
+        return self.paginate(iam, "list_roles", "Roles", page_size)
 
     def list_attached_role_policies(self, session, role_name):
 
+        return list(self.iter_attached_role_policies(session, role_name))
+
+    def iter_attached_role_policies(self, session, role_name, page_size=None):
+
         iam = self.get_boto3_session_client("iam", session)
-        response = iam.list_attached_role_policies(RoleName=role_name)
 
-        return response["AttachedPolicies"]
+        return self.paginate(
+            iam, "list_attached_role_policies", "AttachedPolicies", page_size, RoleName=role_name
+        )
 
     def get_policy(self, session, policy_arn):
         iam = self.get_boto3_session_client("iam", session)
@@ -61,10 +72,13 @@ class GdsIamClient(GdsAwsClient):
         return response
 
     def list_role_tags(self, session, role_name):
+
+        return list(self.iter_role_tags(session, role_name))
+
+    def iter_role_tags(self, session, role_name, page_size=None):
         iam = self.get_boto3_session_client("iam", session)
-        response = iam.list_role_tags(RoleName=role_name)
 
-        return response["Tags"]
+        return self.paginate(iam, "list_role_tags", "Tags", page_size, RoleName=role_name)
 
     def split_resource(self, resource):
 
@@ -12,9 +12,16 @@ class GdsKmsClient(GdsAwsClient):
 
     def get_key_list_with_details(self, session):
         keys_list = self.get_key_list(session)
-        for key in keys_list:
-            key.update(self.get_key_rotation_status(session, key["KeyArn"]))
-            key.update(self.get_key_details(session, key["KeyArn"]))
+
+        def get_details(key):
+            return (
+                self.get_key_rotation_status(session, key["KeyArn"]),
+                self.get_key_details(session, key["KeyArn"]),
+            )
+
+        for key, (rotation_status, details) in zip(keys_list, self.enrich(keys_list, get_details)):
+            key.update(rotation_status)
+            key.update(details)
         self.app.log.debug("KMS::get_key_list_with_details")
         self.app.log.debug(type(keys_list))
         self.app.log.debug(keys_list)
@@ -23,13 +30,19 @@ class GdsKmsClient(GdsAwsClient):
     def get_key_list(self, session):
         """
         """
-        kms_client = self.get_boto3_session_client("kms", session)
-        data = kms_client.list_keys().get("Keys", [])
+        data = list(self.iter_keys(session))
         self.app.log.debug("KMS::get_key_list")
         self.app.log.debug(type(data))
         self.app.log.debug(data)
         return data
 
+    def iter_keys(self, session, page_size=None):
+        """
+        Yield the keys one page of list_keys at a time
+        """
+        kms_client = self.get_boto3_session_client("kms", session)
+        return self.paginate(kms_client, "list_keys", "Keys", page_size)
+
     def get_key_rotation_status(self, session, key_id_or_arn):
         """
         """
@@ -0,0 +1,87 @@
+"""
+GdsMetadataCache
+A process-wide cache for slow changing AWS metadata
+(caller identity, queue URLs, SSM chain parameters, region lists)
+
+Lambda containers are reused between invocations so anything stored
+at module level survives for the life of the container. Entries expire
+after a TTL and can be invalidated explicitly, eg when a call made with
+the cached value fails.
+"""
+import threading
+import time
+
+
+class GdsMetadataCache:
+
+    default_ttl = 3600
+
+    def __init__(self, default_ttl=None):
+        if default_ttl is not None:
+            self.default_ttl = default_ttl
+        self.items = dict()
+        self.lock = threading.RLock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0}
+
+    def get(self, key, loader, ttl=None):
+        """
+        Return the cached value for key or call loader() to populate it.
+        Loader exceptions are raised to the caller and nothing is cached.
+        :param key: hashable cache key eg ("sts", "caller_identity")
+        :param loader: function with no arguments returning the value
+        :param ttl: lifetime in seconds (default_ttl if not specified)
+        """
+        now = time.monotonic()
+        with self.lock:
+            if key in self.items:
+                expires, value = self.items[key]
+                if expires > now:
+                    self.stats["hits"] += 1
+                    return value
+                del self.items[key]
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+
+        value = loader()
+        self.set(key, value, ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        lifetime = self.default_ttl if ttl is None else ttl
+        with self.lock:
+            self.items[key] = (time.monotonic() + lifetime, value)
+
+    def invalidate(self, key=None):
+        """
+        Remove a single key, every key starting with the given tuple
+        prefix or (when key is None) everything in the cache
+        """
+        with self.lock:
+            if key is None:
+                removed = list(self.items.keys())
+            elif isinstance(key, tuple):
+                removed = [
+                    item for item in self.items
+                    if item == key or (isinstance(item, tuple) and item[:len(key)] == key)
+                ]
+            else:
+                removed = [key] if key in self.items else []
+            for item in removed:
+                del self.items[item]
+            self.stats["invalidated"] += len(removed)
+        return len(removed)
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats["size"] = len(self.items)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] / lookups) if lookups > 0 else 0.0
+        return stats
+
+
+# Shared by every Gds*Client in the process
+metadata_cache = GdsMetadataCache()
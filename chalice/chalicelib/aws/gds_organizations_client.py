@@ -18,15 +18,14 @@ class GdsOrganizationsClient(GdsAwsClient):
         :returns: A list of accounts
         :rtype: list
         """
-        client = self.get_boto3_session_client("organizations", session)
-
-        results = client.list_accounts(MaxResults=20)
-        accounts = results["Accounts"]
+        return list(self.iter_accounts(session))
 
-        while "NextToken" in results:
-            results = client.list_accounts(
-                MaxResults=20, NextToken=results["NextToken"]
-            )
-            accounts += results["Accounts"]
+    def iter_accounts(self, session, page_size=None):
+        """Yield the AWS organization linked accounts one page at a time.
+        :param session: The boto3 session to use for the connection
+        :param page_size: Accounts per page, at most 20
+        :returns: A generator of accounts
+        """
+        client = self.get_boto3_session_client("organizations", session)
 
-        return accounts
+        return self.paginate(client, "list_accounts", "Accounts", page_size)
@@ -0,0 +1,253 @@
+"""
+GdsRateLimiter
+A process-wide rate limiter shared by every boto3 client the Gds*Clients create
+
+When the daily audit starts many lambdas call the same services in the
+same accounts at once. Each client registered with the limiter:
+- takes a token from a bucket per (account, service) before every attempt
+  (including botocore retries) so calls are spread out instead of bursting
+- holds a per-service concurrency slot while a request is in flight
+- halves the bucket rate when a request is throttled and slowly restores it
+  as requests succeed (additive increase, multiplicative decrease)
+- retries using the botocore retry handler up to retry_attempts times
+
+Throttle events, retries and time spent waiting are counted per service.
+"""
+import os
+import threading
+import time
+
+from botocore.config import Config
+
+
+# Error codes AWS services return when a caller is throttled
+THROTTLING_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+]
+
+
+class GdsTokenBucket:
+    """
+    A token bucket which refills at rate tokens per second up to capacity.
+    The rate is lowered when calls are throttled and recovers towards
+    max_rate as calls succeed.
+    """
+
+    # rate is multiplied by this when a call is throttled
+    backoff_factor = 0.5
+    # fraction of max_rate restored for each successful call
+    recovery_factor = 0.05
+    # the rate is never reduced below this many calls per second
+    min_rate = 0.5
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty
+        Returns the seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def throttled(self):
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            # stop the bucket bursting straight back into the throttle
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_factor)
+
+
+class GdsRateLimiter:
+
+    # calls per second for each (account, service) bucket
+    default_rate = 10
+    service_rates = {
+        "ec2": 20,
+        # the per key and per bucket reads allow hundreds of calls per second
+        "kms": 100,
+        "s3": 100,
+        "iam": 10,
+        "sts": 10,
+        "support": 5,
+        "organizations": 5,
+    }
+    # requests in flight at once for each service across all accounts
+    default_concurrency = 16
+    service_concurrency = {
+        "iam": 4,
+        "support": 4,
+        "organizations": 2,
+    }
+    # attempts to retry each call after the first
+    retry_attempts = 7
+    # seconds to wait for a concurrency slot before calling anyway
+    concurrency_timeout = 30
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = dict()
+        self.semaphores = dict()
+        self.lock = threading.RLock()
+        self.held = threading.local()
+        self.retry_attempts = int(
+            os.environ.get("CSW_API_RETRY_ATTEMPTS", self.retry_attempts)
+        )
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = dict()
+
+    def get_service_stats(self, service_name):
+        return self.stats.setdefault(
+            service_name,
+            {"calls": 0, "attempts": 0, "throttles": 0, "errors": 0, "wait_seconds": 0.0},
+        )
+
+    def count(self, service_name, name, value=1):
+        with self.lock:
+            self.get_service_stats(service_name)[name] += value
+
+    def get_stats(self):
+        """
+        Return the counters for each service with the retries
+        (attempts beyond the first for each call)
+        """
+        with self.lock:
+            stats = {
+                service_name: service_stats.copy()
+                for service_name, service_stats in self.stats.items()
+            }
+        for service_stats in stats.values():
+            service_stats["retries"] = service_stats["attempts"] - service_stats["calls"]
+        return stats
+
+    def get_bucket(self, account, service_name):
+        key = (str(account), service_name)
+        with self.lock:
+            if key not in self.buckets:
+                rate = self.service_rates.get(service_name, self.default_rate)
+                self.buckets[key] = GdsTokenBucket(rate, clock=self.clock, sleep=self.sleep)
+            return self.buckets[key]
+
+    def get_semaphore(self, service_name):
+        with self.lock:
+            if service_name not in self.semaphores:
+                concurrency = self.service_concurrency.get(
+                    service_name, self.default_concurrency
+                )
+                self.semaphores[service_name] = threading.BoundedSemaphore(concurrency)
+            return self.semaphores[service_name]
+
+    def get_client_config(self):
+        """
+        The botocore retry policy for clients registered with the limiter
+        """
+        return Config(retries={"max_attempts": self.retry_attempts})
+
+    def register(self, client, account="default"):
+        """
+        Route every request the client sends through the limiter
+        """
+        service_name = client.meta.service_model.service_name
+        events = client.meta.events
+        events.register(
+            "before-call",
+            lambda **kwargs: self.count(service_name, "calls"),
+        )
+        events.register(
+            "before-send",
+            lambda **kwargs: self.before_send(account, service_name),
+        )
+        events.register(
+            "needs-retry",
+            lambda **kwargs: self.after_attempt(account, service_name, **kwargs),
+        )
+        return client
+
+    def before_send(self, account, service_name):
+        """
+        Wait for a token and a concurrency slot before each attempt
+        """
+        waited = self.get_bucket(account, service_name).acquire()
+        semaphore = self.get_semaphore(service_name)
+        start = self.clock()
+        acquired = semaphore.acquire(timeout=self.concurrency_timeout)
+        waited += self.clock() - start
+        # attempts are synchronous within a thread so the slot to release
+        # after the attempt is tracked per thread
+        self.held.__dict__.setdefault("semaphores", []).append(
+            semaphore if acquired else None
+        )
+        with self.lock:
+            service_stats = self.get_service_stats(service_name)
+            service_stats["attempts"] += 1
+            service_stats["wait_seconds"] += waited
+        # returning None lets botocore send the request
+        return None
+
+    def after_attempt(self, account, service_name, response=None, caught_exception=None, **kwargs):
+        """
+        Release the concurrency slot and adjust the bucket rate
+        from the result of the attempt
+        """
+        semaphores = self.held.__dict__.get("semaphores", [])
+        if semaphores:
+            semaphore = semaphores.pop()
+            if semaphore is not None:
+                semaphore.release()
+
+        bucket = self.get_bucket(account, service_name)
+        code = None
+        if response is not None:
+            code = response[1].get("Error", {}).get("Code")
+        if code in THROTTLING_ERROR_CODES:
+            self.count(service_name, "throttles")
+            bucket.throttled()
+        elif code is not None or caught_exception is not None:
+            self.count(service_name, "errors")
+        else:
+            bucket.succeeded()
+        # returning None leaves the retry decision to botocore
+        return None
+
+
+# Shared by every Gds*Client in the process
+rate_limiter = GdsRateLimiter()
@@ -13,9 +13,15 @@ class GdsRdsClient(GdsAwsClient):
     def describe_db_instances(self, session):
         """
         """
-        kms_client = self.get_boto3_session_client("rds", session)
-        data = kms_client.describe_db_instances().get("DBInstances", [])
+        data = list(self.iter_db_instances(session))
         self.app.log.debug("RDS::describe_db_instances")
         self.app.log.debug(type(data))
         self.app.log.debug(data)
         return data
+
+    def iter_db_instances(self, session, page_size=None):
+        """
+        Yield the instances one page of describe_db_instances at a time
+        """
+        rds_client = self.get_boto3_session_client("rds", session)
+        return self.paginate(rds_client, "describe_db_instances", "DBInstances", page_size)
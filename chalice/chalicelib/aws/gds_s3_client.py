@@ -2,6 +2,8 @@
 # extends GdsAwsClient
 # implements aws s3 and s3api endpoint queries
 
+import os
+
 from chalicelib.aws.gds_aws_client import GdsAwsClient
 
 
@@ -10,11 +12,13 @@ class GdsS3Client(GdsAwsClient):
     # list buckets
     def get_bucket_list(self, session):
 
+        return list(self.iter_buckets(session))
+
+    def iter_buckets(self, session, page_size=None):
+
         s3 = self.get_boto3_session_client("s3", session)
-        response = s3.list_buckets()
-        buckets = response["Buckets"]
 
-        return buckets
+        return self.paginate(s3, "list_buckets", "Buckets", page_size)
 
     def get_bucket_policy(self, session, bucket_name):
 
@@ -70,3 +74,15 @@ class GdsS3Client(GdsAwsClient):
             self.app.log.error(self.app.utilities.get_typed_exception())
 
         return acl
+
+    # put-object to a bucket owned by the CSW account
+    def put_object(self, bucket_name, key, body):
+        s3 = self.get_default_client("s3", os.environ["CSW_REGION"])
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+        return f"s3://{bucket_name}/{key}"
+
+    # get-object from a bucket owned by the CSW account
+    def get_object(self, bucket_name, key):
+        s3 = self.get_default_client("s3", os.environ["CSW_REGION"])
+        response = s3.get_object(Bucket=bucket_name, Key=key)
+        return response["Body"].read()
@@ -3,22 +3,43 @@
 # implements aws sqs endpoint queries
 
 import os
+import time
 from chalicelib.aws.gds_aws_client import GdsAwsClient
 
 
 class GdsSqsClient(GdsAwsClient):
 
+    # SQS limits for a single send-message-batch call
+    batch_max_entries = 10
+    batch_max_bytes = 262144
+    # number of times to resend entries which failed with a server side fault
+    batch_retries = 3
+    # seconds to wait before the first resend, doubled for each attempt
+    batch_retry_wait = 0.1
+
+    # seconds before a queue URL is rebuilt
+    queue_url_ttl = 86400
+
+    # when set messages are sent to the backend instead of SQS
+    # eg a GdsSqsMemoryBackend to run the audit lambdas in process
+    queue_backend = None
+
     # get-queue-url
     # --queue-name < value >
     def get_queue_url(self, queue_name):
 
+        if self.queue_backend is not None:
+            return self.queue_backend.get_queue_url(queue_name)
+
         try:
 
             self.app.log.debug("Try getting queue URL for: " + queue_name)
             region = os.environ["CSW_REGION"]
-            caller = self.get_caller_details()
-            account = caller["Account"]
-            queue_url = f"https://{region}.queue.amazonaws.com/{account}/{queue_name}"
+            queue_url = self.metadata.get(
+                ("sqs", "queue_url", region, queue_name),
+                lambda: self.build_queue_url(region, queue_name),
+                self.queue_url_ttl,
+            )
 
             self.app.log.debug("Queue URL: " + queue_url)
 
@@ -28,11 +49,19 @@ class GdsSqsClient(GdsAwsClient):
 
         return queue_url
 
+    def build_queue_url(self, region, queue_name):
+        caller = self.get_caller_details()
+        account = caller["Account"]
+        return f"https://{region}.queue.amazonaws.com/{account}/{queue_name}"
+
     # send-message
     # --queue-url < value >
     # --message-body < value >
     def send_message(self, queue_url, body):
 
+        if self.queue_backend is not None:
+            return self.queue_backend.send_message(queue_url, body)
+
         try:
 
             region = os.environ["CSW_REGION"]
@@ -47,3 +76,80 @@ class GdsSqsClient(GdsAwsClient):
             message_id = None
 
         return message_id
+
+    def get_message_batches(self, bodies):
+        """
+        Split a list of message bodies into lists of indexes which fit
+        within the SQS entry count and payload size limits for a batch
+        """
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for index, body in enumerate(bodies):
+            body_bytes = len(body.encode("utf-8"))
+            is_full = len(batch) == self.batch_max_entries
+            is_too_big = batch_bytes + body_bytes > self.batch_max_bytes
+            if batch and (is_full or is_too_big):
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(index)
+            batch_bytes += body_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    # send-message-batch
+    # --queue-url < value >
+    # --entries < value >
+    def send_message_batch(self, queue_url, bodies):
+        """
+        Send a list of message bodies using as few send-message-batch calls
+        as the SQS limits allow.
+
+        Entries which fail because of a server side fault (or because the
+        whole call failed) are resent up to batch_retries times.
+        Entries rejected as a sender fault are not resent.
+
+        Returns a list of message ids in the same order as the bodies
+        with None for any message which could not be sent.
+        """
+        if self.queue_backend is not None:
+            return self.queue_backend.send_message_batch(queue_url, bodies)
+
+        message_ids = [None] * len(bodies)
+
+        region = os.environ["CSW_REGION"]
+
+        sqs = self.get_default_client("sqs", region)
+
+        for batch in self.get_message_batches(bodies):
+            pending = batch
+            attempt = 0
+            while pending and attempt <= self.batch_retries:
+                if attempt > 0:
+                    time.sleep(self.batch_retry_wait * (2 ** (attempt - 1)))
+                attempt += 1
+                entries = [
+                    {"Id": str(index), "MessageBody": bodies[index]} for index in pending
+                ]
+                try:
+                    response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+                except Exception as err:
+                    self.app.log.error("Failed to send SQS message batch: " + str(err))
+                    continue
+
+                for success in response.get("Successful", []):
+                    message_ids[int(success["Id"])] = success["MessageId"]
+
+                retry = []
+                for failure in response.get("Failed", []):
+                    self.app.log.error(
+                        f"Failed to send SQS message {failure['Id']}: "
+                        f"{failure.get('Code')} {failure.get('Message', '')}"
+                    )
+                    if not failure.get("SenderFault", False):
+                        retry.append(int(failure["Id"]))
+                pending = retry
+
+        return message_ids
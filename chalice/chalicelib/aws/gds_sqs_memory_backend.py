@@ -0,0 +1,179 @@
+"""
+GdsSqsMemoryBackend
+An in-process stand in for SQS used as the GdsSqsClient.queue_backend
+to run the audit pipeline locally without AWS.
+
+Handlers decorated with @app.on_sqs_message are subscribed to their queue
+and run delivers batches of messages to them, synchronously or on a pool of
+worker threads, until every subscribed queue is empty.
+Messages reported in batchItemFailures (or the whole batch if the handler
+raises) are returned to the queue like an SQS visibility timeout expiring
+and moved to dead_letters after max_receive_count receives.
+Messages sent to queues without a handler (eg the completed audit queue)
+are kept so they can be inspected with get_messages.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class GdsSqsMemoryContext:
+    """
+    The parts of the lambda context object used by the handlers
+    """
+
+    def __init__(self, function_name, timeout=900, clock=time.monotonic):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.clock = clock
+        self.deadline = clock() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - self.clock()) * 1000))
+
+
+class GdsSqsMemoryBackend:
+
+    url_prefix = "memory://"
+    # the most messages delivered to a handler in one event
+    batch_size = 10
+    # receives before a message is moved to the dead letters
+    max_receive_count = 5
+    # seconds each handler invocation is allowed like the lambda timeout
+    handler_timeout = 900
+
+    def __init__(self, app=None):
+        self.app = app
+        self.queues = dict()
+        self.handlers = dict()
+        self.dead_letters = []
+        self.lock = threading.Lock()
+        self.stats = {"sent": 0, "delivered": 0, "failed": 0, "dead_letters": 0, "invocations": 0}
+
+    def get_queue_url(self, queue_name):
+        return f"{self.url_prefix}{queue_name}"
+
+    def get_queue_name(self, queue_url):
+        return queue_url[len(self.url_prefix):]
+
+    def send_message(self, queue_url, body):
+        message_id = str(uuid.uuid4())
+        record = {
+            "messageId": message_id,
+            "receiptHandle": message_id,
+            "body": body,
+            "attributes": {
+                "ApproximateReceiveCount": "0",
+                "SentTimestamp": str(int(time.time() * 1000)),
+            },
+            "messageAttributes": {},
+            "eventSource": "aws:sqs",
+            "eventSourceARN": f"arn:aws:sqs:memory:000000000000:{self.get_queue_name(queue_url)}",
+        }
+        with self.lock:
+            self.queues.setdefault(self.get_queue_name(queue_url), deque()).append(record)
+            self.stats["sent"] += 1
+        return message_id
+
+    def send_message_batch(self, queue_url, bodies):
+        return [self.send_message(queue_url, body) for body in bodies]
+
+    def subscribe(self, queue_name, handler):
+        """
+        Deliver the messages sent to the queue to a lambda handler
+        called with (event, context) like @app.on_sqs_message handlers
+        """
+        self.handlers[queue_name] = handler
+
+    def get_messages(self, queue_name):
+        """
+        The bodies of the messages waiting in a queue
+        """
+        with self.lock:
+            return [record["body"] for record in self.queues.get(queue_name, [])]
+
+    def receive(self):
+        """
+        Take the next batch of messages from the first subscribed queue
+        with messages waiting
+        Returns the queue name and records or None if the queues are empty
+        """
+        with self.lock:
+            for queue_name in self.handlers:
+                queue = self.queues.get(queue_name)
+                if queue:
+                    records = []
+                    while queue and len(records) < self.batch_size:
+                        record = queue.popleft()
+                        attributes = record["attributes"]
+                        attributes["ApproximateReceiveCount"] = str(
+                            int(attributes["ApproximateReceiveCount"]) + 1
+                        )
+                        records.append(record)
+                    return queue_name, records
+        return None
+
+    def deliver(self, queue_name, records):
+        """
+        Invoke the queue's handler with a batch of records and return
+        the records which failed to the queue
+        """
+        handler = self.handlers[queue_name]
+        context = GdsSqsMemoryContext(queue_name, self.handler_timeout)
+        failed = set()
+        try:
+            response = handler({"Records": records}, context)
+            for failure in (response or {}).get("batchItemFailures", []):
+                failed.add(failure["itemIdentifier"])
+        except Exception as err:
+            if self.app is not None:
+                self.app.log.error(f"Handler for {queue_name} failed: {err}")
+            failed = set(record["messageId"] for record in records)
+
+        with self.lock:
+            self.stats["invocations"] += 1
+            self.stats["delivered"] += len(records)
+            self.stats["failed"] += len(failed)
+            for record in records:
+                if record["messageId"] not in failed:
+                    continue
+                if int(record["attributes"]["ApproximateReceiveCount"]) >= self.max_receive_count:
+                    self.dead_letters.append((queue_name, record))
+                    self.stats["dead_letters"] += 1
+                else:
+                    self.queues[queue_name].append(record)
+
+    def run(self, workers=1):
+        """
+        Deliver messages until every subscribed queue is empty
+        With workers > 1 batches are delivered concurrently on a thread pool
+        Returns the stats
+        """
+        if workers <= 1:
+            batch = self.receive()
+            while batch is not None:
+                self.deliver(*batch)
+                batch = self.receive()
+            return self.get_stats()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            while True:
+                while len(in_flight) < workers:
+                    batch = self.receive()
+                    if batch is None:
+                        break
+                    in_flight.add(executor.submit(self.deliver, *batch))
+                # the batches in flight may send more messages
+                if len(in_flight) == 0:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        return self.get_stats()
+
+    def get_stats(self):
+        with self.lock:
+            return self.stats.copy()
@@ -0,0 +1,63 @@
+"""
+Blob stores for claim-check messages.
+Payloads too big to send safely on SQS are written to a blob store and the
+message carries a pointer to the payload (the claim check) instead.
+In the lambda environment the store is an S3 bucket named by the
+CSW_CLAIM_CHECK_BUCKET environment variable. Locally and in tests
+CSW_CLAIM_CHECK_PATH names a directory instead.
+If neither is set the claim-check mode is off and payloads are sent inline.
+"""
+import os
+
+from chalicelib.aws.gds_s3_client import GdsS3Client
+
+
+class LocalBlobStore:
+    """
+    Store blobs as files under a local directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def put(self, key, body):
+        file_path = os.path.join(self.path, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as blob_file:
+            blob_file.write(body)
+        return f"file://{file_path}"
+
+    def get(self, key):
+        with open(os.path.join(self.path, key), "r") as blob_file:
+            return blob_file.read()
+
+
+class S3BlobStore:
+    """
+    Store blobs as objects in an S3 bucket in the CSW account
+    """
+
+    def __init__(self, app, bucket_name):
+        self.client = GdsS3Client(app)
+        self.bucket_name = bucket_name
+
+    def put(self, key, body):
+        return self.client.put_object(self.bucket_name, key, body)
+
+    def get(self, key):
+        return self.client.get_object(self.bucket_name, key).decode("utf-8")
+
+
+def get_blob_store(app):
+    """
+    Return the configured claim-check blob store or None to send payloads inline
+    """
+    bucket_name = os.environ.get("CSW_CLAIM_CHECK_BUCKET")
+    path = os.environ.get("CSW_CLAIM_CHECK_PATH")
+    if bucket_name:
+        store = S3BlobStore(app, bucket_name)
+    elif path:
+        store = LocalBlobStore(path)
+    else:
+        store = None
+    return store
@@ -8,6 +8,7 @@ class CloudTrailFileValidation(CriteriaDefault):
 
     active = True
     severity = 3
+    data_source = ("cloudtrail", "describe_trails", "account")
     ClientClass = GdsCloudtrailClient
     is_regional = False
     resource_type = "AWS::CLOUDTRAIL:LOG_VALIDATION"
@@ -10,6 +10,7 @@ class MultiregionalCloudtrail(CriteriaDefault):
 
     active = True
     severity = 2
+    data_source = ("cloudtrail", "describe_trails", "account")
     ClientClass = GdsCloudtrailClient
     is_regional = False
     resource_type = "AWS::CLOUDTRAIL:MULTIREGIONAL"
@@ -8,6 +8,7 @@ from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClie
 class AwsEc2SecurityGroupIngressOpen(CriteriaDefault):
 
     active = True
+    data_source = ("ec2", "describe_security_groups", "region")
 
     ClientClass = GdsEc2SecurityGroupClient
 
@@ -11,6 +11,7 @@ class AwsEc2SecurityGroupIngressSsh(CriteriaDefault):
 
     active = True
     severity = 3
+    data_source = ("ec2", "describe_security_groups", "region")
 
     ClientClass = GdsEc2SecurityGroupClient
     AllowlistClass = AccountSshCidrAllowlist
@@ -110,18 +111,15 @@ class AwsEc2SecurityGroupIngressSsh(CriteriaDefault):
         Append the standard valid ranges with any custom exceptions from the databases
         """
         valid_ranges = self.valid_ranges.copy()
-        now = datetime.datetime.now()
         # If the account ID is set retrieve any
         # allow list rules from the database
         # and append to valid_ranges
-        allow_list = (AccountSshCidrAllowlist
-            .select()
-            .where(
-            AccountSshCidrAllowlist.account_subscription_id == self.account_subscription_id,
-            AccountSshCidrAllowlist.date_expires > now
-        ))
-        for item in allow_list:
-            valid_ranges.append(item.cidr)
+        # The audit preloads them in the exception index
+        if self.exception_index is not None:
+            allow_list = self.exception_index.get_allowed_cidrs()
+        else:
+            allow_list = AccountSshCidrAllowlist.get_active_cidrs(self.account_subscription_id)
+        valid_ranges.extend(allow_list)
         return valid_ranges
 
     def get_cli_valid_ranges(self):
@@ -48,8 +48,10 @@ class AwsS3SecurePolicy(CriteriaDefault):
     def get_data(self, session, **kwargs):
         """Request buckets and policies from AWS API."""
         buckets = self.client.get_bucket_list(session)
-        for bucket in buckets:
-            policy = self.client.get_bucket_policy(session, bucket["Name"])
+        policies = self.client.enrich(
+            buckets, lambda bucket: self.client.get_bucket_policy(session, bucket["Name"])
+        )
+        for bucket, policy in zip(buckets, policies):
             try:
                 bucket["Policy"] = json.loads(policy)
             except (TypeError, json.decoder.JSONDecodeError):
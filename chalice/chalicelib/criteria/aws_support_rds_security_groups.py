@@ -36,8 +36,11 @@ class AwsSupportRDSSecurityGroups(TrustedAdvisorCriterion):
 
     def get_resource_data(self, session, region, resource):
         id = resource.get("resourceId",None)
-        group = self.resource_client.get_security_group_by_id(session, region, id)
-        return group
+        if not id:
+            return None
+        # the groups are fetched with one call per region once every
+        # flagged resource has asked for its group
+        return self.resource_client.load_security_group(session, region, id)
 
 
 class AwsSupportRDSSecurityGroupsYellow(AwsSupportRDSSecurityGroups):
@@ -45,10 +45,12 @@ class AwsVpcFlowLogsEnabled(CriteriaDefault):
         vpcs = self.client.describe_vpcs(session, params["region"])
 
         self.app.log.debug("Got VPCs, iterating over them to get flow log data")
-        for vpc in vpcs:
-            vpc["FlowLog"] = self.client.describe_flow_logs(
-                session, vpc, params["region"]
-            )
+        flow_logs = self.client.enrich(
+            vpcs,
+            lambda vpc: self.client.load_flow_logs(session, vpc, params["region"]),
+        )
+        for vpc, flow_log in zip(vpcs, flow_logs):
+            vpc["FlowLog"] = flow_log
 
         self.app.log.debug("Got all the flow log data")
         return vpcs
@@ -1,6 +1,11 @@
+import hashlib
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from botocore.exceptions import ClientError
+
 from chalicelib.aws.gds_aws_client import GdsAwsClient
 from chalicelib.aws.gds_support_client import GdsSupportClient
 
@@ -12,6 +17,23 @@ class CriteriaDefault:
 
     is_regional = True
 
+    # For regional criteria restrict the check to a list of region names
+    # eg ["us-east-1"] for global services reporting in a single region.
+    # None means every region enabled for the account is checked.
+    supported_regions = None
+
+    # The API data the criterion evaluates as (service, operation, scope)
+    # eg ("ec2", "describe_security_groups", "region")
+    # Criteria declaring the same data_source must have identical get_data
+    # methods. The audit collects the data once for all of them and evaluates
+    # each criterion against its own copy.
+    # None means the criterion collects its own data.
+    data_source = None
+
+    # Increment when the evaluation logic changes so that delta audits
+    # evaluate every resource again instead of carrying results forward
+    version = 1
+
     """
     exception_type = "resource" | "allowlist" 
     You can either record exceptions on a per resource basis 
@@ -36,6 +58,9 @@ class CriteriaDefault:
     # Set default account_subscription_id which should be set in the
     # audit lambda by calling the set_account_subscription_id() method
     account_subscription_id = None
+    # Active exceptions for the account and criterion being audited
+    # set in the audit lambda by calling the set_exception_index() method
+    exception_index = None
 
     resources = dict()
 
@@ -73,6 +98,75 @@ class CriteriaDefault:
     def get_data(self, session, **kwargs):
         return []
 
+    def get_request_data(self, session, params, timer=None, criterion_id=None):
+        """
+        Call get_data for a single request returning the data and any
+        boto3 ClientError (eg AccessDenied from an out-of-date policy)
+        instead of raising it.
+        The time taken is recorded as a get_data span if a timer is given.
+        """
+        start = time.perf_counter()
+        try:
+            data = self.get_data(session, **params)
+            error = None
+        except ClientError as boto3_error:
+            data = None
+            error = boto3_error
+        if timer is not None:
+            timer.record(
+                "get_data",
+                (time.perf_counter() - start) * 1000,
+                criterion_id,
+                params.get("region"),
+            )
+        return data, error
+
+    def collect_data(
+        self, session, requests, max_workers=1, timer=None, criterion_id=None, deadline=None
+    ):
+        """
+        Call get_data for each request (usually one per region).
+        With max_workers > 1 the requests are run concurrently on a bounded
+        thread pool so the elapsed time tracks the slowest region rather
+        than the sum of all of them.
+        Once the deadline is reached requests which have not been started
+        are left out of the results. The first request is always made so
+        every invocation makes progress.
+        Results are returned in the same order as the requests
+        as a list of (params, data, error) tuples.
+        """
+
+        def get_data(index, params):
+            if index > 0 and deadline is not None and deadline.reached():
+                return None
+            return self.get_request_data(session, params, timer, criterion_id)
+
+        if max_workers > 1 and len(requests) > 1:
+            workers = min(max_workers, len(requests))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(get_data, index, params)
+                    for index, params in enumerate(requests)
+                ]
+                results = [future.result() for future in futures]
+        else:
+            results = [get_data(index, params) for index, params in enumerate(requests)]
+
+        return [
+            (params, result[0], result[1])
+            for params, result in zip(requests, results)
+            if result is not None
+        ]
+
+    def filter_regions(self, regions):
+        """
+        Remove any regions from the list of enabled region names
+        which the criterion does not support
+        """
+        if self.supported_regions is None:
+            return list(regions)
+        return [region for region in regions if region in self.supported_regions]
+
     def get_resource_persistent_id(self, item, audit):
         """
         The resource_identifier needs to be something which will
@@ -214,6 +308,23 @@ class CriteriaDefault:
 
         return summary
 
+    def merge_summary(self, summary, other):
+        """
+        Add the stats from a summary of another set of resources
+        (eg another region) to the summary
+        """
+        if summary is None:
+            summary = self.empty_summary()
+        for key in ["all", "applicable", "non_compliant", "compliant", "not_applicable"]:
+            summary[key]["display_stat"] += other[key]["display_stat"]
+        regions = summary["regions"]["list"] + [
+            region for region in other["regions"]["list"]
+            if region not in summary["regions"]["list"]
+        ]
+        summary["regions"]["list"] = regions
+        summary["regions"]["count"] = len(regions)
+        return summary
+
     def translate(self, data={}):
         """
         Default method to create name and id fields for an audit_resource
@@ -228,6 +339,18 @@ class CriteriaDefault:
         }
         return item
 
+    def get_data_hash(self, api_item):
+        """
+        Hash the normalised API data with the criterion version
+        and, for allowlist criteria, the allowlist the evaluation depends on.
+        A resource with the same hash as the last audit evaluates the same.
+        """
+        evaluated = [type(self).__name__, self.version, api_item]
+        if self.exception_type == "allowlist" and self.exception_index is not None:
+            evaluated.append(sorted(self.exception_index.get_allowed_cidrs()))
+        normalised = json.dumps(evaluated, sort_keys=True, default=str)
+        return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
     def build_audit_resource_item(self, api_item, audit, criterion, params):
 
         item = self.translate(api_item)
@@ -257,6 +380,9 @@ class CriteriaDefault:
     def set_account_subscription_id(self, account_subscription_id):
         self.account_subscription_id = account_subscription_id
 
+    def set_exception_index(self, exception_index):
+        self.exception_index = exception_index
+
 
 class TrustedAdvisorCriterion(CriteriaDefault):
     """
@@ -287,9 +413,11 @@ class TrustedAdvisorCriterion(CriteriaDefault):
         )
         # if the TA results does not contain the key flaggedResources, add it with an empty list for its value
         flagged = output.get("flaggedResources",[])
-        for resource in flagged:
-            region = resource["metadata"][0]
-            original = self.get_resource_data(session, region, resource)
+        originals = self.client.enrich(
+            flagged,
+            lambda resource: self.get_resource_data(session, resource["metadata"][0], resource),
+        )
+        for resource, original in zip(flagged, originals):
             resource["originalResourceData"] = original
 
         self.app.log.debug(json.dumps(output))
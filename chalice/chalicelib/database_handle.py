@@ -134,6 +134,31 @@ class DatabaseHandle:
             self.app.log.error(str(e))
         return created
 
+    def create_audit_resources(self, event):
+        """
+        Bulk insert audit_resource records each with its resource_compliance
+        record using the buffered AuditResourceWriter.
+        event["Items"] is a list of {"AuditResource": {...}, "ResourceCompliance": {...}}
+        """
+        from chalicelib.models import AuditResourceWriter
+
+        db = self.get_handle()
+        created = []
+        try:
+            db.connect()
+            writer = AuditResourceWriter(event.get("ChunkSize"))
+            for item_data in event["Items"]:
+                created.extend(
+                    writer.add(item_data["AuditResource"], item_data["ResourceCompliance"])
+                )
+            created.extend(writer.flush())
+            db.close()
+        except Exception as e:
+            if db is not None:
+                db.rollback()
+            self.app.log.error(str(e))
+        return created
+
     def get_item(self, event):
         db = self.get_handle()
         db.connect()
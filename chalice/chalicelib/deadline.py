@@ -0,0 +1,47 @@
+"""
+Lambda deadlines.
+Evaluating the criteria for a large account can take longer than the lambda
+timeout. The deadline is read from the lambda context so the audit can stop
+starting new regions in time to save the regions it has completed and
+send a continuation message for the rest.
+
+Without a context (eg when handlers are called directly from the CLI or
+the tests) the deadline is never reached.
+"""
+import os
+
+
+def get_reserve_seconds():
+    """
+    The time kept back before the lambda timeout to finish the region being
+    evaluated, save the checkpoints and send the continuation message.
+    Set CSW_DEADLINE_RESERVE_SECONDS to change it.
+    """
+    try:
+        reserve = float(os.environ.get("CSW_DEADLINE_RESERVE_SECONDS", 60))
+    except ValueError:
+        reserve = 60
+    return max(reserve, 0)
+
+
+class Deadline:
+    def __init__(self, context=None, reserve_seconds=None):
+        self.context = context
+        if reserve_seconds is None:
+            reserve_seconds = get_reserve_seconds()
+        self.reserve_ms = reserve_seconds * 1000
+
+    def get_remaining_ms(self):
+        """
+        Milliseconds before the lambda is timed out or None without a context
+        """
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis()
+
+    def reached(self):
+        """
+        Whether it is too late to start another unit of work
+        """
+        remaining = self.get_remaining_ms()
+        return remaining is not None and remaining <= self.reserve_ms
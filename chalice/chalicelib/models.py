@@ -1,7 +1,10 @@
+import math
 import os
 import datetime
 import peewee
 import re
+import zlib
+from playhouse import shortcuts
 
 # peewee has a validator library but it has a max version of 3.1
 # this would mean downgrading our peewee version.
@@ -130,7 +133,7 @@ class User(database_handle.BaseModel):
 
             for exception in exceptions:
                 exception.audit_resource_id = (
-                    AuditResource.select()
+                    AuditResource.select_summary()
                     .where(
                         AuditResource.resource_persistent_id
                         == exception.resource_persistent_id,
@@ -345,8 +348,8 @@ class ProductTeam(database_handle.BaseModel):
                             "resources": [],
                         }
                         for compliance in failed_resources:
-                            audit_resource = AuditResource.get_by_id(
-                                compliance.audit_resource_id
+                            audit_resource = AuditResource.get_summary_by_id(
+                                compliance.audit_resource_id_id
                             )
                             criterion = Criterion.get_by_id(audit_resource.criterion_id)
                             status = Status.get_by_id(compliance.status_id)
@@ -570,7 +573,7 @@ class ProductTeam(database_handle.BaseModel):
         iam_client = GdsIamClient(app)
         caller = iam_client.get_caller_details()
         local_audit_session = iam_client.get_chained_session(caller["Account"])
-        roles = iam_client.list_roles(local_audit_session)
+        roles = iam_client.iter_roles(local_audit_session)
         team_role = None
         for role in roles:
             print(str(role))
@@ -639,7 +642,7 @@ class ProductTeam(database_handle.BaseModel):
         iam_client.get_chain_role_params()
         caller = iam_client.get_caller_details()
         local_audit_session = iam_client.get_chained_session(caller["Account"])
-        roles = iam_client.list_roles(local_audit_session)
+        roles = iam_client.iter_roles(local_audit_session)
         team_roles = []
         for role in roles:
             app.log.debug(str(role))
@@ -865,15 +868,195 @@ class AccountAudit(database_handle.BaseModel):
     date_updated = peewee.DateTimeField(default=datetime.datetime.now)
     date_completed = peewee.DateTimeField(null=True)
     active_criteria = peewee.IntegerField(default=0)
+    criteria_attempted = peewee.IntegerField(default=0)
     criteria_processed = peewee.IntegerField(default=0)
     criteria_passed = peewee.IntegerField(default=0)
     criteria_failed = peewee.IntegerField(default=0)
     issues_found = peewee.IntegerField(default=0)
     finished = peewee.BooleanField(default=False)
+    # partial audits only evaluate the criteria which were due
+    partial = peewee.BooleanField(default=False)
+    # set once the completed audit message has been sent
+    completion_sent = peewee.BooleanField(default=False)
 
     class Meta:
         table_name = "account_audit"
 
+    @classmethod
+    def create_batch(cls, account_subscriptions, partial=False):
+        """
+        Create an empty audit record for each account subscription
+        with one multi-row insert inside a single transaction.
+        Returns the new audit records in the same order as the accounts.
+        """
+        accounts = list(account_subscriptions)
+        if len(accounts) == 0:
+            return []
+        rows = [
+            {"account_subscription_id": account.id, "partial": partial}
+            for account in accounts
+        ]
+        with cls._meta.database.atomic():
+            audits = list(cls.insert_many(rows).returning(cls).execute())
+        # reuse the account records already loaded rather than lazy loading
+        # each foreign key again when the audits are serialized
+        for audit, account in zip(audits, accounts):
+            audit.account_subscription_id = account
+        return audits
+
+    @classmethod
+    def record_criterion_result(
+        cls, account_audit_id, processed, failed_resources, audit_criterion_id=None
+    ):
+        """
+        Atomically add the result of one audit criterion to the audit stats
+        with a single UPDATE ... SET column = column + n statement
+        so each evaluated criterion costs the same however big the audit is.
+        If the audit_criterion_id is passed its counted flag is claimed first
+        so a redelivered result is only added once.
+        Returns the number of audit records updated.
+        """
+        failed = 1 if failed_resources > 0 else 0
+        passed = 1 if processed and not failed else 0
+        with cls._meta.database.atomic():
+            if audit_criterion_id is not None:
+                claimed = (
+                    AuditCriterion.update(counted=True)
+                    .where(
+                        AuditCriterion.id == audit_criterion_id,
+                        AuditCriterion.counted == False,
+                    )
+                    .execute()
+                )
+                if claimed == 0:
+                    return 0
+            return (
+                cls.update(
+                    criteria_attempted=cls.criteria_attempted + 1,
+                    criteria_processed=cls.criteria_processed + (1 if processed else 0),
+                    criteria_passed=cls.criteria_passed + passed,
+                    criteria_failed=cls.criteria_failed + failed,
+                    issues_found=cls.issues_found + failed_resources,
+                    date_updated=datetime.datetime.now(),
+                )
+                .where(cls.id == account_audit_id)
+                .execute()
+            )
+
+    @classmethod
+    def mark_finished(cls, account_audit_id):
+        """
+        Flag the audit as finished once every active criterion has been attempted.
+        The conditional update only succeeds once so when messages are processed
+        concurrently exactly one caller gets True and completes the audit.
+        """
+        updated = (
+            cls.update(finished=True, date_completed=datetime.datetime.now())
+            .where(
+                cls.id == account_audit_id,
+                cls.finished == False,
+                cls.criteria_attempted >= cls.active_criteria,
+            )
+            .execute()
+        )
+        return updated == 1
+
+    @classmethod
+    def mark_completion_sent(cls, account_audit_id):
+        """
+        Flag that the completed audit message has been sent.
+        Until then a redelivered result for the finished audit sends it again.
+        """
+        updated = (
+            cls.update(completion_sent=True)
+            .where(cls.id == account_audit_id, cls.completion_sent == False)
+            .execute()
+        )
+        return updated == 1
+
+    def carry_forward_criteria(self, previous_audit):
+        """
+        Copy the results of the active criteria this partial audit did not
+        evaluate from previous_audit, with their resources and compliance,
+        so the audit has a result for every criterion and can replace
+        previous_audit as the account's latest audit.
+        As in a delta audit the copied resources reference the records
+        holding their data. The copy is one transaction and the audit
+        criteria are unique so it only happens once.
+        Returns the number of audit criteria copied.
+        """
+        with self._meta.database.atomic():
+            evaluated = AuditCriterion.select(AuditCriterion.criterion_id).where(
+                AuditCriterion.account_audit_id == self.id
+            )
+            carried = list(
+                AuditCriterion.select()
+                .join(Criterion)
+                .where(
+                    AuditCriterion.account_audit_id == previous_audit.id,
+                    AuditCriterion.attempted == True,
+                    AuditCriterion.criterion_id.not_in(evaluated),
+                    Criterion.active == True,
+                )
+            )
+            if len(carried) == 0:
+                return 0
+            AuditCriterion.insert_many(
+                [
+                    {
+                        "account_audit_id": self.id,
+                        "criterion_id": audit_criterion.criterion_id_id,
+                        "regions": audit_criterion.regions,
+                        "resources": audit_criterion.resources,
+                        "tested": audit_criterion.tested,
+                        "passed": audit_criterion.passed,
+                        "failed": audit_criterion.failed,
+                        "ignored": audit_criterion.ignored,
+                        "processed": audit_criterion.processed,
+                        "attempted": True,
+                        "counted": True,
+                        "carried_from_id": audit_criterion.carried_from_id or audit_criterion.id,
+                    }
+                    for audit_criterion in carried
+                ]
+            ).execute()
+
+            writer = AuditResourceWriter()
+            resources = (
+                AuditResource.select_summary()
+                .select_extend(*ResourceCompliance._meta.sorted_fields)
+                .join(ResourceCompliance, attr="compliance")
+                .where(
+                    AuditResource.account_audit_id == previous_audit.id,
+                    AuditResource.criterion_id.in_(
+                        [audit_criterion.criterion_id_id for audit_criterion in carried]
+                    ),
+                )
+            )
+            for audit_resource in resources:
+                resource_item = dict(audit_resource.__data__)
+                del resource_item["id"]
+                resource_item["account_audit_id"] = self.id
+                resource_item["carried_from_id"] = audit_resource.carried_from_id or audit_resource.id
+                compliance = dict(audit_resource.compliance.__data__)
+                del compliance["id"]
+                writer.add(resource_item, compliance)
+            writer.flush()
+
+            processed = [audit_criterion for audit_criterion in carried if audit_criterion.processed]
+            AccountAudit.update(
+                active_criteria=AccountAudit.active_criteria + len(carried),
+                criteria_attempted=AccountAudit.criteria_attempted + len(carried),
+                criteria_processed=AccountAudit.criteria_processed + len(processed),
+                criteria_passed=AccountAudit.criteria_passed
+                + len([audit_criterion for audit_criterion in processed if audit_criterion.failed == 0]),
+                criteria_failed=AccountAudit.criteria_failed
+                + len([audit_criterion for audit_criterion in carried if audit_criterion.failed > 0]),
+                issues_found=AccountAudit.issues_found
+                + sum(audit_criterion.failed for audit_criterion in carried),
+            ).where(AccountAudit.id == self.id).execute()
+        return len(carried)
+
     def get_audit_failed_resources(self):
         account_audit_id = self.id
         try:
@@ -894,7 +1077,7 @@ class AccountAudit(database_handle.BaseModel):
         issues_list = []
         if len(account_issues) > 0:
             for compliance in account_issues:
-                audit_resource = AuditResource.get_by_id(compliance.audit_resource_id)
+                audit_resource = AuditResource.get_summary_by_id(compliance.audit_resource_id_id)
                 criterion = Criterion.get_by_id(audit_resource.criterion_id)
                 status = Status.get_by_id(compliance.status_id)
                 issues_list.append(
@@ -990,6 +1173,8 @@ class Criterion(database_handle.BaseModel):
     active = peewee.BooleanField(default=True)
     is_regional = peewee.BooleanField(default=True)
     severity = peewee.IntegerField(default=1)
+    # hours between scheduled runs, defaults to the interval for the severity
+    audit_interval_hours = peewee.IntegerField(null=True)
 
     class Meta:
         table_name = "criterion"
@@ -1075,9 +1260,69 @@ class AuditCriterion(database_handle.BaseModel):
     ignored = peewee.IntegerField(default=0)
     processed = peewee.BooleanField(default=False)
     attempted = peewee.BooleanField(default=False)
+    # set once the result has been added to the account_audit stats
+    counted = peewee.BooleanField(default=False)
+    # set when each region is evaluated in its own message
+    regions_expected = peewee.IntegerField(null=True)
+    # the earlier audit criterion whose results were copied into
+    # a partial audit which did not evaluate the criterion
+    carried_from_id = peewee.IntegerField(null=True)
 
     class Meta:
         table_name = "audit_criterion"
+        indexes = ((("account_audit_id", "criterion_id"), True),)
+
+    def mark_attempted(self):
+        """
+        Save the stats and flag the audit criterion as attempted.
+        When regions are evaluated in separate messages more than one may
+        find every region complete. The conditional update only succeeds
+        once so exactly one caller gets True and sends the evaluated metric.
+        """
+        fields = [
+            "regions", "resources", "tested", "passed", "failed", "ignored", "processed"
+        ]
+        values = {field: getattr(self, field) for field in fields}
+        updated = (
+            AuditCriterion.update(attempted=True, **values)
+            .where(AuditCriterion.id == self.id, AuditCriterion.attempted == False)
+            .execute()
+        )
+        self.attempted = True
+        return updated == 1
+
+    @classmethod
+    def create_batch(cls, audit, criteria):
+        """
+        Create an audit criterion record for each criterion in an audit
+        with one multi-row insert inside a single transaction.
+        (account_audit_id, criterion_id) is unique so records which already
+        exist, eg from a redelivered message, are left as they are.
+        Returns the new and existing records in the same order as the criteria.
+        """
+        criteria = list(criteria)
+        if len(criteria) == 0:
+            return []
+        rows = [
+            {"account_audit_id": audit.id, "criterion_id": criterion.id}
+            for criterion in criteria
+        ]
+        with cls._meta.database.atomic():
+            cls.insert_many(rows).on_conflict_ignore().execute()
+        existing = cls.select().where(
+            cls.account_audit_id == audit.id,
+            cls.criterion_id.in_([criterion.id for criterion in criteria]),
+        )
+        by_criterion = {
+            audit_criterion.criterion_id_id: audit_criterion for audit_criterion in existing
+        }
+        audit_criteria = []
+        for criterion in criteria:
+            audit_criterion = by_criterion[criterion.id]
+            audit_criterion.account_audit_id = audit
+            audit_criterion.criterion_id = criterion
+            audit_criteria.append(audit_criterion)
+        return audit_criteria
 
     def get_resources_by_status(self, status_id):
         account_audit_id = self.account_audit_id
@@ -1107,7 +1352,7 @@ class AuditCriterion(database_handle.BaseModel):
         issues_list = []
         if len(account_issues) > 0:
             for compliance in account_issues:
-                audit_resource = AuditResource.get_by_id(compliance.audit_resource_id)
+                audit_resource = AuditResource.get_summary_by_id(compliance.audit_resource_id_id)
                 criterion = Criterion.get_by_id(audit_resource.criterion_id)
                 status = Status.get_by_id(compliance.status_id)
                 issues_list.append(
@@ -1127,7 +1372,7 @@ class AuditCriterion(database_handle.BaseModel):
         if len(account_issues) > 0:
             status = Status.get_by_id(status_id)
             for compliance in account_issues:
-                audit_resource = AuditResource.get_by_id(compliance.audit_resource_id)
+                audit_resource = AuditResource.get_summary_by_id(compliance.audit_resource_id_id)
                 criterion = Criterion.get_by_id(audit_resource.criterion_id)
                 issues_list.append(
                     {
@@ -1151,12 +1396,145 @@ class AuditResource(database_handle.BaseModel):
     resource_id = peewee.CharField()
     resource_name = peewee.CharField(null=True)
     resource_persistent_id = peewee.CharField(null=True)
-    resource_data = peewee.TextField()
+    # the API data is stored compressed in audit_resource_data
+    # only records written before it existed have the data here
+    resource_data = peewee.TextField(null=True)
     date_evaluated = peewee.DateTimeField(default=datetime.datetime.now)
+    # hash of the API data and the criterion version
+    data_hash = peewee.CharField(null=True)
+    # the earlier record holding the resource data when it was unchanged
+    carried_from_id = peewee.ForeignKeyField(
+        "self", null=True, backref="carried_forward", lazy_load=False
+    )
 
     class Meta:
         table_name = "audit_resource"
 
+    def get_resource_data(self):
+        """
+        Load the resource data for this record or the earlier record
+        it was carried forward from
+        """
+        if self.resource_data is not None:
+            return self.resource_data
+        data_id = self.carried_from_id or self.id
+        resource_data = AuditResourceData.get_resource_data(data_id)
+        if resource_data is None and self.carried_from_id is not None:
+            # carried forward from a record which has not been converted
+            resource_data = (
+                AuditResource.select(AuditResource.resource_data)
+                .where(AuditResource.id == self.carried_from_id)
+                .scalar()
+            )
+        return resource_data
+
+    def serialize(self, include_data=False):
+        """
+        The resource data is only loaded and decompressed if include_data is set
+        """
+        data = shortcuts.model_to_dict(
+            self, exclude=[AuditResource.carried_from_id, AuditResource.resource_data]
+        )
+        data["carried_from_id"] = self.carried_from_id
+        if include_data:
+            data["resource_data"] = self.get_resource_data()
+        return data
+
+    @classmethod
+    def get_previous_evaluations(cls, account_audit, criterion_id, region=None):
+        """
+        Return the resources recorded for the criterion (and region) by the
+        latest earlier audit of the account which processed it, keyed by
+        resource_persistent_id with the data hash and compliance of each.
+        """
+        previous_audit_id = (
+            AuditCriterion.select(peewee.fn.MAX(AuditCriterion.account_audit_id))
+            .join(AccountAudit)
+            .where(
+                AccountAudit.account_subscription_id == account_audit.account_subscription_id,
+                AccountAudit.id < account_audit.id,
+                AuditCriterion.criterion_id == criterion_id,
+                AuditCriterion.processed == True,
+            )
+            .scalar()
+        )
+        if previous_audit_id is None:
+            return {}
+        query = (
+            cls.select(cls, ResourceCompliance)
+            .join(ResourceCompliance, attr="compliance")
+            .where(cls.account_audit_id == previous_audit_id, cls.criterion_id == criterion_id)
+        )
+        if region is not None:
+            query = query.where(cls.region == region)
+        previous = {}
+        for audit_resource in query:
+            compliance = audit_resource.compliance
+            previous[audit_resource.resource_persistent_id] = {
+                "id": audit_resource.id,
+                # carry forward a reference to the record holding the data
+                "data_id": audit_resource.carried_from_id or audit_resource.id,
+                "data_hash": audit_resource.data_hash,
+                "compliance": {
+                    "annotation": compliance.annotation,
+                    "resource_type": compliance.resource_type,
+                    "resource_id": compliance.resource_id,
+                    "compliance_type": compliance.compliance_type,
+                    "is_compliant": compliance.is_compliant,
+                    "is_applicable": compliance.is_applicable,
+                    "status_id": compliance.status_id_id,
+                },
+            }
+        return previous
+
+    @classmethod
+    def select_summary(cls):
+        """
+        Select every column except the legacy resource_data column
+        for queries listing resources
+        """
+        return cls.select(
+            *[field for field in cls._meta.sorted_fields if field is not cls.resource_data]
+        )
+
+    @classmethod
+    def get_summary_by_id(cls, audit_resource_id):
+        return cls.select_summary().where(cls.id == audit_resource_id).get()
+
+    @classmethod
+    def delete_evaluated(cls, account_audit_id, criterion_id, region=None):
+        """
+        Delete the audit_resource and resource_compliance records for an audit
+        criterion, or one region of it, left by an earlier attempt
+        so the records can be written again without duplicates.
+        """
+        resources = cls.select(cls.id).where(
+            cls.account_audit_id == account_audit_id, cls.criterion_id == criterion_id
+        )
+        if region is not None:
+            resources = resources.where(cls.region == region)
+        resource_ids = [resource.id for resource in resources]
+        if len(resource_ids) > 0:
+            ResourceCompliance.delete().where(
+                ResourceCompliance.audit_resource_id.in_(resource_ids)
+            ).execute()
+            AuditResourceData.delete().where(
+                AuditResourceData.audit_resource_id.in_(resource_ids)
+            ).execute()
+            cls.delete().where(cls.id.in_(resource_ids)).execute()
+        return len(resource_ids)
+
+
+def serialize_with_audit_resource(model):
+    """
+    Serialize a model referencing an audit resource without following
+    carried_from_id, which holds the id rather than the record it refers to
+    """
+    data = shortcuts.model_to_dict(model, exclude=[AuditResource.carried_from_id])
+    if data["audit_resource_id"] is not None:
+        data["audit_resource_id"]["carried_from_id"] = model.audit_resource_id.carried_from_id
+    return data
+
 
 class ResourceCompliance(database_handle.BaseModel):
     audit_resource_id = peewee.ForeignKeyField(
@@ -1173,6 +1551,155 @@ class ResourceCompliance(database_handle.BaseModel):
     class Meta:
         table_name = "resource_compliance"
 
+    def serialize(self):
+        return serialize_with_audit_resource(self)
+
+
+class AuditResourceData(database_handle.BaseModel):
+    """
+    The raw API data for an audit resource compressed with zlib.
+    Stored apart from audit_resource so that queries listing resources
+    don't read the payloads. It is only loaded to show a single resource.
+    """
+
+    audit_resource_id = peewee.ForeignKeyField(
+        AuditResource, primary_key=True, backref="audit_resource_data", lazy_load=False
+    )
+    data = peewee.BlobField()
+
+    # batch size for converting audit_resource.resource_data
+    convert_batch_size = 1000
+
+    class Meta:
+        table_name = "audit_resource_data"
+
+    @staticmethod
+    def compress(resource_data):
+        return zlib.compress(resource_data.encode("utf-8"))
+
+    @staticmethod
+    def decompress(data):
+        return zlib.decompress(bytes(data)).decode("utf-8")
+
+    @classmethod
+    def get_resource_data(cls, audit_resource_id):
+        data = (
+            cls.select(cls.data).where(cls.audit_resource_id == audit_resource_id).scalar()
+        )
+        return None if data is None else cls.decompress(data)
+
+    @classmethod
+    def convert_batch(cls, batch_size=None):
+        """
+        Move the resource_data of a batch of audit_resource records written
+        before this table existed into compressed audit_resource_data records
+        Returns the number of records converted, 0 once there are none left.
+        """
+        batch_size = batch_size or cls.convert_batch_size
+        with cls._meta.database.atomic():
+            resources = list(
+                AuditResource.select(AuditResource.id, AuditResource.resource_data)
+                .where(AuditResource.resource_data.is_null(False))
+                .order_by(AuditResource.id)
+                .limit(batch_size)
+            )
+            if len(resources) == 0:
+                return 0
+            rows = [
+                {"audit_resource_id": resource.id, "data": cls.compress(resource.resource_data)}
+                for resource in resources
+            ]
+            cls.insert_many(rows).on_conflict_ignore().execute()
+            AuditResource.update(resource_data=None).where(
+                AuditResource.id.in_([resource.id for resource in resources])
+            ).execute()
+        return len(resources)
+
+
+class AuditResourceWriter:
+    """
+    Buffers evaluated resources and writes the audit_resource,
+    resource_compliance and compressed audit_resource_data records in chunks.
+    Each chunk is a multi-row insert per table inside one transaction with
+    the compliance and data records linked to the audit_resource ids
+    returned by the database.
+    Call flush once all the resources have been added.
+    """
+
+    chunk_size = 500
+
+    def __init__(self, chunk_size=None):
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.pending = []
+        self.written = 0
+
+    def add(self, audit_resource_item, compliance):
+        """
+        Queue an audit_resource dict and its compliance dict.
+        Once written, compliance["audit_resource_id"] is set to
+        the new AuditResource record.
+        Returns the records written if adding the item filled a chunk.
+        """
+        self.pending.append((audit_resource_item, compliance))
+        if len(self.pending) >= self.chunk_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Write any buffered resources and return the new AuditResource records
+        """
+        if len(self.pending) == 0:
+            return []
+        pending = self.pending
+        self.pending = []
+        resource_rows = [
+            self.get_row(AuditResource, resource_item) for resource_item, compliance in pending
+        ]
+        # the data is written compressed to audit_resource_data
+        for row in resource_rows:
+            row["resource_data"] = None
+        with AuditResource._meta.database.atomic():
+            audit_resources = list(
+                AuditResource.insert_many(resource_rows).returning(AuditResource).execute()
+            )
+            data_rows = []
+            for audit_resource, (resource_item, compliance) in zip(audit_resources, pending):
+                compliance["audit_resource_id"] = audit_resource
+                if resource_item.get("resource_data") is not None:
+                    data_rows.append(
+                        {
+                            "audit_resource_id": audit_resource.id,
+                            "data": AuditResourceData.compress(resource_item["resource_data"]),
+                        }
+                    )
+            compliance_rows = [
+                self.get_row(ResourceCompliance, compliance) for resource_item, compliance in pending
+            ]
+            ResourceCompliance.insert_many(compliance_rows).execute()
+            if len(data_rows) > 0:
+                AuditResourceData.insert_many(data_rows).execute()
+        self.written += len(pending)
+        return audit_resources
+
+    @staticmethod
+    def get_row(model, data):
+        """
+        Build an insert row with every column of the model so that all the
+        rows in a multi-row insert have the same shape.
+        Missing values fall back to the field default.
+        """
+        row = {}
+        for name, field in model._meta.fields.items():
+            if name == "id":
+                continue
+            value = data.get(name)
+            if value is None and field.default is not None:
+                value = field.default() if callable(field.default) else field.default
+            row[name] = value
+        return row
+
 
 # For non-green status issues we record a risk record
 class ResourceRiskAssessment(database_handle.BaseModel):
@@ -1196,6 +1723,9 @@ class ResourceRiskAssessment(database_handle.BaseModel):
     class Meta:
         table_name = "resource_risk_assessment"
 
+    def serialize(self):
+        return serialize_with_audit_resource(self)
+
 
 class ResourceException(database_handle.BaseModel):
     resource_persistent_id = peewee.CharField()
@@ -1243,6 +1773,28 @@ class ResourceException(database_handle.BaseModel):
 
         return exception
 
+    @classmethod
+    def get_active_exceptions(cls, criterion_id, account_subscription_id):
+        """
+        Load every active exception for the criterion and account in one query
+        returns a dict of exceptions keyed by resource_persistent_id
+        """
+        now = datetime.datetime.now()
+        exceptions = (
+            ResourceException.select()
+            .where(
+                ResourceException.criterion_id == criterion_id,
+                ResourceException.account_subscription_id == account_subscription_id,
+                ResourceException.date_created <= now,
+                ResourceException.date_expires >= now,
+            )
+            .order_by(ResourceException.id)
+        )
+        index = {}
+        for exception in exceptions:
+            index.setdefault(exception.resource_persistent_id, exception)
+        return index
+
     @classmethod
     def find_exception(
         cls, criterion_id, resource_persistent_id, account_subscription_id
@@ -1306,6 +1858,18 @@ class AccountSshCidrAllowlist(database_handle.BaseModel):
         # check for at least 16 bit subnet mask
         return allowlist_pattern
 
+    @classmethod
+    def get_active_cidrs(cls, account_subscription_id):
+        """
+        Return the unexpired allowed CIDRs for the account
+        """
+        now = datetime.datetime.now()
+        allow_list = AccountSshCidrAllowlist.select().where(
+            AccountSshCidrAllowlist.account_subscription_id == account_subscription_id,
+            AccountSshCidrAllowlist.date_expires > now,
+        )
+        return [item.cidr for item in allow_list]
+
     @classmethod
     def get_defaults(cls, account_subscription_id, user_id):
         now = datetime.datetime.now()
@@ -1320,6 +1884,295 @@ class AccountSshCidrAllowlist(database_handle.BaseModel):
         }
 
 
+class ExceptionIndex:
+    """
+    In-memory index of the exceptions which apply while evaluating
+    one criterion for one account.
+    Resource exceptions are loaded once keyed by resource_persistent_id
+    and the SSH CIDR allowlist is loaded the first time it is needed
+    so evaluating a criterion makes a fixed number of exception queries
+    however many resources fail.
+    """
+
+    def __init__(self, criterion_id, account_subscription_id):
+        self.criterion_id = criterion_id
+        self.account_subscription_id = account_subscription_id
+        self.exceptions = ResourceException.get_active_exceptions(
+            criterion_id, account_subscription_id
+        )
+        self.allowed_cidrs = None
+
+    def get_exception(self, resource_persistent_id):
+        """
+        Return the active exception for the resource or None
+        """
+        return self.exceptions.get(resource_persistent_id)
+
+    def get_allowed_cidrs(self):
+        """
+        Return the unexpired SSH CIDR allowlist entries for the account
+        """
+        if self.allowed_cidrs is None:
+            self.allowed_cidrs = AccountSshCidrAllowlist.get_active_cidrs(
+                self.account_subscription_id
+            )
+        return self.allowed_cidrs
+
+
+class AccountRegion(database_handle.BaseModel):
+    """
+    The regions enabled for an audited account.
+    Regions which need to be opted into are not returned by describe-regions
+    for accounts which have not opted in so regional criteria don't waste
+    time calling endpoints which will fail or return nothing.
+    The list is refreshed when it is older than max_age.
+    """
+
+    account_subscription_id = peewee.ForeignKeyField(
+        AccountSubscription, backref="account_regions"
+    )
+    region_name = peewee.CharField()
+    enabled = peewee.BooleanField(default=True)
+    date_updated = peewee.DateTimeField(default=datetime.datetime.now)
+
+    max_age = datetime.timedelta(days=1)
+
+    class Meta:
+        table_name = "account_region"
+        indexes = ((("account_subscription_id", "region_name"), True),)
+
+    @classmethod
+    def get_enabled_regions(cls, account_subscription_id, load_regions):
+        """
+        Return the names of the regions enabled for the account.
+        If the stored list is missing or out of date load_regions() is
+        called to get the current list of enabled region names which
+        replaces the stored list.
+        """
+        now = datetime.datetime.now()
+        stored = list(
+            cls.select().where(cls.account_subscription_id == account_subscription_id)
+        )
+        is_current = len(stored) > 0 and all(
+            (now - region.date_updated) < cls.max_age for region in stored
+        )
+        if is_current:
+            regions = [region.region_name for region in stored if region.enabled]
+        else:
+            regions = list(load_regions())
+            cls.replace_regions(account_subscription_id, regions, now)
+        return sorted(regions)
+
+    @classmethod
+    def replace_regions(cls, account_subscription_id, regions, date_updated=None):
+        if date_updated is None:
+            date_updated = datetime.datetime.now()
+        rows = [
+            {
+                "account_subscription_id": account_subscription_id,
+                "region_name": region,
+                "enabled": True,
+                "date_updated": date_updated,
+            }
+            for region in regions
+        ]
+        with cls._meta.database.atomic():
+            cls.delete().where(
+                cls.account_subscription_id == account_subscription_id
+            ).execute()
+            if len(rows) > 0:
+                cls.insert_many(rows).execute()
+
+
+class AccountCriterionRegion(database_handle.BaseModel):
+    """
+    How many resources a regional criterion found in each region of an account
+    when it was last checked. Regions without resources are only re-checked
+    once the empty_region_interval has passed.
+    """
+
+    account_subscription_id = peewee.ForeignKeyField(
+        AccountSubscription, backref="account_criterion_regions"
+    )
+    criterion_id = peewee.ForeignKeyField(Criterion, backref="account_criterion_regions")
+    region_name = peewee.CharField()
+    resources = peewee.IntegerField(default=0)
+    date_checked = peewee.DateTimeField(default=datetime.datetime.now)
+
+    empty_region_interval = datetime.timedelta(days=7)
+
+    class Meta:
+        table_name = "account_criterion_region"
+        indexes = ((("account_subscription_id", "criterion_id", "region_name"), True),)
+
+    @classmethod
+    def get_skippable_regions(cls, account_subscription_id, criterion_id):
+        """
+        Return the names of regions where the criterion found no resources
+        more recently than the empty_region_interval
+        """
+        checked_since = datetime.datetime.now() - cls.empty_region_interval
+        empty = cls.select(cls.region_name).where(
+            cls.account_subscription_id == account_subscription_id,
+            cls.criterion_id == criterion_id,
+            cls.resources == 0,
+            cls.date_checked > checked_since,
+        )
+        return set(region.region_name for region in empty)
+
+    @classmethod
+    def record_resources(cls, account_subscription_id, criterion_id, region_counts):
+        """
+        Upsert the number of resources found for each region
+        :param region_counts: dict of {region_name: resource count}
+        """
+        now = datetime.datetime.now()
+        rows = [
+            {
+                "account_subscription_id": account_subscription_id,
+                "criterion_id": criterion_id,
+                "region_name": region,
+                "resources": count,
+                "date_checked": now,
+            }
+            for region, count in region_counts.items()
+        ]
+        if len(rows) > 0:
+            (
+                cls.insert_many(rows)
+                .on_conflict(
+                    conflict_target=[
+                        cls.account_subscription_id,
+                        cls.criterion_id,
+                        cls.region_name,
+                    ],
+                    preserve=[cls.resources, cls.date_checked],
+                )
+                .execute()
+            )
+
+
+class AuditCriterionRegion(database_handle.BaseModel):
+    """
+    Checkpoint recording that one region of an audit criterion has been
+    evaluated and its resources written.
+    (audit_criterion_id, region_name) is the work key for evaluating criteria
+    so when an SQS message is redelivered the regions already completed
+    are not collected, evaluated or written again.
+    Non-regional criteria are recorded against the global_region.
+    """
+
+    global_region = "global"
+
+    audit_criterion_id = peewee.ForeignKeyField(
+        AuditCriterion, backref="audit_criterion_regions"
+    )
+    region_name = peewee.CharField()
+    check_passed = peewee.BooleanField(default=False)
+    summary = peewee.TextField(null=True)
+    date_completed = peewee.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "audit_criterion_region"
+        indexes = ((("audit_criterion_id", "region_name"), True),)
+
+    @classmethod
+    def get_completed(cls, audit_criterion_id):
+        """
+        Return the completed regions of the audit criterion keyed by region name
+        """
+        regions = cls.select().where(cls.audit_criterion_id == audit_criterion_id)
+        return {region.region_name: region for region in regions}
+
+    @classmethod
+    def complete(cls, audit_criterion_id, region_name, check_passed, summary):
+        """
+        Upsert the checkpoint for a region of an audit criterion
+        """
+        (
+            cls.insert(
+                audit_criterion_id=audit_criterion_id,
+                region_name=region_name,
+                check_passed=check_passed,
+                summary=app.utilities.to_json(summary),
+                date_completed=datetime.datetime.now(),
+            )
+            .on_conflict(
+                conflict_target=[cls.audit_criterion_id, cls.region_name],
+                preserve=[cls.check_passed, cls.summary, cls.date_completed],
+            )
+            .execute()
+        )
+
+    def get_summary(self):
+        return app.utilities.from_json(self.summary)
+
+
+class AuditTiming(database_handle.BaseModel):
+    """
+    How long a stage of processing an audit took, for a criterion and region
+    where the stage applies. Recorded in batches by timing.AuditTimer.
+    """
+
+    account_audit_id = peewee.ForeignKeyField(AccountAudit, backref="timings")
+    criterion_id = peewee.ForeignKeyField(Criterion, null=True, backref="timings")
+    region = peewee.CharField(null=True)
+    stage = peewee.CharField()
+    duration_ms = peewee.FloatField()
+    date_recorded = peewee.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "audit_timing"
+
+    @staticmethod
+    def get_percentile(durations, percentile):
+        """
+        Nearest rank percentile of a sorted list of durations
+        """
+        rank = max(1, math.ceil(len(durations) * percentile / 100))
+        return durations[rank - 1]
+
+    @classmethod
+    def get_percentiles(cls, since, group_by="criterion"):
+        """
+        Return the count, p50 and p95 duration of each stage for each
+        criterion or each account from the timings recorded since the date
+        """
+        if group_by == "account":
+            key_fields = [AccountSubscription.id, AccountSubscription.account_name]
+            query = (
+                cls.select(*key_fields, cls.stage, cls.duration_ms)
+                .join(AccountAudit)
+                .join(AccountSubscription)
+            )
+        else:
+            key_fields = [Criterion.id, Criterion.criterion_name]
+            query = cls.select(*key_fields, cls.stage, cls.duration_ms).join(
+                Criterion, peewee.JOIN.LEFT_OUTER
+            )
+        query = query.where(cls.date_recorded >= since).tuples()
+
+        groups = {}
+        for key_id, key_name, stage, duration_ms in query:
+            groups.setdefault((key_id, key_name, stage), []).append(duration_ms)
+        percentiles = []
+        for (key_id, key_name, stage), durations in groups.items():
+            durations.sort()
+            percentiles.append(
+                {
+                    f"{group_by}_id": key_id,
+                    f"{group_by}_name": key_name,
+                    "stage": stage,
+                    "count": len(durations),
+                    "p50": cls.get_percentile(durations, 50),
+                    "p95": cls.get_percentile(durations, 95),
+                }
+            )
+        # the slowest first
+        percentiles.sort(key=lambda item: item["p95"], reverse=True)
+        return percentiles
+
+
 class CurrentAccountStats(database_handle.BaseModel):
     audit_date = peewee.DateField(primary_key=True)
     account_id = peewee.ForeignKeyField(
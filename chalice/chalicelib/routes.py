@@ -617,7 +617,7 @@ def resource_details(id):
                     account.product_team_id
                 ).serialize(),
                 "account": account.serialize(),
-                "resource": resource.serialize(),
+                "resource": resource.serialize(include_data=True),
                 "criterion": models.Criterion.get_by_id(
                     resource.criterion_id
                 ).serialize(),
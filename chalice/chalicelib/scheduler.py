@@ -0,0 +1,246 @@
+"""
+Staggered audit scheduling.
+Rather than queueing an audit of every account at once each day the
+scheduler runs every slot_minutes and queues a slot's share of the audit
+load, spread across the audit window.
+
+Each criterion is due for an account once its interval has passed since it
+was last run for the account. The interval is the criterion's
+audit_interval_hours, or the interval for its severity from the
+CSW_AUDIT_SEVERITY_INTERVALS environment variable (eg "1:6,2:12,3:24"),
+or window_hours. An account is audited for the criteria which are due.
+A partial audit is merged with the account's latest audit when it
+completes, taking the results of the criteria it did not evaluate, and
+replaces it. Those copied results don't count as runs. If the latest
+audit is as old as the longest interval every criterion is run in a
+full audit with the criteria which are due.
+
+Accounts which have never completed an audit or whose latest audit was
+incomplete are audited first, followed by the accounts whose criteria are
+the most overdue.
+"""
+import math
+import os
+from datetime import datetime, timedelta
+
+from peewee import fn
+
+from chalicelib import models
+
+
+class AuditScheduler:
+
+    # hours over which the audit load is spread
+    window_hours = 24
+    # minutes between scheduler runs
+    slot_minutes = 15
+    # hours after which an unfinished audit is assumed to have failed
+    # and its unattempted criteria are due again
+    stale_after_hours = 3
+
+    def __init__(self, app, now=None):
+        self.app = app
+        self.now = now if now is not None else datetime.now()
+        self.severity_intervals = self.parse_severity_intervals(
+            os.environ.get("CSW_AUDIT_SEVERITY_INTERVALS", "")
+        )
+
+    def parse_severity_intervals(self, setting):
+        """
+        Intervals which are not a positive number of hours are ignored
+        """
+        intervals = {}
+        for item in setting.split(","):
+            if ":" in item:
+                try:
+                    severity, hours = item.split(":")
+                    intervals[int(severity)] = float(hours)
+                except ValueError:
+                    self.app.log.warning(f"Invalid audit severity interval: {item}")
+                    continue
+                if intervals[int(severity)] <= 0:
+                    self.app.log.warning(f"Invalid audit severity interval: {item}")
+                    del intervals[int(severity)]
+        return intervals
+
+    def get_slot_count(self):
+        return int(self.window_hours * 60 / self.slot_minutes)
+
+    def get_interval(self, criterion):
+        """
+        Hours between runs of the criterion for each account
+        """
+        if criterion.audit_interval_hours is not None and criterion.audit_interval_hours > 0:
+            interval = criterion.audit_interval_hours
+        else:
+            interval = self.severity_intervals.get(criterion.severity, self.window_hours)
+        return interval
+
+    def get_last_runs(self, max_interval):
+        """
+        The last time each criterion was run for each account
+        Criteria from unfinished audits only count while the audit is
+        younger than stale_after_hours unless they were attempted.
+        The audit criteria are created when an audit is scheduled so
+        audits still waiting in the queue are counted.
+        Results copied into a partial audit from an earlier audit are not runs.
+        Runs from more than a window before the longest interval are ignored
+        so those accounts are treated as never audited.
+        """
+        since = self.now - timedelta(hours=max_interval + self.window_hours)
+        stale = self.now - timedelta(hours=self.stale_after_hours)
+        query = (
+            models.AuditCriterion.select(
+                models.AccountAudit.account_subscription_id,
+                models.AuditCriterion.criterion_id,
+                fn.MAX(models.AccountAudit.date_started).alias("last_run"),
+            )
+            .join(models.AccountAudit)
+            .where(
+                models.AccountAudit.date_started >= since,
+                models.AuditCriterion.carried_from_id.is_null(),
+                (models.AuditCriterion.attempted == True)
+                | (models.AccountAudit.date_started >= stale),
+            )
+            .group_by(
+                models.AccountAudit.account_subscription_id,
+                models.AuditCriterion.criterion_id,
+            )
+            .tuples()
+        )
+        return {
+            (account_subscription_id, criterion_id): last_run
+            for account_subscription_id, criterion_id, last_run in query
+        }
+
+    def get_incomplete_accounts(self):
+        """
+        The ids of accounts whose latest audit did not process every criterion
+        """
+        query = (
+            models.AccountLatestAudit.select(models.AccountLatestAudit.account_subscription_id)
+            .join(models.AccountAudit)
+            .where(
+                models.AccountAudit.criteria_processed < models.AccountAudit.active_criteria
+            )
+            .tuples()
+        )
+        return {account_subscription_id for account_subscription_id, in query}
+
+    def get_latest_audits(self):
+        """
+        The date each account's latest audit started
+        """
+        query = (
+            models.AccountLatestAudit.select(
+                models.AccountLatestAudit.account_subscription_id,
+                models.AccountAudit.date_started,
+            )
+            .join(models.AccountAudit)
+            .tuples()
+        )
+        return {account_subscription_id: date_started for account_subscription_id, date_started in query}
+
+    def get_expected_load(self, accounts, criteria):
+        """
+        The criterion evaluations expected in each slot if the audits
+        of every account were evenly spread across the window
+        """
+        runs_per_window = sum(
+            self.window_hours / self.get_interval(criterion) for criterion in criteria
+        )
+        return math.ceil(len(accounts) * runs_per_window / self.get_slot_count())
+
+    def get_due(self, accounts, criteria):
+        """
+        Return a list of (priority, account, due criteria) for every account
+        with a criterion due, highest priority first
+        """
+        intervals = {criterion.id: self.get_interval(criterion) for criterion in criteria}
+        max_interval = max(intervals.values(), default=self.window_hours)
+        last_runs = self.get_last_runs(max_interval)
+        latest_audits = self.get_latest_audits()
+        incomplete = self.get_incomplete_accounts()
+        due = []
+        for account in accounts:
+            due_criteria = []
+            overdue = 0.0
+            for criterion in criteria:
+                last_run = last_runs.get((account.id, criterion.id))
+                if last_run is None:
+                    due_criteria.append(criterion)
+                    overdue = math.inf
+                else:
+                    hours = (self.now - last_run).total_seconds() / 3600
+                    if hours >= intervals[criterion.id]:
+                        due_criteria.append(criterion)
+                        overdue = max(overdue, hours / intervals[criterion.id])
+            if due_criteria:
+                latest_audit = latest_audits.get(account.id)
+                if (
+                    latest_audit is None
+                    or (self.now - latest_audit).total_seconds() / 3600 >= max_interval
+                ):
+                    # the latest audit is out of date
+                    due_criteria = list(criteria)
+                # never audited or incomplete first then the most overdue
+                priority = (
+                    account.id not in latest_audits or account.id in incomplete,
+                    overdue,
+                )
+                due.append((priority, account, due_criteria))
+        due.sort(key=lambda item: item[0], reverse=True)
+        return due
+
+    def plan(self, accounts, criteria):
+        """
+        Choose the accounts to audit in this slot and the criteria due for each.
+        Accounts are taken in priority order until the slot's share of the
+        expected load is used up.
+        Returns a list of (account, criteria) and the expected load for the slot.
+        """
+        criteria = list(criteria)
+        expected = self.get_expected_load(accounts, criteria)
+        planned = []
+        load = 0
+        for priority, account, due_criteria in self.get_due(accounts, criteria):
+            if load >= expected:
+                break
+            planned.append((account, due_criteria))
+            load += len(due_criteria)
+        return planned, expected
+
+    def get_load_curve(self, accounts, criteria):
+        """
+        Compare the expected criterion evaluations in each slot of the last
+        window with the evaluations actually queued
+        """
+        expected = self.get_expected_load(accounts, list(criteria))
+        slot = timedelta(minutes=self.slot_minutes)
+        start = self.now - timedelta(hours=self.window_hours)
+        query = (
+            models.AccountAudit.select(
+                models.AccountAudit.date_started,
+                fn.COUNT(models.AuditCriterion.id),
+            )
+            .join(models.AuditCriterion)
+            .where(
+                models.AccountAudit.date_started >= start,
+                models.AuditCriterion.carried_from_id.is_null(),
+            )
+            .group_by(models.AccountAudit.id, models.AccountAudit.date_started)
+            .tuples()
+        )
+        actual = [0] * self.get_slot_count()
+        for date_started, evaluations in query:
+            index = int((date_started - start) / slot)
+            if 0 <= index < len(actual):
+                actual[index] += evaluations
+        return [
+            {
+                "slot_start": start + slot * index,
+                "expected": expected,
+                "actual": evaluations,
+            }
+            for index, evaluations in enumerate(actual)
+        ]
@@ -0,0 +1,74 @@
+"""
+Audit timing spans.
+Each audit lambda records how long the stages of processing a message took
+(eg waiting in the queue, assuming the role, getting the data for a region,
+evaluating it and writing the results) and writes them to audit_timing in a
+single insert when the message has been processed.
+
+Recording timings must never fail an audit so errors writing them are
+logged and the spans dropped.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from chalicelib import models
+
+
+class AuditTimer:
+    def __init__(self, app, account_audit_id, clock=time.perf_counter):
+        self.app = app
+        self.account_audit_id = account_audit_id
+        self.clock = clock
+        self.spans = []
+        # get_data spans are recorded from the region worker threads
+        self.lock = threading.Lock()
+
+    def record(self, stage, duration_ms, criterion_id=None, region=None):
+        with self.lock:
+            self.spans.append(
+                {
+                    "account_audit_id": self.account_audit_id,
+                    "criterion_id": criterion_id,
+                    "region": region,
+                    "stage": stage,
+                    "duration_ms": duration_ms,
+                }
+            )
+
+    @contextmanager
+    def span(self, stage, criterion_id=None, region=None):
+        """
+        Record the time taken by the body of the with statement
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(stage, (self.clock() - start) * 1000, criterion_id, region)
+
+    def record_queue_wait(self, message, criterion_id=None):
+        """
+        Record the time the SQS message spent in the queue
+        from the SentTimestamp attribute of the record
+        """
+        try:
+            sent = int(message.to_dict()["attributes"]["SentTimestamp"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.record("queue_wait", max(0, time.time() * 1000 - sent), criterion_id)
+
+    def flush(self):
+        with self.lock:
+            spans = self.spans
+            self.spans = []
+        if len(spans) == 0:
+            return 0
+        try:
+            models.AuditTiming.insert_many(spans).execute()
+        except Exception:
+            self.app.log.error(
+                "Failed to record audit timings: " + self.app.utilities.get_typed_exception()
+            )
+            return 0
+        return len(spans)
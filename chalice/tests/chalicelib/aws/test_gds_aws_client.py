@@ -1,7 +1,23 @@
+from unittest import mock
+
+import boto3
+from botocore.stub import Stubber
+
 from tests.chalicelib.aws.test_client_default import TestClientDefault
 from chalicelib.aws.gds_aws_client import GdsAwsClient
 
 
+def create_stubbed_client(service_name):
+    client = boto3.client(
+        service_name,
+        region_name="eu-west-2",
+        aws_access_key_id="key",
+        aws_secret_access_key="secret",
+        aws_session_token="token",
+    )
+    return client, Stubber(client)
+
+
 class TestGdsAwsClient(TestClientDefault):
     @classmethod
     def setUp(self):
@@ -47,4 +63,44 @@ class TestGdsAwsClient(TestClientDefault):
         self.assertIn("test_key_1", lookup)
         self.assertEqual(lookup["test_key_1"], "test_val_1")
         self.assertIn("test_key_2", lookup)
-        self.assertEqual(lookup["test_key_2"], "test_val_2")
\ No newline at end of file
+        self.assertEqual(lookup["test_key_2"], "test_val_2")
+
+    def test_paginate(self):
+        kms, stubber = create_stubbed_client("kms")
+        keys = [
+            {"KeyId": f"key-{index}", "KeyArn": f"arn:aws:kms:eu-west-2:123456789012:key/key-{index}"}
+            for index in range(3)
+        ]
+        stubber.add_response(
+            "list_keys",
+            {"Keys": keys[:2], "Truncated": True, "NextMarker": "marker-1"},
+            {"Limit": 2},
+        )
+        stubber.add_response(
+            "list_keys", {"Keys": keys[2:], "Truncated": False}, {"Limit": 2, "Marker": "marker-1"}
+        )
+        with stubber, mock.patch.dict(GdsAwsClient.pagination_stats, clear=True):
+            items = self.client.paginate(kms, "list_keys", "Keys", page_size=2)
+            self.assertEqual(next(items), keys[0])
+            # the next page is only requested once the first has been used
+            self.assertEqual(len(stubber._queue), 1)
+            self.assertEqual(list(items), keys[1:])
+            stubber.assert_no_pending_responses()
+            self.assertEqual(
+                GdsAwsClient.get_pagination_stats(), {"list_keys": {"pages": 2, "items": 3}}
+            )
+
+    def test_paginate_page_sizes(self):
+        kms, stubber = create_stubbed_client("kms")
+        stubber.add_response("list_keys", {"Keys": [], "Truncated": False}, {"Limit": 50})
+        with stubber, mock.patch.dict(GdsAwsClient.page_sizes, {"list_keys": 50}):
+            self.assertEqual(list(self.client.paginate(kms, "list_keys", "Keys")), [])
+
+    def test_paginate_single_call(self):
+        cloudtrail, stubber = create_stubbed_client("cloudtrail")
+        stubber.add_response("describe_trails", {"trailList": [{"Name": "trail"}]}, {})
+        with stubber:
+            self.assertEqual(
+                list(self.client.paginate(cloudtrail, "describe_trails", "trailList")),
+                [{"Name": "trail"}],
+            )
@@ -0,0 +1,130 @@
+import os
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from app import app
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from tests.chalicelib.criteria.test_data import SESSION
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_batch_loader import GdsBatchLoader
+from chalicelib.aws.gds_enrichment_executor import GdsEnrichmentExecutor
+from chalicelib.criteria.aws_support_rds_security_groups import AwsSupportRDSSecurityGroupsRed
+from chalicelib.criteria.aws_vpc_flow_logs_enabled import AwsVpcFlowLogsEnabled
+
+
+class TestGdsBatchLoader(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+        self.loader = GdsBatchLoader(self.fetch_many, max_batch_size=3)
+
+    def fetch_many(self, region, ids):
+        self.fetched.append((region, ids))
+        return {item_id: f"{region}:{item_id}" for item_id in ids if item_id != "missing"}
+
+    def test_loads_are_fetched_together(self):
+        results = [
+            self.loader.load(region, item_id, region)
+            for region, item_id in [("eu-west-1", "a"), ("eu-west-2", "a"), ("eu-west-1", "missing")]
+        ]
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(
+            [result.result() for result in results], ["eu-west-1:a", "eu-west-2:a", None]
+        )
+        self.assertEqual(
+            self.fetched, [("eu-west-1", ["a", "missing"]), ("eu-west-2", ["a"])]
+        )
+
+    def test_batches_are_limited_in_size(self):
+        results = [self.loader.load("eu-west-1", item_id, "eu-west-1") for item_id in "abcde"]
+        self.assertEqual([result.result() for result in results][-1], "eu-west-1:e")
+        self.assertEqual([ids for region, ids in self.fetched], [["a", "b", "c"], ["d", "e"]])
+
+    def test_results_are_cached(self):
+        self.assertEqual(self.loader.get("eu-west-1", "a", "eu-west-1"), "eu-west-1:a")
+        self.assertEqual(self.loader.get("eu-west-1", "a", "eu-west-1"), "eu-west-1:a")
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(self.loader.get_stats()["hits"], 1)
+
+    def test_failures_are_raised_to_each_caller(self):
+        loader = GdsBatchLoader(mock.Mock(side_effect=[Exception("Throttling"), {"a": 1}]))
+        results = [loader.load("eu-west-1", item_id) for item_id in "ab"]
+        for result in results:
+            with self.assertRaisesRegex(Exception, "Throttling"):
+                result.result()
+        # failed ids are fetched again
+        self.assertEqual(loader.get("eu-west-1", "a"), 1)
+
+    def test_enrichment_batches_loads(self):
+        loader = GdsBatchLoader(self.fetch_many)
+        results = GdsEnrichmentExecutor(max_workers=4).map(
+            lambda item_id: loader.load("eu-west-1", item_id, "eu-west-1"), range(20)
+        )
+        self.assertEqual(results, [f"eu-west-1:{item_id}" for item_id in range(20)])
+        self.assertEqual(len(self.fetched), 1)
+
+
+class TestGdsAwsClientBatchLoader(TestClientDefault):
+    def setUp(self):
+        self.calls = []
+        for patch in [
+            mock.patch.object(GdsAwsClient, "enrichment", GdsEnrichmentExecutor(max_workers=4)),
+            mock.patch("botocore.client.BaseClient._make_api_call", side_effect=self.make_api_call),
+            mock.patch.dict(os.environ, {"AWS_DEFAULT_REGION": "eu-west-2"}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def make_api_call(self, operation_name, params):
+        self.calls.append((operation_name, params))
+        if operation_name == "DescribeVpcs":
+            return {"Vpcs": [{"VpcId": f"vpc-{index}"} for index in range(5)]}
+        values = params.get("Filters", [{"Values": []}])[0]["Values"]
+        if operation_name == "DescribeFlowLogs":
+            return {"FlowLogs": [{"ResourceId": "vpc-1"}, {"ResourceId": "vpc-3"}]}
+        return {"SecurityGroups": [{"GroupId": group_id} for group_id in values if group_id != "sg-gone"]}
+
+    def test_flow_logs_are_fetched_in_one_call(self):
+        vpcs = AwsVpcFlowLogsEnabled(self.app).get_data(SESSION, region="eu-west-1")
+        self.assertEqual([len(vpc["FlowLog"]) for vpc in vpcs], [0, 1, 0, 1, 0])
+        flow_log_calls = [params for operation, params in self.calls if operation == "DescribeFlowLogs"]
+        self.assertEqual(len(flow_log_calls), 1)
+        self.assertEqual(
+            flow_log_calls[0]["Filters"][0]["Values"], [f"vpc-{index}" for index in range(5)]
+        )
+
+    def test_security_groups_are_fetched_in_one_call_per_region(self):
+        check = AwsSupportRDSSecurityGroupsRed(self.app)
+        flagged = [
+            {"resourceId": group_id, "metadata": [region, group_id]}
+            for region, group_id in [
+                ("eu-west-1", "sg-1"), ("eu-west-2", "sg-2"), ("eu-west-1", "sg-gone"), ("eu-west-1", "sg-3"),
+            ]
+        ]
+        with mock.patch.object(check.client, "refresh_check_with_wait"), mock.patch.object(
+            check.client,
+            "describe_trusted_advisor_check_result",
+            return_value={"flaggedResources": flagged},
+        ):
+            resources = check.get_data(SESSION)
+        self.assertEqual(
+            [resource["originalResourceData"] for resource in resources],
+            [{"GroupId": "sg-1"}, {"GroupId": "sg-2"}, None, {"GroupId": "sg-3"}],
+        )
+        self.assertEqual(len(self.calls), 2)
+        # the groups are cached for the rest of the criterion run
+        group = check.resource_client.get_security_group_by_id(SESSION, "eu-west-1", "sg-3")
+        self.assertEqual(group, {"GroupId": "sg-3"})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_failed_security_group_lookups_are_tried_again(self):
+        client = AwsSupportRDSSecurityGroupsRed(app).resource_client
+        throttled = ClientError({"Error": {"Code": "Throttling"}}, "DescribeSecurityGroups")
+        with mock.patch(
+            "botocore.client.BaseClient._make_api_call",
+            side_effect=[throttled, {"SecurityGroups": [{"GroupId": "sg-1"}]}],
+        ):
+            self.assertIsNone(client.get_security_group_by_id(SESSION, "eu-west-1", "sg-1"))
+            group = client.get_security_group_by_id(SESSION, "eu-west-1", "sg-1")
+        self.assertEqual(group, {"GroupId": "sg-1"})
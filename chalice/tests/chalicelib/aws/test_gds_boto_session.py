@@ -0,0 +1,44 @@
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.loaders import JSONFileLoader
+
+from chalicelib.aws.gds_boto_session import GdsBotoSession
+
+
+class TestGdsBotoSession(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        self.boto_session = GdsBotoSession(create_session=self.create_session)
+
+    def create_session(self):
+        session = boto3.session.Session()
+        self.created.append(session)
+        return session
+
+    def test_clients_share_one_session(self):
+        self.boto_session.client(
+            "sqs", region_name="eu-west-2", **GdsBotoSession.prewarm_credentials
+        )
+        self.boto_session.client(
+            "kms", region_name="eu-west-2", **GdsBotoSession.prewarm_credentials
+        )
+        self.assertEqual(len(self.created), 1)
+
+    def test_prewarm_loads_each_service_once(self):
+        loaded = self.boto_session.prewarm(["sqs", "kms"])
+        self.assertEqual(list(loaded.keys()), ["sqs", "kms"])
+        self.assertEqual(list(self.boto_session.prewarm(["kms", "sts"]).keys()), ["sts"])
+        stats = self.boto_session.get_stats()
+        self.assertEqual(list(stats["prewarmed"].keys()), ["sqs", "kms", "sts"])
+
+    def test_prewarmed_models_are_reused(self):
+        self.boto_session.prewarm(["sqs"])
+        load_file = JSONFileLoader().load_file
+        with mock.patch.object(JSONFileLoader, "load_file", side_effect=load_file) as load:
+            self.boto_session.client(
+                "sqs", region_name="eu-west-1", **GdsBotoSession.prewarm_credentials
+            )
+        # the sqs models are not read from disk again
+        self.assertEqual([call for call in load.call_args_list if "sqs" in str(call)], [])
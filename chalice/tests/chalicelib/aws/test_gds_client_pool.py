@@ -0,0 +1,127 @@
+import os
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from tests.chalicelib.criteria.test_data import SESSION
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_client_pool import GdsClientPool
+from chalicelib.aws.gds_kms_client import GdsKmsClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestGdsClientPool(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = GdsClientPool(max_size=2, clock=self.clock)
+        self.created = 0
+
+    def create(self):
+        self.created += 1
+        return f"client-{self.created}"
+
+    def test_get_reuses_clients(self):
+        key = ("key-1", "ec2", "eu-west-2")
+        self.assertEqual(self.pool.get(key, self.create), "client-1")
+        self.assertEqual(self.pool.get(key, self.create), "client-1")
+        self.assertEqual(self.pool.get(("key-1", "ec2", "eu-west-1"), self.create), "client-2")
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["created"], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.pool.get(("a", "ec2", None), self.create)
+        self.pool.get(("b", "ec2", None), self.create)
+        # using a moves b to the front of the eviction order
+        self.pool.get(("a", "ec2", None), self.create)
+        self.pool.get(("c", "ec2", None), self.create)
+        self.assertEqual(self.pool.get_stats()["evicted"], 1)
+        self.assertEqual(self.pool.get(("a", "ec2", None), self.create), "client-1")
+        self.assertEqual(self.pool.get(("b", "ec2", None), self.create), "client-4")
+
+    def test_expired_credentials_are_evicted(self):
+        pool = GdsClientPool(clock=self.clock)
+        pool.get(("a", "ec2", None), self.create, expires=1010)
+        pool.get(("b", "ec2", None), self.create, expires=2000)
+        self.clock.now = 1010
+        self.assertEqual(pool.get(("a", "ec2", None), self.create), "client-3")
+        self.clock.now = 2000
+        # clients with expired credentials are removed when another is added
+        pool.get(("c", "ec2", None), self.create)
+        self.assertEqual(pool.get_stats()["expired"], 2)
+        self.assertEqual(pool.get_stats()["size"], 2)
+
+    def test_invalidate(self):
+        self.pool.get(("a", "ec2", None), self.create)
+        self.pool.get(("a", "kms", None), self.create)
+        self.assertEqual(self.pool.invalidate("a"), 2)
+        self.assertEqual(self.pool.get_stats()["size"], 0)
+
+    def test_concurrent_gets_create_one_client(self):
+        pool = GdsClientPool()
+        clients = []
+
+        def get():
+            clients.append(pool.get(("a", "ec2", None), self.create))
+
+        threads = [threading.Thread(target=get) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.created, 1)
+        self.assertEqual(set(clients), {"client-1"})
+
+
+class TestGdsAwsClientPool(TestClientDefault):
+    def setUp(self):
+        self.pool = GdsClientPool()
+        for patch in [
+            mock.patch.object(GdsAwsClient, "client_pool", self.pool),
+            mock.patch.dict(os.environ, {"AWS_DEFAULT_REGION": "eu-west-2"}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_session_clients_are_pooled(self):
+        client = GdsKmsClient(self.app)
+        kms = client.get_boto3_session_client("kms", SESSION)
+        self.assertIs(client.get_boto3_session_client("kms", SESSION), kms)
+        other = dict(SESSION, AccessKeyId="other")
+        self.assertIsNot(client.get_boto3_session_client("kms", other), kms)
+        self.assertIsNot(client.get_boto3_session_client("kms", SESSION, "us-east-1"), kms)
+        self.assertEqual(self.pool.get_stats()["created"], 3)
+
+    def test_key_details_reuse_one_client(self):
+        client = GdsKmsClient(self.app)
+        responses = {
+            "ListKeys": {"Keys": [{"KeyId": "key-1", "KeyArn": "arn-1"}, {"KeyId": "key-2", "KeyArn": "arn-2"}]},
+            "GetKeyRotationStatus": {"KeyRotationEnabled": True},
+            "DescribeKey": {"KeyMetadata": {"KeyId": "key"}},
+        }
+        with mock.patch(
+            "botocore.client.BaseClient._make_api_call",
+            side_effect=lambda operation_name, params: responses[operation_name],
+        ):
+            keys = client.get_key_list_with_details(SESSION)
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(self.pool.get_stats()["created"], 1)
+
+    def test_credential_expiry(self):
+        client = GdsAwsClient(self.app)
+        self.assertIsNone(client.get_credential_expiry(SESSION))
+        session = dict(
+            SESSION, Expiration=datetime.now(timezone.utc) + timedelta(seconds=3600)
+        )
+        expires = client.get_credential_expiry(session)
+        remaining = 3600 - client.credential_expiry_margin
+        self.assertAlmostEqual(expires, self.pool.clock() + remaining, delta=5)
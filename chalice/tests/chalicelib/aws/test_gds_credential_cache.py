@@ -0,0 +1,153 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from tests.chalicelib.aws.test_gds_client_pool import FakeClock
+from tests.chalicelib.criteria.test_data import SESSION
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_credential_cache import GdsCredentialCache
+
+
+def get_credentials(name, seconds=3600):
+    return dict(
+        SESSION,
+        AccessKeyId=name,
+        Expiration=datetime.now(timezone.utc) + timedelta(seconds=seconds),
+    )
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+class TestGdsCredentialCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = GdsCredentialCache(clock=self.clock)
+        self.assumed = 0
+
+    def assume(self):
+        self.assumed += 1
+        return get_credentials(f"key-{self.assumed}")
+
+    def test_get_reuses_credentials(self):
+        key = "000000000001-chain"
+        self.assertEqual(self.cache.get(key, self.assume)["AccessKeyId"], "key-1")
+        self.assertEqual(self.cache.get(key, self.assume)["AccessKeyId"], "key-1")
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["sts_calls"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_expired_credentials_are_assumed_again(self):
+        key = "000000000001-chain"
+        self.cache.get(key, self.assume)
+        # credentials within expiry_margin of expiring are not used
+        self.clock.now += 3600 - self.cache.expiry_margin
+        self.assertEqual(self.cache.get(key, self.assume)["AccessKeyId"], "key-2")
+        self.assertEqual(self.cache.get_stats()["misses"], 2)
+
+    def test_credentials_are_refreshed_before_expiry(self):
+        key = "000000000001-chain"
+        self.cache.get(key, self.assume)
+        self.clock.now += 3600 - self.cache.refresh_margin
+        # the cached credentials are returned while they are refreshed
+        self.assertEqual(self.cache.get(key, self.assume)["AccessKeyId"], "key-1")
+        self.cache.get_executor().shutdown(wait=True)
+        self.assertEqual(self.cache.get(key, self.assume)["AccessKeyId"], "key-2")
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["refreshes"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["sts_calls"], 2)
+
+    def test_failures_are_raised_and_not_cached(self):
+        def fail():
+            raise Exception("AccessDenied")
+
+        with self.assertRaises(Exception):
+            self.cache.get("000000000001-chain", fail)
+        self.assertEqual(self.cache.get("000000000001-chain", self.assume)["AccessKeyId"], "key-1")
+        self.assertEqual(self.cache.get_stats()["failures"], 1)
+
+    def test_concurrent_gets_assume_once(self):
+        release = threading.Event()
+        sessions = []
+
+        def assume():
+            release.wait(5)
+            return self.assume()
+
+        def get():
+            sessions.append(self.cache.get("000000000001-chain", assume))
+
+        threads = [threading.Thread(target=get) for index in range(8)]
+        threads[0].start()
+        wait_for(lambda: self.cache.in_flight)
+        for thread in threads[1:]:
+            thread.start()
+        wait_for(lambda: self.cache.get_stats()["coalesced"] == 7)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.assumed, 1)
+        self.assertEqual({session["AccessKeyId"] for session in sessions}, {"key-1"})
+        self.assertEqual(self.cache.get_stats()["sts_calls"], 1)
+
+    def test_least_recently_used_is_dropped(self):
+        cache = GdsCredentialCache(clock=self.clock)
+        cache.max_size = 2
+        for key in ["a", "b", "a", "c"]:
+            cache.get(key, self.assume)
+        self.assertEqual(list(cache.sessions.keys()), ["a", "c"])
+
+
+class TestGdsAwsClientCredentials(TestClientDefault):
+    def setUp(self):
+        self.cache = GdsCredentialCache()
+        self.chain = {"account": "1", "chain_role": "chain", "target_role": "target"}
+        self.loaded = []
+        for patch in [
+            mock.patch.object(GdsAwsClient, "credentials", self.cache),
+            mock.patch.object(GdsAwsClient, "get_chain_role_params", return_value=self.chain),
+            mock.patch.object(GdsAwsClient, "load_session", side_effect=self.load_session, autospec=True),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def load_session(self, client, account, role, session=None, *args):
+        self.loaded.append((account, role, None if session is None else session["AccessKeyId"]))
+        return get_credentials(f"{account}-{role}")
+
+    def test_chained_sessions_are_cached(self):
+        client = GdsAwsClient(self.app)
+        for index in range(3):
+            session = client.get_chained_session("2")
+            self.assertEqual(session["AccessKeyId"], "2-target")
+        # the target role is assumed with the chain session credentials
+        self.assertEqual(self.loaded, [("1", "chain", None), ("2", "target", "1-chain")])
+        self.assertEqual(self.cache.get_stats()["sts_calls"], 2)
+        self.assertTrue(client.assume_chained_role("2"))
+        self.assertEqual(len(self.loaded), 2)
+
+    def test_chain_failure_invalidates_chain_params(self):
+        client = GdsAwsClient(self.app)
+        with mock.patch.object(
+            GdsAwsClient, "load_session", side_effect=Exception("AccessDenied")
+        ), mock.patch.object(client.metadata, "invalidate") as invalidate:
+            self.assertIsNone(client.get_chained_session("2"))
+            self.assertFalse(client.assume_chained_role("2"))
+        invalidate.assert_called_with(("ssm", "chain_role_params"))
+
+    def test_assume_role_replaces_cached_session(self):
+        client = GdsAwsClient(self.app)
+        client.get_session("1", "chain")
+        self.assertTrue(client.assume_role("1", "chain"))
+        self.assertEqual(len(self.loaded), 2)
+        self.assertEqual(client.get_session("1", "chain")["AccessKeyId"], "1-chain")
+        self.assertEqual(len(self.loaded), 2)
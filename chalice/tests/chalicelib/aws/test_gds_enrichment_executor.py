@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from tests.chalicelib.criteria.test_data import SESSION
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_enrichment_executor import GdsEnrichmentExecutor
+from chalicelib.aws.gds_kms_client import GdsKmsClient
+
+
+class TestGdsEnrichmentExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = GdsEnrichmentExecutor(max_workers=4)
+
+    def test_results_are_in_item_order(self):
+        def fetch(item):
+            # later items finish first
+            time.sleep((10 - item) / 1000)
+            return item * 2
+
+        self.assertEqual(self.executor.map(fetch, range(10)), [item * 2 for item in range(10)])
+
+    def test_in_flight_is_bounded(self):
+        lock = threading.Lock()
+        counts = {"in_flight": 0, "most": 0}
+
+        def fetch(item):
+            with lock:
+                counts["in_flight"] += 1
+                counts["most"] = max(counts["most"], counts["in_flight"])
+            time.sleep(0.005)
+            with lock:
+                counts["in_flight"] -= 1
+
+        self.executor.map(fetch, range(20))
+        self.assertLessEqual(counts["most"], 4)
+        self.assertGreater(counts["most"], 1)
+
+    def test_errors_are_handled_per_item(self):
+        fetched = []
+
+        def fetch(item):
+            fetched.append(item)
+            if item in [2, 5]:
+                raise ValueError(f"item {item}")
+            return item
+
+        results = self.executor.map(fetch, range(8), on_error=lambda item, error: str(error))
+        self.assertEqual(results, [0, 1, "item 2", 3, 4, "item 5", 6, 7])
+        # without on_error the first error is raised once every item is finished
+        fetched.clear()
+        with self.assertRaisesRegex(ValueError, "item 2"):
+            self.executor.map(fetch, range(8))
+        self.assertEqual(sorted(fetched), list(range(8)))
+        self.assertEqual(self.executor.get_stats()["errors"], 4)
+
+    def test_nested_map_runs_in_the_worker(self):
+        executor = GdsEnrichmentExecutor(max_workers=2)
+
+        def fetch(item):
+            return executor.map(lambda inner: (item, inner), range(3))
+
+        results = executor.map(fetch, range(4))
+        self.assertEqual(results[3], [(3, 0), (3, 1), (3, 2)])
+
+    def test_single_worker_runs_in_the_caller(self):
+        executor = GdsEnrichmentExecutor(max_workers=1)
+        threads = executor.map(lambda item: threading.current_thread(), range(3))
+        self.assertEqual(set(threads), {threading.current_thread()})
+        self.assertIsNone(executor.executor)
+
+
+class TestGdsAwsClientEnrichment(TestClientDefault):
+    def test_key_details_are_fetched_concurrently(self):
+        keys = [{"KeyId": f"key-{index}", "KeyArn": f"arn-{index}"} for index in range(6)]
+
+        def make_api_call(operation_name, params):
+            if operation_name == "ListKeys":
+                return {"Keys": keys}
+            time.sleep(0.01)
+            if operation_name == "GetKeyRotationStatus":
+                return {"KeyRotationEnabled": params["KeyId"] != "arn-3"}
+            return {"KeyMetadata": {"Description": params["KeyId"]}}
+
+        with mock.patch.object(
+            GdsAwsClient, "enrichment", GdsEnrichmentExecutor(max_workers=4)
+        ), mock.patch(
+            "botocore.client.BaseClient._make_api_call", side_effect=make_api_call
+        ), mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "eu-west-2"}):
+            details = GdsKmsClient(self.app).get_key_list_with_details(SESSION)
+        self.assertEqual([key["Description"] for key in details], [key["KeyArn"] for key in keys])
+        self.assertEqual([key["KeyRotationEnabled"] for key in details], [True] * 3 + [False] + [True] * 2)
@@ -1,5 +1,9 @@
 import json
+from datetime import datetime
+from unittest import mock
+
 from tests.chalicelib.aws.test_client_default import TestClientDefault
+from tests.chalicelib.aws.test_gds_aws_client import create_stubbed_client
 from chalicelib.aws.gds_iam_client import GdsIamClient
 
 
@@ -18,6 +22,29 @@ class TestGdsIamClient(TestClientDefault):
     def test_init_client(self):
         self.assertIn("list_roles", dir(self.client))
 
+    def test_list_roles_pages(self):
+        """
+        Test that roles beyond the first page are returned
+        """
+        roles = [
+            {
+                "Path": "/",
+                "RoleName": f"role-{index}",
+                "RoleId": f"AROAEXAMPLEROLEID{index}",
+                "Arn": f"arn:aws:iam::123456789012:role/role-{index}",
+                "CreateDate": datetime(2020, 1, 1),
+            }
+            for index in range(3)
+        ]
+        iam, stubber = create_stubbed_client("iam")
+        stubber.add_response("list_roles", {"Roles": roles[:2], "IsTruncated": True, "Marker": "page-2"})
+        stubber.add_response(
+            "list_roles", {"Roles": roles[2:], "IsTruncated": False}, {"Marker": "page-2"}
+        )
+        with stubber, mock.patch.object(self.client, "get_boto3_session_client", return_value=iam):
+            listed = self.client.list_roles({})
+        self.assertEqual([role["RoleName"] for role in listed], ["role-0", "role-1", "role-2"])
+
     def test_parse_arn_components(self):
         arn = "arn:aws:iam:[region]:123456789012:user/user@domain.com"
         parsed = self.client.parse_arn_components(arn)
@@ -0,0 +1,89 @@
+import os
+import unittest
+from unittest import mock
+
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_ec2_client import GdsEc2Client
+from chalicelib.aws.gds_metadata_cache import GdsMetadataCache
+from chalicelib.aws.gds_sqs_client import GdsSqsClient
+
+
+class TestGdsMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = GdsMetadataCache()
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return f"value-{self.loads}"
+
+    def test_get_caches_value(self):
+        self.assertEqual(self.cache.get(("a",), self.loader), "value-1")
+        self.assertEqual(self.cache.get(("a",), self.loader), "value-1")
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_get_expired(self):
+        self.cache.get(("a",), self.loader, ttl=-1)
+        self.assertEqual(self.cache.get(("a",), self.loader), "value-2")
+        self.assertEqual(self.cache.get_stats()["expired"], 1)
+
+    def test_loader_exception_is_not_cached(self):
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            self.cache.get(("a",), fail)
+        self.assertEqual(self.cache.get(("a",), self.loader), "value-1")
+
+    def test_invalidate_prefix(self):
+        self.cache.set(("sqs", "queue_url", "one"), 1)
+        self.cache.set(("sqs", "queue_url", "two"), 2)
+        self.cache.set(("ssm", "chain_role_params"), 3)
+        self.assertEqual(self.cache.invalidate(("sqs",)), 2)
+        self.assertEqual(self.cache.get_stats()["size"], 1)
+        self.assertEqual(self.cache.invalidate(), 1)
+        self.assertEqual(self.cache.get_stats()["size"], 0)
+
+
+class TestGdsClientMetadataCache(TestClientDefault):
+    def setUp(self):
+        os.environ.setdefault("CSW_REGION", "eu-west-2")
+        self.cache = GdsMetadataCache()
+        self.patch = mock.patch.object(GdsAwsClient, "metadata", self.cache)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_chain_role_params_shared_between_clients(self):
+        chain = {"account": "123456789012", "chain_role": "Chain", "target_role": "Target"}
+        with mock.patch.object(
+            GdsAwsClient, "load_chain_role_params", return_value=chain
+        ) as load:
+            self.assertEqual(GdsAwsClient(self.app).get_chain_role_params(), chain)
+            self.assertEqual(GdsAwsClient(self.app).get_chain_role_params(), chain)
+        self.assertEqual(load.call_count, 1)
+
+    def test_queue_url_cached(self):
+        with mock.patch.object(
+            GdsAwsClient, "load_caller_identity", return_value={"Account": "123456789012"}
+        ) as load:
+            client = GdsSqsClient(self.app)
+            first = client.get_queue_url("test-queue")
+            second = GdsSqsClient(self.app).get_queue_url("test-queue")
+            GdsSqsClient(self.app).get_queue_url("other-queue")
+        self.assertEqual(first, second)
+        self.assertIn("/123456789012/test-queue", first)
+        # the caller identity is cached as well as the queue urls
+        self.assertEqual(load.call_count, 1)
+
+    def test_describe_regions_cached(self):
+        regions = [{"RegionName": "eu-west-2"}]
+        with mock.patch.object(GdsEc2Client, "load_regions", return_value=regions) as load:
+            GdsEc2Client(self.app).describe_regions()
+            self.assertEqual(GdsEc2Client(self.app).describe_regions(), regions)
+        self.assertEqual(load.call_count, 1)
@@ -0,0 +1,178 @@
+import threading
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+from chalicelib.aws.gds_rate_limiter import GdsRateLimiter, GdsTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeRaw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class FakeEc2Endpoint:
+    """
+    Stands in for the EC2 endpoint, throttling the first requests
+    """
+
+    throttled_body = (
+        b"<Response><Errors><Error><Code>RequestLimitExceeded</Code>"
+        b"<Message>Request limit exceeded.</Message></Error></Errors>"
+        b"<RequestID>1</RequestID></Response>"
+    )
+    regions_body = (
+        b'<DescribeRegionsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">'
+        b"<requestId>1</requestId><regionInfo><item><regionName>eu-west-2</regionName>"
+        b"<regionEndpoint>ec2.eu-west-2.amazonaws.com</regionEndpoint></item>"
+        b"</regionInfo></DescribeRegionsResponse>"
+    )
+
+    def __init__(self, throttle):
+        self.throttle = throttle
+        self.requests = 0
+
+    def __call__(self, request, **kwargs):
+        self.requests += 1
+        if self.requests <= self.throttle:
+            return AWSResponse(request.url, 503, {}, FakeRaw(self.throttled_body))
+        return AWSResponse(request.url, 200, {}, FakeRaw(self.regions_body))
+
+
+class TestGdsTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = GdsTokenBucket(2, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_acquire_waits_for_tokens(self):
+        waited = [self.bucket.acquire() for call in range(4)]
+        self.assertEqual(waited, [0.0, 0.0, 0.5, 0.5])
+        self.assertEqual(self.clock.now, 1.0)
+
+    def test_throttled_backs_off_and_recovers(self):
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 1)
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 0.5)
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, GdsTokenBucket.min_rate)
+        for call in range(100):
+            self.bucket.succeeded()
+        self.assertEqual(self.bucket.rate, 2)
+
+
+class TestGdsRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = GdsRateLimiter(clock=self.clock, sleep=self.clock.sleep)
+
+    def create_client(self, endpoint, account="123456789012"):
+        client = boto3.client(
+            "ec2",
+            region_name="eu-west-2",
+            aws_access_key_id="key",
+            aws_secret_access_key="secret",
+            aws_session_token="token",
+            config=self.limiter.get_client_config(),
+        )
+        self.limiter.register(client, account)
+        client.meta.events.register("before-send", endpoint)
+        return client
+
+    def test_retries_throttled_calls(self):
+        endpoint = FakeEc2Endpoint(throttle=2)
+        client = self.create_client(endpoint)
+        with mock.patch("botocore.endpoint.time.sleep"):
+            response = client.describe_regions()
+        self.assertEqual(response["Regions"][0]["RegionName"], "eu-west-2")
+        stats = self.limiter.get_stats()["ec2"]
+        self.assertEqual(stats["calls"], 1)
+        self.assertEqual(stats["attempts"], 3)
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["throttles"], 2)
+        bucket = self.limiter.get_bucket("123456789012", "ec2")
+        self.assertLess(bucket.rate, bucket.max_rate)
+        # the bucket for another account is not slowed down
+        other = self.limiter.get_bucket("210987654321", "ec2")
+        self.assertEqual(other.rate, other.max_rate)
+
+    def test_gives_up_after_retry_attempts(self):
+        self.limiter.retry_attempts = 3
+        endpoint = FakeEc2Endpoint(throttle=10)
+        client = self.create_client(endpoint)
+        with mock.patch("botocore.endpoint.time.sleep"):
+            with self.assertRaises(ClientError) as context:
+                client.describe_regions()
+        self.assertEqual(context.exception.response["Error"]["Code"], "RequestLimitExceeded")
+        self.assertEqual(endpoint.requests, 4)
+        self.assertEqual(self.limiter.get_stats()["ec2"]["throttles"], 4)
+
+    def test_throttled_calls_wait_for_tokens(self):
+        endpoint = FakeEc2Endpoint(throttle=1)
+        client = self.create_client(endpoint)
+        with mock.patch("botocore.endpoint.time.sleep"):
+            client.describe_regions()
+            client.describe_regions()
+        # the token bucket emptied by the throttle made the later attempts wait
+        self.assertGreater(self.limiter.get_stats()["ec2"]["wait_seconds"], 0)
+        self.assertGreater(len(self.clock.slept), 0)
+
+    def test_releases_concurrency_slots(self):
+        self.limiter.service_concurrency = {"ec2": 1}
+        client = self.create_client(FakeEc2Endpoint(throttle=1))
+        with mock.patch("botocore.endpoint.time.sleep"):
+            client.describe_regions()
+            client.describe_regions()
+        semaphore = self.limiter.get_semaphore("ec2")
+        self.assertTrue(semaphore.acquire(blocking=False))
+        semaphore.release()
+
+    def test_concurrency_cap(self):
+        self.limiter.service_concurrency = {"ec2": 2}
+        self.limiter.service_rates = {"ec2": 1000}
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def slow_endpoint(request, **kwargs):
+            with lock:
+                in_flight.append(request)
+                peak.append(len(in_flight))
+            release.wait(1)
+            with lock:
+                in_flight.remove(request)
+            return AWSResponse(request.url, 200, {}, FakeRaw(FakeEc2Endpoint.regions_body))
+
+        clients = [self.create_client(slow_endpoint) for index in range(4)]
+        threads = [threading.Thread(target=client.describe_regions) for client in clients]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(self.limiter.get_stats()["ec2"]["calls"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+from tests.chalicelib.aws.test_client_default import TestClientDefault
+from chalicelib.aws.gds_sqs_client import GdsSqsClient
+
+
+class FakeSqs:
+    """
+    Stand in for a boto3 SQS client which fails the listed entry ids
+    the first time they are sent
+    """
+
+    def __init__(self, fail_ids=None, sender_fault_ids=None):
+        self.calls = []
+        self.fail_ids = set(fail_ids or [])
+        self.sender_fault_ids = set(sender_fault_ids or [])
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls.append([entry["Id"] for entry in Entries])
+        response = {"Successful": [], "Failed": []}
+        for entry in Entries:
+            if entry["Id"] in self.sender_fault_ids:
+                response["Failed"].append(
+                    {"Id": entry["Id"], "SenderFault": True, "Code": "InvalidMessageContents"}
+                )
+            elif entry["Id"] in self.fail_ids:
+                self.fail_ids.remove(entry["Id"])
+                response["Failed"].append(
+                    {"Id": entry["Id"], "SenderFault": False, "Code": "InternalError"}
+                )
+            else:
+                response["Successful"].append(
+                    {"Id": entry["Id"], "MessageId": "message-" + entry["Id"]}
+                )
+        return response
+
+
+class TestGdsSqsClient(TestClientDefault):
+    def setUp(self):
+        os.environ.setdefault("CSW_REGION", "eu-west-2")
+        self.client = GdsSqsClient(self.app)
+        self.client.batch_retry_wait = 0
+        self.sqs = FakeSqs()
+        self.client.get_default_client = lambda service_name, region=None: self.sqs
+
+    def test_get_message_batches_max_entries(self):
+        batches = self.client.get_message_batches(["{}"] * 25)
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual(batches[2], [20, 21, 22, 23, 24])
+
+    def test_get_message_batches_max_bytes(self):
+        self.client.batch_max_bytes = 10
+        batches = self.client.get_message_batches(["12345", "12345", "123"])
+        self.assertEqual(batches, [[0, 1], [2]])
+
+    def test_send_message_batch(self):
+        bodies = [str(index) for index in range(23)]
+        message_ids = self.client.send_message_batch("queue", bodies)
+        self.assertEqual(len(self.sqs.calls), 3)
+        self.assertEqual(message_ids[0], "message-0")
+        self.assertEqual(message_ids[22], "message-22")
+
+    def test_send_message_batch_retries_failed_entries(self):
+        self.sqs.fail_ids = {"3", "7"}
+        message_ids = self.client.send_message_batch("queue", ["{}"] * 10)
+        self.assertEqual(self.sqs.calls[1], ["3", "7"])
+        self.assertNotIn(None, message_ids)
+
+    def test_send_message_batch_does_not_retry_sender_faults(self):
+        self.sqs.sender_fault_ids = {"2"}
+        message_ids = self.client.send_message_batch("queue", ["{}"] * 5)
+        self.assertEqual(len(self.sqs.calls), 1)
+        self.assertIsNone(message_ids[2])
+        self.assertEqual(message_ids.count(None), 1)
@@ -0,0 +1,167 @@
+import copy
+import json
+import threading
+import unittest
+from unittest import mock
+
+from app import app
+from chalicelib import models
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClient
+from chalicelib.aws.gds_sqs_client import GdsSqsClient
+from chalicelib.aws.gds_sqs_memory_backend import GdsSqsMemoryBackend
+from tests.chalicelib.criteria.test_data import EGRESS_RESTRICTION, SESSION
+from tests.chalicelib.test_audit import SECURITY_GROUP_CRITERIA, audit
+from tests.chalicelib.test_database_default import TestDatabaseDefault
+
+
+class RecordingHandler:
+    """
+    Stands in for an @app.on_sqs_message handler
+    """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event, context):
+        with self.lock:
+            self.events.append([record["body"] for record in event["Records"]])
+        return {
+            "batchItemFailures": [
+                {"itemIdentifier": record["messageId"]}
+                for record in event["Records"]
+                if record["body"] in self.fail
+            ]
+        }
+
+
+class TestGdsSqsMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = GdsSqsMemoryBackend()
+
+    def test_send_and_deliver_batches(self):
+        handler = RecordingHandler()
+        self.backend.subscribe("queue", handler)
+        queue_url = self.backend.get_queue_url("queue")
+        message_ids = self.backend.send_message_batch(
+            queue_url, [str(index) for index in range(15)]
+        )
+        self.assertEqual(len(set(message_ids)), 15)
+        stats = self.backend.run()
+        self.assertEqual([len(bodies) for bodies in handler.events], [10, 5])
+        self.assertEqual(stats["delivered"], 15)
+        self.assertEqual(stats["invocations"], 2)
+        self.assertEqual(self.backend.get_messages("queue"), [])
+
+    def test_unsubscribed_queues_are_kept(self):
+        self.backend.send_message(self.backend.get_queue_url("completed"), "done")
+        self.backend.run()
+        self.assertEqual(self.backend.get_messages("completed"), ["done"])
+
+    def test_failures_are_redelivered_then_dead_lettered(self):
+        handler = RecordingHandler(fail=["bad"])
+        self.backend.subscribe("queue", handler)
+        self.backend.send_message_batch(self.backend.get_queue_url("queue"), ["good", "bad"])
+        stats = self.backend.run()
+        self.assertEqual(handler.events[0], ["good", "bad"])
+        self.assertEqual(handler.events[1:], [["bad"]] * 4)
+        self.assertEqual(stats["failed"], 5)
+        self.assertEqual(len(self.backend.dead_letters), 1)
+        queue_name, record = self.backend.dead_letters[0]
+        self.assertEqual(record["body"], "bad")
+        self.assertEqual(record["attributes"]["ApproximateReceiveCount"], "5")
+
+    def test_handler_errors_fail_the_batch(self):
+        calls = []
+
+        def handler(event, context):
+            calls.append(len(event["Records"]))
+            if len(calls) == 1:
+                raise Exception("lambda failed")
+            self.assertGreater(context.get_remaining_time_in_millis(), 0)
+
+        self.backend.subscribe("queue", handler)
+        self.backend.send_message_batch(self.backend.get_queue_url("queue"), ["1", "2"])
+        stats = self.backend.run()
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(stats["failed"], 2)
+
+    def test_workers_process_messages_sent_by_handlers(self):
+        next_url = self.backend.get_queue_url("next")
+        first = RecordingHandler()
+        second = RecordingHandler()
+
+        def forward(event, context):
+            for record in event["Records"]:
+                self.backend.send_message(next_url, record["body"])
+            return first(event, context)
+
+        self.backend.subscribe("first", forward)
+        self.backend.subscribe("next", second)
+        self.backend.send_message_batch(
+            self.backend.get_queue_url("first"), [str(index) for index in range(50)]
+        )
+        stats = self.backend.run(workers=4)
+        self.assertEqual(stats["delivered"], 100)
+        self.assertEqual(
+            sorted(body for bodies in second.events for body in bodies),
+            sorted(str(index) for index in range(50)),
+        )
+
+    def test_sqs_client_uses_backend(self):
+        with mock.patch.object(GdsSqsClient, "queue_backend", self.backend):
+            sqs = GdsSqsClient(app)
+            queue_url = sqs.get_queue_url("queue")
+            self.assertEqual(queue_url, "memory://queue")
+            self.assertIsNotNone(sqs.send_message(queue_url, "one"))
+            self.assertEqual(len(sqs.send_message_batch(queue_url, ["two", "three"])), 2)
+        self.assertEqual(self.backend.get_messages("queue"), ["one", "two", "three"])
+
+
+class TestAuditPipeline(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditPipeline, self).setUp()
+        for status in ["Not checked", "Pass", "Fail", "Exception"]:
+            models.Status.create(status_name=status, description=status)
+        for class_name in SECURITY_GROUP_CRITERIA:
+            self.create_criterion(class_name.split(".")[-1], class_name)
+        self.accounts = [
+            self.create_account(100000000000 + index, f"account-{index}") for index in range(2)
+        ]
+        self.backend = GdsSqsMemoryBackend(app)
+        self.backend.subscribe(f"{app.prefix}-audit-account-queue", audit.account_audit_criteria)
+        self.backend.subscribe(
+            f"{app.prefix}-audit-account-metric-queue", audit.account_evaluate_criteria
+        )
+        self.backend.subscribe(f"{app.prefix}-evaluated-metric-queue", audit.audit_evaluated_metric)
+
+    def test_audit_accounts(self):
+        security_groups = EGRESS_RESTRICTION["pass"]["SecurityGroups"]
+        with mock.patch.object(
+            GdsSqsClient, "queue_backend", self.backend
+        ), mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ), mock.patch.object(
+            audit, "get_account_regions", return_value=["eu-west-1", "eu-west-2"]
+        ), mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=lambda session, **params: copy.deepcopy(security_groups),
+        ):
+            audits = models.AccountAudit.create_batch(self.accounts)
+            audit.queue_audits(GdsSqsClient(app), audits)
+            stats = self.backend.run()
+
+        # 2 audits, 1 shared data source message and 3 evaluated metrics each
+        self.assertEqual(stats["delivered"], 2 + 2 + 6)
+        self.assertEqual(stats["failed"], 0)
+        for account_audit in models.AccountAudit.select():
+            self.assertTrue(account_audit.finished)
+            self.assertEqual(account_audit.criteria_processed, 3)
+        completed = self.backend.get_messages(f"{app.prefix}-completed-audit-queue")
+        self.assertEqual(
+            sorted(json.loads(body)["id"] for body in completed),
+            sorted(account_audit.id for account_audit in audits),
+        )
@@ -31,7 +31,7 @@ class TestAwsVpcFlowLogsEnabled(CriteriaSubclassTestCaseMixin, TestCaseWithAttrA
                 self.subclass.client.describe_vpcs = lambda session, region_name: self.test_data[
                     key
                 ]
-                self.subclass.client.describe_flow_logs = lambda session, vpc, region_name: self.test_data_logs[
+                self.subclass.client.load_flow_logs = lambda session, vpc, region_name: self.test_data_logs[
                     key
                 ]
                 item = self.subclass.get_data(None, region=None)
@@ -4,9 +4,13 @@ CriteriaDefault unit tests and Mixin for all its subclasses TestCases
 """
 
 import importlib
+import threading
+import time
 import unittest
 import os
 
+from botocore.exceptions import ClientError
+
 from app import CloudSecurityWatch
 from tests.chalicelib.criteria.test_data import EMPTY_SUMMARY, SESSION
 from chalicelib.criteria.criteria_default import CriteriaDefault
@@ -117,6 +121,74 @@ class TestCriteriaDefault(TestCaseWithAttrAssert):
         """
         self.assertEqual(self.criteria_default.get_data("any_input"), [])
 
+    def test_filter_regions(self):
+        """
+        test that supported_regions restricts the list of enabled regions
+        """
+        regions = ["eu-west-1", "eu-west-2", "us-east-1"]
+        self.assertEqual(self.criteria_default.filter_regions(regions), regions)
+        self.criteria_default.supported_regions = ["us-east-1", "ap-east-1"]
+        self.assertEqual(self.criteria_default.filter_regions(regions), ["us-east-1"])
+
+    def test_collect_data(self):
+        """
+        test that concurrent collection returns results in request order,
+        captures client errors and never exceeds the worker limit
+        """
+        lock = threading.Lock()
+        running = {"now": 0, "max": 0}
+
+        def get_data(session, region):
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            # later regions finish first
+            time.sleep(0.01 * (6 - int(region[-1])))
+            with lock:
+                running["now"] -= 1
+            if region == "region-3":
+                raise ClientError(
+                    {"Error": {"Code": "AccessDenied", "Message": "denied"}},
+                    "DescribeThings",
+                )
+            return [region]
+
+        self.criteria_default.get_data = get_data
+        requests = [{"region": f"region-{index}"} for index in range(1, 6)]
+        for workers in [1, 2]:
+            running["max"] = 0
+            collected = self.criteria_default.collect_data(SESSION, requests, workers)
+            self.assertEqual([params for params, data, error in collected], requests)
+            self.assertEqual(
+                [data for params, data, error in collected],
+                [["region-1"], ["region-2"], None, ["region-4"], ["region-5"]],
+            )
+            self.assertIsInstance(collected[2][2], ClientError)
+            self.assertEqual(running["max"], workers)
+
+    def test_collect_data_deadline(self):
+        """
+        test that requests are not started once the deadline is reached
+        but the first request is always made
+        """
+        calls = []
+
+        def get_data(session, region):
+            calls.append(region)
+            return [region]
+
+        class ReachedAfterFirstCall:
+            def reached(self):
+                return len(calls) > 0
+
+        self.criteria_default.get_data = get_data
+        requests = [{"region": f"region-{index}"} for index in range(1, 4)]
+        collected = self.criteria_default.collect_data(
+            SESSION, requests, 1, deadline=ReachedAfterFirstCall()
+        )
+        self.assertEqual(calls, ["region-1"])
+        self.assertEqual(collected, [({"region": "region-1"}, ["region-1"], None)])
+
     def test_build_evaluation(self):
         """
         black box test of the build_evaluation method
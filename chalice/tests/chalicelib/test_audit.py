@@ -0,0 +1,853 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import app
+from botocore.exceptions import ClientError
+from chalicelib import models
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClient
+from chalicelib.blob_store import LocalBlobStore
+from chalicelib.deadline import Deadline
+from chalicelib.scheduler import AuditScheduler
+from tests.chalicelib.criteria.test_data import EGRESS_RESTRICTION, SESSION
+from tests.chalicelib.test_database_default import TestDatabaseDefault
+
+# the audit lambdas are named after the environment prefix
+os.environ.setdefault("CSW_ENV", "test")
+if not hasattr(app, "prefix"):
+    app.prefix = "csw-test"
+
+from chalicelib import audit  # noqa: E402
+
+
+SECURITY_GROUP_CRITERIA = [
+    "chalicelib.criteria.aws_ec2_security_group_ingress_ssh.AwsEc2SecurityGroupIngressSsh",
+    "chalicelib.criteria.aws_ec2_security_group_ingress_open.AwsEc2SecurityGroupIngressOpen",
+    "chalicelib.criteria.aws_ec2_egress_restriction.UnrestrictedEgressSecurityGroups",
+]
+
+
+class FakeSqs:
+    """
+    Records the messages sent by the audit lambdas
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, queue_url, message_body):
+        self.messages.append(json.loads(message_body))
+        return str(len(self.messages))
+
+
+class TestAuditDataSource(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditDataSource, self).setUp()
+        for status in ["Not checked", "Pass", "Fail", "Exception"]:
+            models.Status.create(status_name=status, description=status)
+        self.account = self.create_account()
+        self.audit = models.AccountAudit.create(account_subscription_id=self.account)
+        self.criteria = [
+            self.create_criterion(class_name.split(".")[-1], class_name)
+            for class_name in SECURITY_GROUP_CRITERIA
+        ]
+        self.criteria.append(
+            self.create_criterion(
+                "AwsSupportRootMfa",
+                "chalicelib.criteria.aws_support_root_mfa.AwsSupportRootMfa",
+            )
+        )
+        self.audit_criteria = models.AuditCriterion.create_batch(self.audit, self.criteria)
+
+    def test_group_by_data_source(self):
+        messages = audit.group_by_data_source(self.audit_criteria)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0]["id"], self.audit_criteria[0].id)
+        self.assertEqual(
+            messages[0]["shared_audit_criterion_ids"],
+            [audit_criterion.id for audit_criterion in self.audit_criteria[1:3]],
+        )
+        self.assertEqual(messages[1]["id"], self.audit_criteria[3].id)
+        self.assertEqual(messages[1]["shared_audit_criterion_ids"], [])
+
+    def test_evaluate_shared_data_source(self):
+        message_data = audit.group_by_data_source(self.audit_criteria[:3])[0]
+        security_groups = EGRESS_RESTRICTION["pass"]["SecurityGroups"]
+        sqs = FakeSqs()
+        with mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ) as get_chained_session, mock.patch.object(
+            audit, "get_account_regions", return_value=["eu-west-1", "eu-west-2"]
+        ), mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=lambda session, **params: copy.deepcopy(security_groups),
+        ) as describe_security_groups:
+            processed = audit.evaluate_audit_criteria(sqs, "queue", message_data)
+
+        self.assertTrue(processed)
+        # one assume and one call per region instead of one per criterion
+        self.assertEqual(get_chained_session.call_count, 1)
+        self.assertEqual(describe_security_groups.call_count, 2)
+        self.assertEqual(
+            [message["id"] for message in sqs.messages],
+            [audit_criterion.id for audit_criterion in self.audit_criteria[:3]],
+        )
+        for audit_criterion in self.audit_criteria[:3]:
+            audit_criterion = models.AuditCriterion.get_by_id(audit_criterion.id)
+            self.assertTrue(audit_criterion.attempted)
+            self.assertTrue(audit_criterion.processed)
+            self.assertEqual(audit_criterion.resources, len(security_groups) * 2)
+            self.assertEqual(
+                models.AuditResource.select()
+                .where(models.AuditResource.criterion_id == audit_criterion.criterion_id)
+                .count(),
+                len(security_groups) * 2,
+            )
+
+
+class FakeMessage:
+    def __init__(self, data, message_id="message-1"):
+        self.body = json.dumps(data, default=str)
+        self.message_id = message_id
+
+    def to_dict(self):
+        return {"messageId": self.message_id, "body": self.body}
+
+
+class TestAuditEvaluatedMetric(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditEvaluatedMetric, self).setUp()
+        self.audit = models.AccountAudit.create(
+            account_subscription_id=self.create_account(), active_criteria=2
+        )
+        criteria = [self.create_criterion(f"criterion {index}") for index in range(2)]
+        self.audit_criteria = models.AuditCriterion.create_batch(self.audit, criteria)
+        self.sent = []
+
+    def evaluated_messages(self):
+        messages = []
+        for audit_criterion, failed in zip(self.audit_criteria, [0, 3]):
+            message_data = audit_criterion.serialize()
+            message_data["failed"] = failed
+            message_data["processed"] = True
+            message_data["check_passed"] = failed == 0
+            messages.append(FakeMessage(message_data, f"message-{audit_criterion.id}"))
+        return messages
+
+    def send_message(self, queue_url, body):
+        self.sent.append(json.loads(body))
+        return f"message-{len(self.sent)}"
+
+    def run_metric(self, messages):
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", return_value="queue"
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message", side_effect=self.send_message
+        ):
+            return audit.audit_evaluated_metric.func(messages)
+
+    def test_counts_and_completes_once(self):
+        messages = self.evaluated_messages()
+        self.assertEqual(self.run_metric(messages[:1]), {"batchItemFailures": []})
+        self.assertEqual(self.sent, [])
+        self.run_metric(messages[1:])
+        completed = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertTrue(completed.finished)
+        self.assertEqual(completed.criteria_passed, 1)
+        self.assertEqual(completed.criteria_failed, 1)
+        self.assertEqual(completed.issues_found, 3)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sent[0]["criteria"]), 2)
+        self.assertEqual(
+            models.AccountLatestAudit.get().account_audit_id.id, self.audit.id
+        )
+
+    def test_claim_check(self):
+        with tempfile.TemporaryDirectory() as path, mock.patch.dict(
+            os.environ, {"CSW_CLAIM_CHECK_PATH": path}
+        ):
+            self.run_metric(self.evaluated_messages())
+            message_data = self.sent[0]
+            self.assertNotIn("criteria", message_data)
+            self.assertEqual(message_data["criteria_count"], 2)
+            self.assertEqual(message_data["issues_found"], 3)
+            payload = json.loads(LocalBlobStore(path).get(message_data["claim_check"]["key"]))
+            self.assertEqual(payload["id"], self.audit.id)
+            self.assertEqual(len(payload["criteria"]), 2)
+
+
+class RedeliveringQueues:
+    """
+    Local stand in for SQS which delivers every message twice
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.sent = 0
+
+    def get_queue_url(self, queue_name):
+        return queue_name
+
+    def send_message(self, queue_url, body):
+        self.queues.setdefault(queue_url, []).append(body)
+        self.sent += 1
+        return str(self.sent)
+
+    def send_message_batch(self, queue_url, bodies):
+        return [self.send_message(queue_url, body) for body in bodies]
+
+    def receive(self, queue_name):
+        bodies = self.queues.pop(f"{app.prefix}-{queue_name}", [])
+        return [
+            FakeMessage(json.loads(body), f"message-{index}-{delivery}")
+            for index, body in enumerate(bodies)
+            for delivery in range(2)
+        ]
+
+
+class LambdaTimeout(BaseException):
+    """
+    Stops a handler part way through like a lambda timing out
+    """
+
+
+class TestAuditRedelivery(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditRedelivery, self).setUp()
+        for status in ["Not checked", "Pass", "Fail", "Exception"]:
+            models.Status.create(status_name=status, description=status)
+        self.audit = models.AccountAudit.create(account_subscription_id=self.create_account())
+        self.queues = RedeliveringQueues()
+        self.security_groups = EGRESS_RESTRICTION["pass"]["SecurityGroups"]
+
+    def run_handlers(self, handler, queue_name):
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=self.queues.get_queue_url
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message", side_effect=self.queues.send_message
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message_batch", side_effect=self.queues.send_message_batch
+        ), mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ), mock.patch.object(
+            audit, "get_account_regions", return_value=["eu-west-1", "eu-west-2"]
+        ):
+            return handler.func(self.queues.receive(queue_name))
+
+    def run_evaluate(self):
+        with mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=lambda session, **params: copy.deepcopy(self.security_groups),
+        ) as describe_security_groups:
+            self.run_handlers(audit.account_evaluate_criteria, "audit-account-metric-queue")
+        return describe_security_groups.call_count
+
+    def test_redelivered_messages(self):
+        for class_name in SECURITY_GROUP_CRITERIA:
+            self.create_criterion(class_name.split(".")[-1], class_name)
+        self.queues.send_message(
+            f"{app.prefix}-audit-account-queue",
+            app.utilities.to_json(self.audit.serialize()),
+        )
+        self.run_handlers(audit.account_audit_criteria, "audit-account-queue")
+        self.assertEqual(models.AuditCriterion.select().count(), 3)
+
+        # the redelivered evaluations do not call AWS again
+        self.assertEqual(self.run_evaluate(), 2)
+        self.assertEqual(
+            models.AuditResource.select().count(), 3 * 2 * len(self.security_groups)
+        )
+        self.assertEqual(
+            models.ResourceCompliance.select().count(), 3 * 2 * len(self.security_groups)
+        )
+
+        self.run_handlers(audit.audit_evaluated_metric, "evaluated-metric-queue")
+        completed = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertTrue(completed.finished)
+        self.assertEqual(completed.criteria_attempted, 3)
+        self.assertEqual(completed.criteria_processed, 3)
+        self.assertEqual(
+            len(self.queues.queues[f"{app.prefix}-completed-audit-queue"]), 1
+        )
+
+    def test_resume_after_timeout(self):
+        criterion = self.create_criterion("ssh", SECURITY_GROUP_CRITERIA[0])
+        audit_criterion = models.AuditCriterion.create_batch(self.audit, [criterion])[0]
+        self.queues.send_message(
+            f"{app.prefix}-audit-account-metric-queue",
+            app.utilities.to_json(audit.group_by_data_source([audit_criterion])[0]),
+        )
+        complete = models.AuditCriterionRegion.complete
+        calls = []
+
+        def complete_then_timeout(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise LambdaTimeout()
+            return complete(*args)
+
+        # the first delivery times out writing the second region
+        # and is redelivered twice
+        self.queues.receive = mock.Mock(
+            side_effect=lambda queue_name: [
+                FakeMessage(json.loads(body))
+                for body in self.queues.queues[f"{app.prefix}-{queue_name}"]
+            ]
+        )
+        with mock.patch.object(
+            models.AuditCriterionRegion, "complete", side_effect=complete_then_timeout
+        ):
+            with self.assertRaises(LambdaTimeout):
+                self.run_evaluate()
+            self.assertEqual(
+                models.AuditResource.select().count(), len(self.security_groups)
+            )
+            # only the region which was not completed is collected again
+            self.assertEqual(self.run_evaluate(), 1)
+            self.assertEqual(self.run_evaluate(), 0)
+
+        self.assertEqual(
+            models.AuditResource.select().count(), 2 * len(self.security_groups)
+        )
+        audit_criterion = models.AuditCriterion.get_by_id(audit_criterion.id)
+        self.assertTrue(audit_criterion.processed)
+        self.assertEqual(audit_criterion.resources, 2 * len(self.security_groups))
+
+    def test_continue_after_deadline(self):
+        criterion = self.create_criterion("ssh", SECURITY_GROUP_CRITERIA[0])
+        audit_criterion = models.AuditCriterion.create_batch(self.audit, [criterion])[0]
+        self.queues.send_message(
+            f"{app.prefix}-audit-account-metric-queue",
+            app.utilities.to_json(audit.group_by_data_source([audit_criterion])[0]),
+        )
+        self.queues.receive = mock.Mock(
+            side_effect=lambda queue_name: [
+                FakeMessage(json.loads(body))
+                for body in self.queues.queues.pop(f"{app.prefix}-{queue_name}", [])
+            ]
+        )
+        # the deadline has passed so each invocation evaluates a single region
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 0
+        with mock.patch.object(audit, "Deadline", return_value=Deadline(context)):
+            self.assertEqual(self.run_evaluate(), 1)
+            audit_criterion = models.AuditCriterion.get_by_id(audit_criterion.id)
+            self.assertFalse(audit_criterion.attempted)
+            self.assertEqual(audit_criterion.resources, len(self.security_groups))
+            self.assertNotIn(f"{app.prefix}-evaluated-metric-queue", self.queues.queues)
+            continuation = json.loads(
+                self.queues.queues[f"{app.prefix}-audit-account-metric-queue"][0]
+            )
+            self.assertEqual(continuation["id"], audit_criterion.id)
+            self.assertEqual(continuation["continuation"], 1)
+
+            # the continuation only collects the pending region
+            self.assertEqual(self.run_evaluate(), 1)
+
+        self.assertNotIn(f"{app.prefix}-audit-account-metric-queue", self.queues.queues)
+        self.assertEqual(
+            len(self.queues.queues[f"{app.prefix}-evaluated-metric-queue"]), 1
+        )
+        audit_criterion = models.AuditCriterion.get_by_id(audit_criterion.id)
+        self.assertTrue(audit_criterion.attempted)
+        self.assertTrue(audit_criterion.processed)
+        self.assertEqual(audit_criterion.resources, 2 * len(self.security_groups))
+        self.assertEqual(
+            models.AuditResource.select().count(), 2 * len(self.security_groups)
+        )
+
+    def test_region_messages(self):
+        for class_name in SECURITY_GROUP_CRITERIA:
+            self.create_criterion(class_name.split(".")[-1], class_name)
+        self.queues.send_message(
+            f"{app.prefix}-audit-account-queue",
+            app.utilities.to_json(self.audit.serialize()),
+        )
+        self.run_handlers(audit.account_audit_criteria, "audit-account-queue")
+        with mock.patch.dict(os.environ, {"CSW_REGION_MESSAGES": "1"}):
+            # the shared data source message is split by region
+            self.assertEqual(self.run_evaluate(), 0)
+            region_messages = [
+                json.loads(body)
+                for body in self.queues.queues[f"{app.prefix}-audit-account-metric-queue"]
+            ]
+            # every delivery of the data source message sends both regions again
+            self.assertEqual(
+                sorted(set(message["region"] for message in region_messages)),
+                ["eu-west-1", "eu-west-2"],
+            )
+            self.assertEqual(len(region_messages[0]["shared_audit_criterion_ids"]), 2)
+            self.assertNotIn(f"{app.prefix}-evaluated-metric-queue", self.queues.queues)
+            # each region is collected once however often it is delivered
+            self.assertEqual(self.run_evaluate(), 2)
+
+        for audit_criterion in models.AuditCriterion.select():
+            self.assertTrue(audit_criterion.attempted)
+            self.assertTrue(audit_criterion.processed)
+            self.assertEqual(audit_criterion.regions_expected, 2)
+            self.assertEqual(audit_criterion.regions, 2)
+            self.assertEqual(audit_criterion.resources, 2 * len(self.security_groups))
+            # only the first region to find every region complete sends the metric
+            self.assertFalse(audit_criterion.mark_attempted())
+
+        self.run_handlers(audit.audit_evaluated_metric, "evaluated-metric-queue")
+        completed = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertTrue(completed.finished)
+        self.assertEqual(completed.criteria_attempted, 3)
+        self.assertEqual(completed.criteria_processed, 3)
+        self.assertEqual(
+            len(self.queues.queues[f"{app.prefix}-completed-audit-queue"]), 1
+        )
+
+    def test_region_message_failure(self):
+        criterion = self.create_criterion("ssh", SECURITY_GROUP_CRITERIA[0])
+        audit_criterion = models.AuditCriterion.create_batch(self.audit, [criterion])[0]
+        audit_criterion.regions_expected = 2
+        audit_criterion.save()
+        sqs = FakeSqs()
+
+        def describe_security_groups(session, **params):
+            if params["region"] == "eu-west-1":
+                raise ClientError(
+                    {"Error": {"Code": "AccessDenied", "Message": "denied"}},
+                    "DescribeSecurityGroups",
+                )
+            return copy.deepcopy(self.security_groups)
+
+        with mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ), mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=describe_security_groups,
+        ):
+            for region in ["eu-west-1", "eu-west-2"]:
+                message_data = audit.group_by_data_source([audit_criterion])[0]
+                message_data["region"] = region
+                audit.evaluate_audit_criteria(sqs, "queue", message_data)
+
+        # the denied region reports in so the criterion still completes
+        self.assertEqual(len(sqs.messages), 1)
+        self.assertTrue(sqs.messages[0]["processed"])
+        audit_criterion = models.AuditCriterion.get_by_id(audit_criterion.id)
+        self.assertTrue(audit_criterion.attempted)
+        self.assertEqual(audit_criterion.regions, 1)
+        self.assertEqual(audit_criterion.resources, len(self.security_groups))
+
+
+class TestAuditBatchFailures(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditBatchFailures, self).setUp()
+        self.audit = models.AccountAudit.create(
+            account_subscription_id=self.create_account(), active_criteria=1
+        )
+        criterion = self.create_criterion("criterion")
+        self.audit_criterion = models.AuditCriterion.create_batch(self.audit, [criterion])[0]
+        self.sent = {}
+        settings = mock.patch.dict(
+            os.environ,
+            {
+                "CSW_SQS_PARTIAL_BATCH": "true",
+                "CSW_AUDIT_DEAD_LETTER_QUEUE": f"{app.prefix}-audit-dead-letter-queue",
+            },
+        )
+        settings.start()
+        self.addCleanup(settings.stop)
+
+    def send_message(self, queue_url, body):
+        self.sent.setdefault(queue_url, []).append(json.loads(body))
+        return "message-id"
+
+    def run_metric(self, messages, **record_evaluated_metric):
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=lambda queue_name: queue_name
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message", side_effect=self.send_message
+        ), mock.patch.object(
+            audit, "record_evaluated_metric", **record_evaluated_metric
+        ) as record:
+            response = audit.audit_evaluated_metric.func(messages)
+        return response, record
+
+    def messages(self):
+        message_data = self.audit_criterion.serialize()
+        message_data["processed"] = True
+        return [FakeMessage(message_data, "first"), FakeMessage(message_data, "second")]
+
+    def test_is_retryable_error(self):
+        throttled = ClientError({"Error": {"Code": "Throttling"}}, "DescribeRegions")
+        server_error = ClientError(
+            {"Error": {"Code": "Unknown"}, "ResponseMetadata": {"HTTPStatusCode": 503}},
+            "DescribeRegions",
+        )
+        denied = ClientError({"Error": {"Code": "AccessDenied"}}, "DescribeRegions")
+        self.assertTrue(audit.is_retryable_error(throttled))
+        self.assertTrue(audit.is_retryable_error(server_error))
+        self.assertTrue(audit.is_retryable_error(audit.RetryableError()))
+        self.assertFalse(audit.is_retryable_error(denied))
+        self.assertFalse(audit.is_retryable_error(KeyError("id")))
+
+    def test_retryable_failure(self):
+        throttled = ClientError({"Error": {"Code": "Throttling"}}, "DescribeRegions")
+        response, record = self.run_metric(
+            self.messages(), side_effect=[throttled, None]
+        )
+        self.assertEqual(record.call_count, 2)
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "first"}]})
+        self.assertEqual(self.sent, {})
+
+    def test_terminal_failure(self):
+        denied = ClientError({"Error": {"Code": "AccessDenied"}}, "DescribeRegions")
+        response, record = self.run_metric(self.messages(), side_effect=[None, denied])
+        self.assertEqual(response, {"batchItemFailures": []})
+        dead_letters = self.sent[f"{app.prefix}-audit-dead-letter-queue"]
+        self.assertEqual(len(dead_letters), 1)
+        self.assertEqual(dead_letters[0]["message_id"], "second")
+        self.assertEqual(dead_letters[0]["queue"], f"{app.prefix}-evaluated-metric-queue")
+        self.assertIn("AccessDenied", dead_letters[0]["error"])
+
+    def test_malformed_message(self):
+        message = FakeMessage({}, "malformed")
+        message.body = "not json"
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=lambda queue_name: queue_name
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message", side_effect=self.send_message
+        ):
+            response = audit.audit_evaluated_metric.func([message] + self.messages()[:1])
+        self.assertEqual(response, {"batchItemFailures": []})
+        self.assertEqual(
+            len(self.sent[f"{app.prefix}-audit-dead-letter-queue"]), 1
+        )
+        # the valid message in the batch is still processed
+        self.assertTrue(models.AccountAudit.get_by_id(self.audit.id).finished)
+
+    def test_completed_audit_send_is_retried(self):
+        completed_queue = f"{app.prefix}-completed-audit-queue"
+        sends = []
+
+        def send_message(queue_url, body):
+            sends.append(queue_url)
+            # the first completed audit message is not accepted
+            if queue_url == completed_queue and sends.count(completed_queue) == 1:
+                return None
+            return self.send_message(queue_url, body)
+
+        message = self.messages()[0]
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=lambda queue_name: queue_name
+        ), mock.patch.object(audit.GdsSqsClient, "send_message", side_effect=send_message):
+            response = audit.audit_evaluated_metric.func([message])
+            self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "first"}]})
+            failed = models.AccountAudit.get_by_id(self.audit.id)
+            self.assertTrue(failed.finished)
+            self.assertFalse(failed.completion_sent)
+
+            # the redelivered result sends the completed audit
+            self.assertEqual(audit.audit_evaluated_metric.func([message]), {"batchItemFailures": []})
+            self.assertEqual(len(self.sent[completed_queue]), 1)
+            self.assertTrue(models.AccountAudit.get_by_id(self.audit.id).completion_sent)
+            self.assertEqual(models.AccountAudit.get_by_id(self.audit.id).criteria_attempted, 1)
+
+            # and later deliveries do not send it again
+            audit.audit_evaluated_metric.func([message])
+        self.assertEqual(len(self.sent[completed_queue]), 1)
+
+    def test_batch_retried_without_partial_batch_mode(self):
+        throttled = ClientError({"Error": {"Code": "Throttling"}}, "DescribeRegions")
+        with mock.patch.dict(os.environ, {"CSW_SQS_PARTIAL_BATCH": ""}):
+            with self.assertRaisesRegex(audit.RetryableError, "1 of 2 messages"):
+                self.run_metric(self.messages(), side_effect=[throttled, None])
+            response, record = self.run_metric(self.messages(), side_effect=[None, None])
+        self.assertEqual(response, {"batchItemFailures": []})
+
+    def test_terminal_failure_without_dead_letter_queue(self):
+        denied = ClientError({"Error": {"Code": "AccessDenied"}}, "DescribeRegions")
+        with mock.patch.dict(
+            os.environ, {"CSW_SQS_PARTIAL_BATCH": "", "CSW_AUDIT_DEAD_LETTER_QUEUE": ""}
+        ):
+            response, record = self.run_metric(self.messages(), side_effect=[None, denied])
+        # the message is logged and dropped rather than retried forever
+        self.assertEqual(response, {"batchItemFailures": []})
+        self.assertEqual(self.sent, {})
+
+    def test_dead_letter_failure_is_retried(self):
+        with mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=lambda queue_name: queue_name
+        ), mock.patch.object(audit.GdsSqsClient, "send_message", return_value=None):
+            response = audit.audit_evaluated_metric.func([FakeMessage({}, "missing")])
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "missing"}]})
+
+
+class TestScheduledAudits(TestDatabaseDefault):
+    def setUp(self):
+        super(TestScheduledAudits, self).setUp()
+        self.now = datetime(2020, 1, 1, 12, 0)
+        self.account = self.create_account()
+        self.criteria = [
+            self.create_criterion("frequent", severity=1),
+            self.create_criterion("daily", severity=3),
+        ]
+        # the last full audit was 7 hours ago
+        self.full_audit = models.AccountAudit.create(
+            account_subscription_id=self.account,
+            date_started=self.now - timedelta(hours=7),
+            active_criteria=2,
+            criteria_processed=2,
+            finished=True,
+        )
+        # the frequent criterion failed and the daily criterion passed
+        for criterion, failed in zip(self.criteria, [2, 0]):
+            models.AuditCriterion.create(
+                account_audit_id=self.full_audit,
+                criterion_id=criterion,
+                attempted=True,
+                processed=True,
+                failed=failed,
+            )
+        models.AccountLatestAudit.create(
+            account_subscription_id=self.account, account_audit_id=self.full_audit
+        )
+        self.queues = RedeliveringQueues()
+
+    def test_partial_audit(self):
+        with mock.patch.dict(
+            os.environ, {"CSW_AUDIT_SEVERITY_INTERVALS": "1:6"}
+        ), mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=self.queues.get_queue_url
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message", side_effect=self.queues.send_message
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message_batch", side_effect=self.queues.send_message_batch
+        ):
+            self.assertTrue(audit.execute_scheduled_audits(self.now))
+            response = audit.account_audit_criteria.func(
+                self.queues.receive("audit-account-queue")
+            )
+            self.assertEqual(response, {"batchItemFailures": []})
+            partial_audit = models.AccountAudit.get(models.AccountAudit.partial == True)
+            audit_criteria = list(partial_audit.audit_criteria)
+            # only the 6 hourly criterion was due
+            self.assertEqual(partial_audit.active_criteria, 1)
+            self.assertEqual(
+                [audit_criterion.criterion_id.id for audit_criterion in audit_criteria],
+                [self.criteria[0].id],
+            )
+
+            # the frequent criterion passes this time
+            audit_criteria[0].processed = True
+            audit_criteria[0].passed = 1
+            audit_criteria[0].mark_attempted()
+            message_data = audit_criteria[0].serialize()
+            audit.audit_evaluated_metric.func([FakeMessage(message_data)])
+
+        self.assertTrue(models.AccountAudit.get_by_id(partial_audit.id).finished)
+        self.assertEqual(len(self.queues.queues[f"{app.prefix}-completed-audit-queue"]), 1)
+        # the partial audit takes the daily result and becomes the latest audit
+        latest = self.account.get_latest_audit()
+        self.assertEqual(latest.id, partial_audit.id)
+        self.assertEqual(latest.active_criteria, 2)
+        self.assertEqual(latest.criteria_passed, 2)
+        self.assertEqual(latest.criteria_failed, 0)
+        stats = latest.get_stats(max_severity=3)
+        self.assertEqual(
+            [(criterion["criterion_id"]["id"], criterion["failed"]) for criterion in stats["criteria"]],
+            [(self.criteria[0].id, 0), (self.criteria[1].id, 0)],
+        )
+        # the copied result is not a run so the daily criterion is not due
+        scheduler = AuditScheduler(app, self.now)
+        self.assertEqual(
+            scheduler.get_last_runs(24)[(self.account.id, self.criteria[1].id)],
+            self.full_audit.date_started,
+        )
+
+    def test_carry_forward_criteria(self):
+        for status in ["Not checked", "Pass", "Fail"]:
+            models.Status.create(status_name=status, description=status)
+        daily = models.AuditCriterion.get(models.AuditCriterion.criterion_id == self.criteria[1])
+        writer = models.AuditResourceWriter()
+        writer.add(
+            {
+                "account_audit_id": self.full_audit.id,
+                "criterion_id": self.criteria[1].id,
+                "resource_id": "bucket",
+                "resource_persistent_id": "bucket",
+                "resource_data": '{"Name": "bucket"}',
+            },
+            {
+                "resource_type": "AWS::S3::Bucket",
+                "resource_id": "bucket",
+                "compliance_type": "NON_COMPLIANT",
+                "status_id": 3,
+            },
+        )
+        original = writer.flush()[0]
+        partial_audit = models.AccountAudit.create(account_subscription_id=self.account, partial=True)
+        models.AuditCriterion.create_batch(partial_audit, self.criteria[:1])
+
+        self.assertEqual(partial_audit.carry_forward_criteria(self.full_audit), 1)
+        # copied once
+        self.assertEqual(partial_audit.carry_forward_criteria(self.full_audit), 0)
+        carried = models.AuditCriterion.get(
+            models.AuditCriterion.account_audit_id == partial_audit,
+            models.AuditCriterion.criterion_id == self.criteria[1],
+        )
+        self.assertEqual(carried.carried_from_id, daily.id)
+        issues = partial_audit.get_issues_list()
+        self.assertEqual(len(issues), 1)
+        self.assertEqual(issues[0]["resource"]["carried_from_id"], original.id)
+        resource = models.AuditResource.get_by_id(issues[0]["resource"]["id"])
+        self.assertEqual(resource.get_resource_data(), '{"Name": "bucket"}')
+
+    def test_queued_audit_is_not_scheduled_again(self):
+        with mock.patch.dict(
+            os.environ, {"CSW_AUDIT_SEVERITY_INTERVALS": "1:6"}
+        ), mock.patch.object(
+            audit.GdsSqsClient, "get_queue_url", side_effect=self.queues.get_queue_url
+        ), mock.patch.object(
+            audit.GdsSqsClient, "send_message_batch", side_effect=self.queues.send_message_batch
+        ):
+            self.assertTrue(audit.execute_scheduled_audits(self.now))
+            # the next slot runs before the audit has been taken off the queue
+            self.assertTrue(audit.execute_scheduled_audits(self.now + timedelta(minutes=15)))
+        self.assertEqual(len(self.queues.queues[f"{app.prefix}-audit-account-queue"]), 1)
+        partial_audit = models.AccountAudit.get(models.AccountAudit.partial == True)
+        self.assertEqual(
+            [audit_criterion.criterion_id.id for audit_criterion in partial_audit.audit_criteria],
+            [self.criteria[0].id],
+        )
+
+
+class TestDeltaAudit(TestDatabaseDefault):
+    def setUp(self):
+        super(TestDeltaAudit, self).setUp()
+        for status in ["Not checked", "Pass", "Fail", "Exception"]:
+            models.Status.create(status_name=status, description=status)
+        self.account = self.create_account()
+        self.criterion = self.create_criterion("egress", SECURITY_GROUP_CRITERIA[2])
+        self.security_groups = copy.deepcopy(EGRESS_RESTRICTION["pass"]["SecurityGroups"])
+
+    def run_audit(self, evaluate=None):
+        if evaluate is None:
+            evaluate = audit.app.utilities.get_class_by_name(SECURITY_GROUP_CRITERIA[2]).evaluate
+        audit_record = models.AccountAudit.create(account_subscription_id=self.account)
+        audit_criterion = models.AuditCriterion.create_batch(audit_record, [self.criterion])[0]
+        message_data = audit.group_by_data_source([audit_criterion])[0]
+        with mock.patch.dict(
+            os.environ, {"CSW_DELTA_AUDITS": "true"}
+        ), mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ), mock.patch.object(
+            audit, "get_account_regions", return_value=["eu-west-2"]
+        ), mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=lambda session, **params: copy.deepcopy(self.security_groups),
+        ), mock.patch(
+            f"{SECURITY_GROUP_CRITERIA[2]}.evaluate",
+            autospec=True,
+            side_effect=evaluate,
+        ) as evaluate:
+            self.assertTrue(audit.evaluate_audit_criteria(FakeSqs(), "queue", message_data))
+        return audit_record, evaluate.call_count
+
+    def get_resources(self, audit_record):
+        return list(
+            models.AuditResource.select()
+            .where(models.AuditResource.account_audit_id == audit_record.id)
+            .order_by(models.AuditResource.id)
+        )
+
+    def test_carry_forward(self):
+        first, evaluated = self.run_audit()
+        self.assertEqual(evaluated, len(self.security_groups))
+        self.security_groups[0]["Description"] = "changed"
+        second, evaluated = self.run_audit()
+        # only the changed security group is evaluated again
+        self.assertEqual(evaluated, 1)
+
+        first_resources = self.get_resources(first)
+        second_resources = self.get_resources(second)
+        self.assertEqual(len(second_resources), len(self.security_groups))
+        changed = second_resources[0]
+        self.assertIsNone(changed.carried_from_id)
+        self.assertIn("changed", changed.get_resource_data())
+        for carried, original in zip(second_resources[1:], first_resources[1:]):
+            # no copy of the data is stored
+            self.assertEqual(
+                models.AuditResourceData.select()
+                .where(models.AuditResourceData.audit_resource_id == carried.id)
+                .count(),
+                0,
+            )
+            self.assertEqual(carried.carried_from_id, original.id)
+            self.assertEqual(
+                carried.serialize(include_data=True)["resource_data"],
+                original.get_resource_data(),
+            )
+
+        # every audit still has a compliance record for every resource
+        for audit_record in [first, second]:
+            self.assertEqual(
+                models.ResourceCompliance.select()
+                .join(models.AuditResource)
+                .where(models.AuditResource.account_audit_id == audit_record.id)
+                .count(),
+                len(self.security_groups),
+            )
+
+        # the third audit references the record holding the data
+        third, evaluated = self.run_audit()
+        self.assertEqual(evaluated, 0)
+        self.assertEqual(
+            [resource.carried_from_id for resource in self.get_resources(third)],
+            [second_resources[0].id] + [resource.id for resource in first_resources[1:]],
+        )
+
+    def test_hash_before_evaluate(self):
+        check_evaluate = audit.app.utilities.get_class_by_name(SECURITY_GROUP_CRITERIA[2]).evaluate
+
+        def evaluate(check, event, item, whitelist=[]):
+            compliance = check_evaluate(check, event, item, whitelist)
+            item["evaluated"] = True
+            return compliance
+
+        first, evaluated = self.run_audit(evaluate)
+        second, evaluated = self.run_audit(evaluate)
+        # the data added by the first evaluation does not change the hash
+        self.assertEqual(evaluated, 0)
+        self.assertEqual(
+            [resource.data_hash for resource in self.get_resources(second)],
+            [resource.data_hash for resource in self.get_resources(first)],
+        )
+
+    def test_criterion_version(self):
+        self.run_audit()
+        check_class = audit.app.utilities.get_class_by_name(SECURITY_GROUP_CRITERIA[2])
+        with mock.patch.object(check_class, "version", check_class.version + 1):
+            second, evaluated = self.run_audit()
+        self.assertEqual(evaluated, len(self.security_groups))
+        self.assertTrue(
+            all(resource.carried_from_id is None for resource in self.get_resources(second))
+        )
+
+
+class TestPrewarmServices(unittest.TestCase):
+    def test_get_lambda_services(self):
+        self.assertEqual(audit.get_lambda_services("csw-dev-audit_account"), ["sqs"])
+        self.assertIn("support", audit.get_lambda_services("csw-dev-account_evaluate_criteria"))
+        self.assertEqual(audit.get_lambda_services("csw-dev-unknown"), [])
+
+    def test_prewarm_lambda_services(self):
+        with mock.patch.dict(
+            os.environ, {"AWS_LAMBDA_FUNCTION_NAME": "csw-dev-account_audit_criteria"}
+        ), mock.patch.object(GdsAwsClient.boto_session, "prewarm", return_value={}) as prewarm:
+            audit.prewarm_lambda_services()
+        prewarm.assert_called_once_with(["sqs", "ssm", "sts", "ec2"])
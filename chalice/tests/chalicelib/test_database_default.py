@@ -0,0 +1,123 @@
+"""
+TestDatabaseDefault subclass of TestCase which rebinds the peewee models
+to an in-memory SQLite database so that model methods can be unit tested
+without a connection to the RDS Postgres instance.
+"""
+import unittest
+
+import peewee
+
+from chalicelib.database_handle import DatabaseHandle
+
+
+class SharedSqliteDatabase(peewee.SqliteDatabase):
+    """
+    SQLite database file shared by threads.
+    Transactions take the write lock when they begin so that two
+    transactions which read before writing wait for each other
+    instead of failing with "database is locked".
+    """
+
+    def begin(self, lock_type="IMMEDIATE"):
+        return super(SharedSqliteDatabase, self).begin(lock_type)
+
+
+def bind_test_database(path=":memory:"):
+    """
+    Bind every model in chalicelib.models to a new SQLite database,
+    in memory unless a file path is given.
+    SQLite has no schemas so the "public" schema is removed for the duration
+    of the binding.
+    Each thread gets its own connection so a file path is needed
+    for models used from more than one thread.
+    Returns the database and the original bindings so they can be restored.
+    """
+    models = list(DatabaseHandle().get_models().values())
+    original = [(model, model._meta.database, model._meta.schema) for model in models]
+    if path == ":memory:":
+        database = peewee.SqliteDatabase(path)
+    else:
+        database = SharedSqliteDatabase(path, pragmas={"journal_mode": "wal"}, timeout=30)
+    for model in models:
+        model._meta.schema = None
+    database.bind(models, bind_refs=False, bind_backrefs=False)
+    database.connect()
+    database.create_tables(models)
+    return database, original
+
+
+def unbind_test_database(database, original):
+    """
+    Restore the model bindings replaced by bind_test_database
+    """
+    database.close()
+    for model, model_database, schema in original:
+        model._meta.schema = schema
+        model.bind(model_database, bind_refs=False, bind_backrefs=False)
+
+
+class TestDatabaseDefault(unittest.TestCase):
+    """
+    Unit tests base class for model methods which read or write records
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        initialise the the Chalice app object and bind the test database
+        """
+        from app import app
+
+        cls.app = app
+        cls.database, cls.original_bindings = bind_test_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        unbind_test_database(cls.database, cls.original_bindings)
+
+    def setUp(self):
+        """
+        Start each test with empty tables
+        """
+        models = list(DatabaseHandle().get_models().values())
+        self.database.drop_tables(models)
+        self.database.create_tables(models)
+
+    def create_account(self, account_id=123456789012, name="test-account"):
+        """
+        Create an active account subscription belonging to a new team
+        """
+        from chalicelib import models
+
+        team = models.ProductTeam.create(team_name=f"{name}-team", active=True)
+        return models.AccountSubscription.create(
+            account_id=account_id,
+            account_name=name,
+            product_team_id=team,
+            active=True,
+            auditable=True,
+            suspended=False,
+        )
+
+    def create_criterion(self, name="test criterion", class_name="", severity=1):
+        """
+        Create an active criterion record
+        """
+        from chalicelib import models
+
+        provider, created = models.CriteriaProvider.get_or_create(
+            provider_name="AWS"
+        )
+        return models.Criterion.create(
+            criterion_name=name,
+            criteria_provider_id=provider,
+            invoke_class_name=class_name,
+            invoke_class_get_data_method="",
+            title=name,
+            description="",
+            why_is_it_important="",
+            how_do_i_fix_it="",
+            active=True,
+            is_regional=True,
+            severity=severity,
+        )
@@ -0,0 +1,334 @@
+import datetime
+
+from tests.chalicelib.test_database_default import TestDatabaseDefault
+from chalicelib import models
+
+
+class TestAccountAuditCreateBatch(TestDatabaseDefault):
+    def test_create_batch(self):
+        accounts = [
+            self.create_account(100000000000 + index, f"account-{index}")
+            for index in range(3)
+        ]
+        audits = models.AccountAudit.create_batch(accounts)
+        self.assertEqual(len(audits), 3)
+        for audit, account in zip(audits, accounts):
+            self.assertIsNotNone(audit.id)
+            self.assertEqual(audit.account_subscription_id.id, account.id)
+            self.assertEqual(audit.serialize()["account_subscription_id"]["id"], account.id)
+        self.assertEqual(models.AccountAudit.select().count(), 3)
+
+    def test_create_batch_empty(self):
+        self.assertEqual(models.AccountAudit.create_batch([]), [])
+
+
+class TestAuditCriterionCreateBatch(TestDatabaseDefault):
+    def test_create_batch(self):
+        audit = models.AccountAudit.create(account_subscription_id=self.create_account())
+        criteria = [self.create_criterion(f"criterion {index}") for index in range(4)]
+        audit_criteria = models.AuditCriterion.create_batch(audit, criteria)
+        self.assertEqual(
+            [item.criterion_id.id for item in audit_criteria],
+            [criterion.id for criterion in criteria],
+        )
+        self.assertEqual(
+            models.AuditCriterion.select()
+            .where(models.AuditCriterion.account_audit_id == audit)
+            .count(),
+            4,
+        )
+
+    def test_create_batch_existing(self):
+        audit = models.AccountAudit.create(account_subscription_id=self.create_account())
+        criteria = [self.create_criterion(f"criterion {index}") for index in range(3)]
+        first = models.AuditCriterion.create_batch(audit, criteria[:2])
+        first[0].attempted = True
+        first[0].save()
+        again = models.AuditCriterion.create_batch(audit, criteria)
+        self.assertEqual([item.id for item in again[:2]], [item.id for item in first])
+        self.assertTrue(again[0].attempted)
+        self.assertEqual(models.AuditCriterion.select().count(), 3)
+
+
+class TestAccountRegion(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAccountRegion, self).setUp()
+        self.account = self.create_account()
+        self.loads = 0
+
+    def load_regions(self):
+        self.loads += 1
+        return ["eu-west-2", "eu-west-1", "us-east-1"]
+
+    def test_get_enabled_regions_stored_between_calls(self):
+        regions = models.AccountRegion.get_enabled_regions(self.account.id, self.load_regions)
+        self.assertEqual(regions, ["eu-west-1", "eu-west-2", "us-east-1"])
+        models.AccountRegion.get_enabled_regions(self.account.id, self.load_regions)
+        self.assertEqual(self.loads, 1)
+
+    def test_get_enabled_regions_refreshed_when_old(self):
+        models.AccountRegion.replace_regions(
+            self.account.id,
+            ["ap-east-1"],
+            datetime.datetime.now() - models.AccountRegion.max_age * 2,
+        )
+        regions = models.AccountRegion.get_enabled_regions(self.account.id, self.load_regions)
+        self.assertNotIn("ap-east-1", regions)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(models.AccountRegion.select().count(), 3)
+
+
+class TestAccountCriterionRegion(TestDatabaseDefault):
+    def test_get_skippable_regions(self):
+        account = self.create_account()
+        criterion = self.create_criterion()
+        models.AccountCriterionRegion.record_resources(
+            account.id, criterion.id, {"eu-west-1": 0, "eu-west-2": 4, "us-east-1": 0}
+        )
+        skippable = models.AccountCriterionRegion.get_skippable_regions(account.id, criterion.id)
+        self.assertEqual(skippable, {"eu-west-1", "us-east-1"})
+
+        # resources found in a previously empty region
+        models.AccountCriterionRegion.record_resources(account.id, criterion.id, {"us-east-1": 2})
+        skippable = models.AccountCriterionRegion.get_skippable_regions(account.id, criterion.id)
+        self.assertEqual(skippable, {"eu-west-1"})
+        self.assertEqual(models.AccountCriterionRegion.select().count(), 3)
+
+    def test_empty_regions_checked_again_after_interval(self):
+        account = self.create_account()
+        criterion = self.create_criterion()
+        models.AccountCriterionRegion.record_resources(account.id, criterion.id, {"eu-west-1": 0})
+        models.AccountCriterionRegion.update(
+            date_checked=datetime.datetime.now()
+            - models.AccountCriterionRegion.empty_region_interval * 2
+        ).execute()
+        skippable = models.AccountCriterionRegion.get_skippable_regions(account.id, criterion.id)
+        self.assertEqual(skippable, set())
+
+
+class TestAuditResourceWriter(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditResourceWriter, self).setUp()
+        self.audit = models.AccountAudit.create(account_subscription_id=self.create_account())
+        self.criterion = self.create_criterion()
+        for status in ["Not checked", "Pass", "Fail"]:
+            models.Status.create(status_name=status, description=status)
+
+    def build_item(self, index):
+        resource_item = {
+            "account_audit_id": self.audit,
+            "criterion_id": self.criterion,
+            "resource_id": f"resource-{index}",
+            "resource_data": "{}",
+            "resource_persistent_id": f"persistent-{index}",
+        }
+        if index % 2:
+            resource_item["region"] = "eu-west-2"
+        compliance = {
+            "resource_type": "AWS::EC2::SecurityGroup",
+            "resource_id": f"resource-{index}",
+            "compliance_type": "COMPLIANT",
+            "is_compliant": True,
+            "status_id": 2,
+        }
+        return resource_item, compliance
+
+    def test_add_and_flush(self):
+        writer = models.AuditResourceWriter(chunk_size=3)
+        items = [self.build_item(index) for index in range(7)]
+        written = []
+        for resource_item, compliance in items:
+            written.extend(writer.add(resource_item, compliance))
+        self.assertEqual(len(written), 6)
+        self.assertEqual(len(writer.pending), 1)
+        written.extend(writer.flush())
+        self.assertEqual(writer.written, 7)
+        self.assertEqual(writer.flush(), [])
+
+        self.assertEqual(models.AuditResource.select().count(), 7)
+        self.assertEqual(models.ResourceCompliance.select().count(), 7)
+        for audit_resource, (resource_item, compliance) in zip(written, items):
+            self.assertEqual(audit_resource.resource_id, resource_item["resource_id"])
+            self.assertEqual(compliance["audit_resource_id"].id, audit_resource.id)
+            stored = models.ResourceCompliance.get(
+                models.ResourceCompliance.audit_resource_id == audit_resource.id
+            )
+            self.assertEqual(stored.resource_id, resource_item["resource_id"])
+            self.assertTrue(stored.is_applicable)
+            self.assertIsNotNone(models.AuditResource.get_by_id(audit_resource.id).date_evaluated)
+
+    def test_compressed_resource_data(self):
+        writer = models.AuditResourceWriter()
+        resource_item, compliance = self.build_item(0)
+        resource_item["resource_data"] = '{"GroupId": "sg-1", "IpPermissions": []}'
+        writer.add(resource_item, compliance)
+        audit_resource = writer.flush()[0]
+
+        stored = models.AuditResource.get_by_id(audit_resource.id)
+        self.assertIsNone(stored.resource_data)
+        self.assertNotIn("resource_data", stored.serialize())
+        self.assertEqual(
+            stored.serialize(include_data=True)["resource_data"], resource_item["resource_data"]
+        )
+        data = models.AuditResourceData.get_by_id(audit_resource.id).data
+        self.assertEqual(
+            models.AuditResourceData.decompress(data), resource_item["resource_data"]
+        )
+
+        models.AuditResource.delete_evaluated(self.audit.id, self.criterion.id)
+        self.assertEqual(models.AuditResourceData.select().count(), 0)
+
+    def test_convert_batch(self):
+        legacy = []
+        for index in range(5):
+            resource_item, compliance = self.build_item(index)
+            resource_item["resource_data"] = f'{{"index": {index}}}'
+            legacy.append(models.AuditResource.create(**resource_item))
+        self.assertEqual(legacy[0].get_resource_data(), '{"index": 0}')
+
+        self.assertEqual(models.AuditResourceData.convert_batch(2), 2)
+        self.assertEqual(models.AuditResourceData.convert_batch(2), 2)
+        self.assertEqual(models.AuditResourceData.convert_batch(2), 1)
+        self.assertEqual(models.AuditResourceData.convert_batch(2), 0)
+        for index, audit_resource in enumerate(legacy):
+            converted = models.AuditResource.get_by_id(audit_resource.id)
+            self.assertIsNone(converted.resource_data)
+            self.assertEqual(converted.get_resource_data(), f'{{"index": {index}}}')
+
+    def test_select_summary(self):
+        resource_item, compliance = self.build_item(0)
+        audit_resource = models.AuditResource.create(**resource_item)
+        summary = models.AuditResource.get_summary_by_id(audit_resource.id)
+        self.assertEqual(summary.resource_id, resource_item["resource_id"])
+        self.assertIsNone(summary.resource_data)
+
+    def test_serialize_carried_forward(self):
+        resource_item, compliance = self.build_item(0)
+        original = models.AuditResource.create(**resource_item)
+        resource_item["resource_data"] = None
+        carried = models.AuditResource.create(carried_from_id=original.id, **resource_item)
+        compliance["audit_resource_id"] = carried
+        models.ResourceCompliance.create(**compliance)
+        models.ResourceRiskAssessment.create(
+            criterion_id=self.criterion,
+            audit_resource_id=carried,
+            account_audit_id=self.audit,
+            resource_id=resource_item["resource_id"],
+            date_first_identifed=datetime.date.today(),
+        )
+
+        stored = (
+            models.ResourceCompliance.select()
+            .join(models.AuditResource)
+            .where(models.AuditResource.id == carried.id)
+        ).get()
+        data = stored.serialize()
+        self.assertEqual(data["audit_resource_id"]["id"], carried.id)
+        self.assertEqual(data["audit_resource_id"]["carried_from_id"], original.id)
+        self.assertEqual(models.AuditResource.get_by_id(carried.id).get_resource_data(), "{}")
+        assessment = models.ResourceRiskAssessment.get().serialize()
+        self.assertEqual(assessment["audit_resource_id"]["carried_from_id"], original.id)
+
+
+class TestExceptionIndex(TestDatabaseDefault):
+    def setUp(self):
+        super(TestExceptionIndex, self).setUp()
+        self.account = self.create_account()
+        self.other_account = self.create_account(210987654321, "other-account")
+        self.criterion = self.create_criterion()
+        self.other_criterion = self.create_criterion("other criterion")
+        self.user = models.User.create(email="test@example.com", name="Test", active=True)
+        now = datetime.datetime.now()
+        self.active = now + datetime.timedelta(days=1)
+        self.expired = now - datetime.timedelta(days=1)
+
+    def create_exception(self, persistent_id, criterion, account, date_expires):
+        return models.ResourceException.create(
+            resource_persistent_id=persistent_id,
+            criterion_id=criterion,
+            account_subscription_id=account,
+            user_id=self.user,
+            reason=persistent_id,
+            date_created=datetime.datetime.now() - datetime.timedelta(days=2),
+            date_expires=date_expires,
+        )
+
+    def test_get_exception(self):
+        self.create_exception("active", self.criterion, self.account, self.active)
+        self.create_exception("expired", self.criterion, self.account, self.expired)
+        self.create_exception("other-criterion", self.other_criterion, self.account, self.active)
+        self.create_exception("other-account", self.criterion, self.other_account, self.active)
+        index = models.ExceptionIndex(self.criterion.id, self.account.id)
+        self.assertEqual(index.get_exception("active").reason, "active")
+        for persistent_id in ["expired", "other-criterion", "other-account", "missing"]:
+            self.assertIsNone(index.get_exception(persistent_id))
+
+    def test_fixed_number_of_queries(self):
+        for index in range(20):
+            self.create_exception(f"resource-{index}", self.criterion, self.account, self.active)
+        for cidr, date_expires in [("1.2.3.4/32", self.active), ("5.6.7.8/32", self.expired)]:
+            models.AccountSshCidrAllowlist.create(
+                cidr=cidr,
+                reason="test",
+                account_subscription_id=self.account,
+                user_id=self.user,
+                date_expires=date_expires,
+            )
+        execute_sql = self.database.execute_sql
+        queries = []
+
+        def count_queries(sql, params=None, commit=True):
+            queries.append(sql)
+            return execute_sql(sql, params, commit)
+
+        self.database.execute_sql = count_queries
+        try:
+            index = models.ExceptionIndex(self.criterion.id, self.account.id)
+            for resource in range(40):
+                index.get_exception(f"resource-{resource}")
+                self.assertEqual(index.get_allowed_cidrs(), ["1.2.3.4/32"])
+        finally:
+            del self.database.execute_sql
+        self.assertEqual(len(queries), 2)
+
+
+class TestAccountAuditCounters(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAccountAuditCounters, self).setUp()
+        self.audit = models.AccountAudit.create(
+            account_subscription_id=self.create_account(), active_criteria=3
+        )
+
+    def test_record_criterion_result(self):
+        models.AccountAudit.record_criterion_result(self.audit.id, True, 0)
+        models.AccountAudit.record_criterion_result(self.audit.id, True, 4)
+        models.AccountAudit.record_criterion_result(self.audit.id, False, 0)
+        audit = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertEqual(audit.criteria_attempted, 3)
+        self.assertEqual(audit.criteria_processed, 2)
+        self.assertEqual(audit.criteria_passed, 1)
+        self.assertEqual(audit.criteria_failed, 1)
+        self.assertEqual(audit.issues_found, 4)
+
+    def test_record_criterion_result_once(self):
+        audit_criterion = models.AuditCriterion.create(
+            account_audit_id=self.audit, criterion_id=self.create_criterion()
+        )
+        for delivery in range(2):
+            models.AccountAudit.record_criterion_result(
+                self.audit.id, True, 2, audit_criterion.id
+            )
+        audit = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertEqual(audit.criteria_attempted, 1)
+        self.assertEqual(audit.issues_found, 2)
+
+    def test_mark_finished_once(self):
+        models.AccountAudit.record_criterion_result(self.audit.id, True, 0)
+        self.assertFalse(models.AccountAudit.mark_finished(self.audit.id))
+        models.AccountAudit.record_criterion_result(self.audit.id, True, 0)
+        models.AccountAudit.record_criterion_result(self.audit.id, True, 0)
+        self.assertTrue(models.AccountAudit.mark_finished(self.audit.id))
+        self.assertFalse(models.AccountAudit.mark_finished(self.audit.id))
+        audit = models.AccountAudit.get_by_id(self.audit.id)
+        self.assertTrue(audit.finished)
+        self.assertIsNotNone(audit.date_completed)
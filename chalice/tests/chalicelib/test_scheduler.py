@@ -0,0 +1,129 @@
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+from chalicelib import models
+from chalicelib.scheduler import AuditScheduler
+from tests.chalicelib.test_database_default import TestDatabaseDefault
+
+
+class TestAuditScheduler(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditScheduler, self).setUp()
+        self.now = datetime(2020, 1, 1, 12, 0)
+        self.accounts = [
+            self.create_account(100000000000 + index, f"account-{index}")
+            for index in range(8)
+        ]
+        self.daily = self.create_criterion("daily", severity=3)
+        self.frequent = self.create_criterion("frequent", severity=1)
+        self.criteria = [self.daily, self.frequent]
+
+    def create_audit(self, account, hours_ago, criteria, attempted=True, processed=True):
+        audit = models.AccountAudit.create(
+            account_subscription_id=account,
+            date_started=self.now - timedelta(hours=hours_ago),
+            active_criteria=len(criteria),
+            criteria_processed=len(criteria) if processed else 0,
+            finished=attempted,
+        )
+        for criterion in criteria:
+            models.AuditCriterion.create(
+                account_audit_id=audit, criterion_id=criterion, attempted=attempted
+            )
+        return audit
+
+    def get_scheduler(self, severity_intervals="1:6"):
+        with mock.patch.dict(os.environ, {"CSW_AUDIT_SEVERITY_INTERVALS": severity_intervals}):
+            return AuditScheduler(self.app, self.now)
+
+    def test_get_interval(self):
+        scheduler = self.get_scheduler("1:6,2:12")
+        self.assertEqual(scheduler.get_interval(self.frequent), 6)
+        self.assertEqual(scheduler.get_interval(self.daily), 24)
+        self.daily.audit_interval_hours = 48
+        self.assertEqual(scheduler.get_interval(self.daily), 48)
+
+    def test_invalid_intervals_are_ignored(self):
+        scheduler = self.get_scheduler("1:0,2:-6,3:x,4:12")
+        self.assertEqual(scheduler.severity_intervals, {4: 12})
+        self.frequent.audit_interval_hours = 0
+        self.assertEqual(scheduler.get_interval(self.frequent), 24)
+        self.assertEqual(len(scheduler.get_due(self.accounts[:1], self.criteria)[0][2]), 2)
+
+    def test_plan_spreads_accounts(self):
+        scheduler = self.get_scheduler("")
+        # 8 accounts x 2 daily criteria over 96 slots
+        planned, expected = scheduler.plan(self.accounts, self.criteria)
+        self.assertEqual(expected, 1)
+        self.assertEqual(len(planned), 1)
+        self.assertEqual(planned[0][1], self.criteria)
+
+    def test_plan_due_criteria(self):
+        scheduler = self.get_scheduler()
+        for account in self.accounts:
+            models.AccountLatestAudit.create(
+                account_subscription_id=account,
+                account_audit_id=self.create_audit(account, 2, self.criteria),
+            )
+        self.create_audit(self.accounts[3], 7, self.criteria)
+        self.assertEqual(scheduler.plan(self.accounts, self.criteria)[0], [])
+
+        # only the 6 hourly criterion is due 7 hours after the last audit
+        models.AccountLatestAudit.delete().execute()
+        models.AuditCriterion.delete().execute()
+        models.AccountAudit.delete().execute()
+        models.AccountLatestAudit.create(
+            account_subscription_id=self.accounts[3],
+            account_audit_id=self.create_audit(self.accounts[3], 7, self.criteria),
+        )
+        due = scheduler.get_due(self.accounts[3:4], self.criteria)
+        self.assertEqual(due[0][2], [self.frequent])
+
+    def test_full_audit_when_latest_audit_is_old(self):
+        scheduler = self.get_scheduler()
+        models.AccountLatestAudit.create(
+            account_subscription_id=self.accounts[0],
+            account_audit_id=self.create_audit(self.accounts[0], 30, self.criteria),
+        )
+        # partial audits ran the criteria at different times since
+        self.create_audit(self.accounts[0], 7, [self.frequent])
+        self.create_audit(self.accounts[0], 5, [self.daily])
+        due = scheduler.get_due(self.accounts[:1], self.criteria)
+        self.assertEqual(due[0][2], self.criteria)
+
+    def test_plan_priority(self):
+        scheduler = self.get_scheduler("")
+        for index, account in enumerate(self.accounts):
+            audit = self.create_audit(
+                account, 30 + index, self.criteria, processed=index != 2
+            )
+            models.AccountLatestAudit.create(
+                account_subscription_id=account, account_audit_id=audit
+            )
+        due = scheduler.get_due(self.accounts, self.criteria)
+        # the incomplete audit first then the oldest
+        self.assertEqual(
+            [account.id for priority, account, criteria in due[:3]],
+            [self.accounts[2].id, self.accounts[7].id, self.accounts[6].id],
+        )
+
+    def test_stale_unfinished_audit(self):
+        scheduler = self.get_scheduler("")
+        self.create_audit(self.accounts[0], 1, self.criteria, attempted=False)
+        self.create_audit(self.accounts[1], 4, self.criteria, attempted=False)
+        due = scheduler.get_due(self.accounts[:2], self.criteria)
+        # the audit still running is not repeated
+        self.assertEqual([account.id for priority, account, criteria in due], [self.accounts[1].id])
+
+    def test_get_load_curve(self):
+        scheduler = self.get_scheduler("")
+        self.create_audit(self.accounts[0], 1, self.criteria)
+        self.create_audit(self.accounts[1], 1, self.criteria[:1])
+        self.create_audit(self.accounts[2], 30, self.criteria)
+        curve = scheduler.get_load_curve(self.accounts, self.criteria)
+        self.assertEqual(len(curve), 96)
+        self.assertEqual(curve[0]["expected"], 1)
+        self.assertEqual(curve[92]["slot_start"], self.now - timedelta(hours=1))
+        self.assertEqual(curve[92]["actual"], 3)
+        self.assertEqual(sum(slot["actual"] for slot in curve), 3)
@@ -0,0 +1,131 @@
+import copy
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import app
+from chalicelib import models
+from chalicelib.aws.gds_aws_client import GdsAwsClient
+from chalicelib.aws.gds_ec2_security_group_client import GdsEc2SecurityGroupClient
+from chalicelib.timing import AuditTimer
+from tests.chalicelib.criteria.test_data import EGRESS_RESTRICTION, SESSION
+from tests.chalicelib.test_audit import SECURITY_GROUP_CRITERIA, FakeSqs, audit
+from tests.chalicelib.test_database_default import TestDatabaseDefault
+
+
+class FakeSqsRecord:
+    def __init__(self, sent_timestamp):
+        self.sent_timestamp = sent_timestamp
+
+    def to_dict(self):
+        return {"attributes": {"SentTimestamp": str(self.sent_timestamp)}}
+
+
+class TestAuditTimer(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditTimer, self).setUp()
+        self.account = self.create_account()
+        self.audit = models.AccountAudit.create(account_subscription_id=self.account)
+        self.criterion = self.create_criterion("timed")
+
+    def test_span_and_flush(self):
+        clock = mock.Mock(side_effect=[1.0, 1.25])
+        timer = AuditTimer(app, self.audit.id, clock=clock)
+        with timer.span("evaluate", self.criterion.id, "eu-west-2"):
+            pass
+        timer.record_queue_wait(FakeSqsRecord(int(time.time() * 1000) - 5000))
+        self.assertEqual(timer.flush(), 2)
+        self.assertEqual(timer.flush(), 0)
+
+        timing = models.AuditTiming.get(models.AuditTiming.stage == "evaluate")
+        self.assertEqual(timing.duration_ms, 250)
+        self.assertEqual(timing.criterion_id.id, self.criterion.id)
+        self.assertEqual(timing.region, "eu-west-2")
+        queue_wait = models.AuditTiming.get(models.AuditTiming.stage == "queue_wait")
+        self.assertGreaterEqual(queue_wait.duration_ms, 5000)
+        self.assertIsNone(queue_wait.criterion_id)
+
+    def test_flush_errors_are_logged(self):
+        timer = AuditTimer(app, self.audit.id)
+        timer.record("evaluate", 1.0)
+        with mock.patch.object(
+            models.AuditTiming, "insert_many", side_effect=Exception("database gone")
+        ):
+            self.assertEqual(timer.flush(), 0)
+
+    def test_get_percentiles(self):
+        other = models.AccountAudit.create(
+            account_subscription_id=self.create_account(210987654321, "other")
+        )
+        for duration in range(1, 101):
+            models.AuditTiming.create(
+                account_audit_id=self.audit,
+                criterion_id=self.criterion,
+                stage="get_data",
+                duration_ms=duration,
+            )
+        models.AuditTiming.create(
+            account_audit_id=other, criterion_id=self.criterion, stage="get_data", duration_ms=500
+        )
+        models.AuditTiming.create(
+            account_audit_id=other,
+            stage="queue_wait",
+            duration_ms=1000,
+            date_recorded=datetime.now() - timedelta(days=2),
+        )
+        since = datetime.now() - timedelta(days=1)
+
+        criteria = models.AuditTiming.get_percentiles(since, "criterion")
+        self.assertEqual(len(criteria), 1)
+        self.assertEqual(criteria[0]["criterion_name"], "timed")
+        self.assertEqual(criteria[0]["count"], 101)
+        self.assertEqual(criteria[0]["p50"], 51)
+        self.assertEqual(criteria[0]["p95"], 96)
+
+        accounts = models.AuditTiming.get_percentiles(since, "account")
+        # the slowest account first
+        self.assertEqual(
+            [(account["account_name"], account["p95"]) for account in accounts],
+            [("other", 500), ("test-account", 95)],
+        )
+
+
+class TestAuditTimings(TestDatabaseDefault):
+    def setUp(self):
+        super(TestAuditTimings, self).setUp()
+        for status in ["Not checked", "Pass", "Fail", "Exception"]:
+            models.Status.create(status_name=status, description=status)
+        self.audit = models.AccountAudit.create(account_subscription_id=self.create_account())
+        criteria = [
+            self.create_criterion(class_name.split(".")[-1], class_name)
+            for class_name in SECURITY_GROUP_CRITERIA[:2]
+        ]
+        self.audit_criteria = models.AuditCriterion.create_batch(self.audit, criteria)
+
+    def test_evaluate_records_stages(self):
+        message_data = audit.group_by_data_source(self.audit_criteria)[0]
+        security_groups = EGRESS_RESTRICTION["pass"]["SecurityGroups"]
+        timer = AuditTimer(app, self.audit.id)
+        with mock.patch.object(
+            GdsAwsClient, "get_chained_session", return_value=SESSION
+        ), mock.patch.object(
+            audit, "get_account_regions", return_value=["eu-west-1", "eu-west-2"]
+        ), mock.patch.object(
+            GdsEc2SecurityGroupClient,
+            "describe_security_groups",
+            side_effect=lambda session, **params: copy.deepcopy(security_groups),
+        ):
+            audit.evaluate_audit_criteria(FakeSqs(), "queue", message_data, timer)
+        timer.flush()
+
+        stages = {}
+        for timing in models.AuditTiming.select():
+            stages.setdefault(timing.stage, []).append(timing)
+        self.assertEqual(len(stages["assume_role"]), 1)
+        # the shared data is collected once per region
+        self.assertEqual(
+            sorted(timing.region for timing in stages["get_data"]), ["eu-west-1", "eu-west-2"]
+        )
+        # each criterion is evaluated and written for each region
+        self.assertEqual(len(stages["evaluate"]), 4)
+        self.assertEqual(len(stages["db_write"]), 4)